@@ -0,0 +1,181 @@
+"""
+Continuous, time-windowed anomaly detection.
+
+PacketAnalyzer.detect_anomalies looks at a finite capture as a whole. The
+WindowedAnomalyDetector is meant for 24/7 live capture instead: time is cut
+into buckets of `slide` seconds and every detector looks at the last
+`window` seconds (tumbling windows when slide == window, sliding windows when
+slide < window). Counters are updated per packet, so an alert fires as soon
+as a threshold is crossed, and state that has aged out of the window or
+exceeded the idle TTL is evicted whenever a new bucket starts, keeping memory
+proportional to the traffic seen in one window.
+"""
+import math
+from datetime import datetime
+
+from .fields import extract_fields
+
+
+class WindowedAnomalyDetector:
+    def __init__(self, window=60, slide=None, volume_threshold=100, port_scan_threshold=10,
+                 ddos_threshold=50, flow_ttl=None, on_alert=None):
+        """
+        Initialize the detector
+        :param window: Window length in seconds
+        :param slide: Bucket length in seconds (defaults to window, i.e. tumbling windows)
+        :param volume_threshold: Alert when a flow sends more packets than this within a window
+        :param port_scan_threshold: Alert when a source probes more distinct TCP ports than this
+        :param ddos_threshold: Alert when more distinct sources than this hit one destination
+        :param flow_ttl: Evict flows idle for this many seconds (defaults to window)
+        :param on_alert: Optional callback invoked with every alert dict
+        """
+        self.window = window
+        self.slide = slide or window
+        self.volume_threshold = volume_threshold
+        self.port_scan_threshold = port_scan_threshold
+        self.ddos_threshold = ddos_threshold
+        self.on_alert = on_alert
+        self._span = max(1, math.ceil(window / self.slide))
+        self._ttl_span = max(1, math.ceil((flow_ttl or window) / self.slide))
+
+        self._bucket = None
+        # flow -> {bucket: packet count}
+        self._flow_counts = {}
+        # src -> {dst port: last bucket seen}
+        self._ports = {}
+        # dst -> {src: last bucket seen}
+        self._sources = {}
+        # (alert type, key) -> bucket of last alert
+        self._alerted = {}
+        self.evicted = 0
+
+    def _oldest(self, bucket):
+        """First bucket still inside the window ending at `bucket`"""
+        return bucket - self._span + 1
+
+    def _alert(self, kind, key, count, timestamp, bucket):
+        last = self._alerted.get((kind, key))
+        if last is not None and last >= self._oldest(bucket):
+            return None
+        self._alerted[(kind, key)] = bucket
+        alert = {
+            'type': kind,
+            'key': key,
+            'count': count,
+            'timestamp': datetime.fromtimestamp(timestamp),
+            'window': self.window
+        }
+        if self.on_alert is not None:
+            self.on_alert(alert)
+        return alert
+
+    def _distinct(self, table, key, member, bucket, threshold):
+        """Record member under key; return the in-window distinct count if above threshold"""
+        members = table.get(key)
+        if members is None:
+            members = table[key] = {}
+        members[member] = bucket
+        if len(members) <= threshold:
+            return None
+        # Only prune stale members once the raw count crosses the threshold
+        oldest = self._oldest(bucket)
+        for stale in [m for m, seen in members.items() if seen < oldest]:
+            del members[stale]
+        return len(members) if len(members) > threshold else None
+
+    def update(self, fields):
+        """
+        Fold one packet into the windows
+        :param fields: PacketFields read from the packet by extract_fields
+        :return: List of alerts fired by this packet
+        """
+        if fields.src is None:
+            return []
+        timestamp = fields.timestamp.timestamp()
+        bucket = int(timestamp // self.slide)
+        if self._bucket is None or bucket > self._bucket:
+            self._bucket = bucket
+            self.sweep()
+        alerts = []
+
+        # High volume flows
+        flow = (fields.src, fields.dst)
+        counts = self._flow_counts.get(flow)
+        if counts is None:
+            counts = self._flow_counts[flow] = {}
+        counts[bucket] = counts.get(bucket, 0) + 1
+        oldest = self._oldest(bucket)
+        total = sum(count for seen, count in counts.items() if seen >= oldest)
+        if total > self.volume_threshold:
+            alerts.append(self._alert('high_volume', flow, total, timestamp, bucket))
+
+        # Port scans
+        if fields.is_tcp:
+            count = self._distinct(self._ports, fields.src, fields.dstport, bucket, self.port_scan_threshold)
+            if count is not None:
+                alerts.append(self._alert('port_scan', fields.src, count, timestamp, bucket))
+
+        # Many sources converging on one destination
+        count = self._distinct(self._sources, fields.dst, fields.src, bucket, self.ddos_threshold)
+        if count is not None:
+            alerts.append(self._alert('possible_ddos', fields.dst, count, timestamp, bucket))
+
+        return [alert for alert in alerts if alert is not None]
+
+    def process_packet(self, packet):
+        """
+        Fold one packet into the windows
+        :param packet: Packet to analyze
+        :return: List of alerts fired by this packet
+        """
+        try:
+            return self.update(extract_fields(packet))
+        except AttributeError:
+            return []
+
+    def monitor(self, packets):
+        """
+        Run the detector over a (possibly endless) packet stream
+        :param packets: Iterable of packets, e.g. PacketCapture.iter_live_capture()
+        :return: Generator of alerts as they fire
+        """
+        for packet in packets:
+            yield from self.process_packet(packet)
+
+    def sweep(self):
+        """Evict buckets, port/source entries and flows that fell out of the window or TTL"""
+        if self._bucket is None:
+            return
+        oldest = self._oldest(self._bucket)
+        idle_before = self._bucket - self._ttl_span + 1
+
+        for flow in list(self._flow_counts):
+            counts = self._flow_counts[flow]
+            newest = max(counts)
+            if newest < idle_before:
+                del self._flow_counts[flow]
+                self.evicted += 1
+                continue
+            # The newest bucket is kept even when stale, as the flow's last-seen marker
+            for seen in [seen for seen in counts if seen < oldest and seen != newest]:
+                del counts[seen]
+
+        for table in (self._ports, self._sources):
+            for key in list(table):
+                members = table[key]
+                for stale in [m for m, seen in members.items() if seen < oldest]:
+                    del members[stale]
+                if not members:
+                    del table[key]
+                    self.evicted += 1
+
+        for alerted in [k for k, seen in self._alerted.items() if seen < oldest]:
+            del self._alerted[alerted]
+
+    def state_size(self):
+        """Number of flows, scanning sources and targeted destinations currently tracked"""
+        return {
+            'flows': len(self._flow_counts),
+            'sources': len(self._ports),
+            'destinations': len(self._sources)
+        }
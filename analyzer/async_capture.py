@@ -0,0 +1,163 @@
+"""
+Asynchronous capture-while-analyzing pipeline.
+
+A producer task reads packets from the capture (tshark's output stream via
+PacketCapture.aiter_live_capture, or any iterable) into a bounded
+asyncio.Queue while a consumer task drains the queue into the analyzers.
+Analysis therefore overlaps with capture instead of waiting for sniff() to
+finish: the consumer hands control back to the event loop every
+``yield_every`` packets, so the producer keeps reading while a backlog is
+being analyzed. When analysis falls behind, the 'block' policy stops reading from
+tshark (backpressure pushes back to the capture buffers), while the 'drop'
+policy discards packets and counts them so latency stays steady.
+"""
+import asyncio
+import time
+
+from .engine import AnalysisEngine
+
+POLICIES = ('drop', 'block')
+
+_DONE = object()
+
+
+class AsyncCapturePipeline:
+    def __init__(self, consumers=None, queue_size=10000, policy='block', metrics=None, yield_every=64):
+        """
+        Initialize the pipeline
+        :param consumers: Callables invoked with every packet, e.g. engine.process_packet or
+                          detector.process_packet (defaults to a new AnalysisEngine)
+        :param queue_size: Maximum number of packets waiting for analysis
+        :param policy: 'block' to pause capture or 'drop' to discard packets when the queue is full
+        :param metrics: Metrics receiving queue wait times, the queue depth gauge and drop
+                        counts (also passed to the default AnalysisEngine)
+        :param yield_every: Packets analyzed before the consumer lets the producer run again
+        """
+        if yield_every < 1:
+            raise ValueError(f"yield_every must be at least 1, got {yield_every!r}")
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy {policy!r}, expected one of {POLICIES}")
+        if consumers is None:
+            self.engine = AnalysisEngine(metrics=metrics)
+            consumers = [self.engine.process_packet]
+        self.consumers = list(consumers)
+        self.queue_size = queue_size
+        self.policy = policy
+        self.yield_every = yield_every
+        self.stats = {
+            'queued': 0,
+            'dropped': 0,
+            'processed': 0,
+            'max_queue_depth': 0,
+            'max_latency': 0.0,
+            'total_latency': 0.0
+        }
+        self._queue = None
+        self._stopping = False
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.register_gauge('queue_depth', lambda: self.queue_depth, queue='capture')
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def get_stats(self):
+        """Counters plus current queue depth and mean queue latency in seconds"""
+        stats = dict(self.stats)
+        stats['queue_depth'] = self.queue_depth
+        stats['mean_latency'] = stats['total_latency'] / stats['processed'] if stats['processed'] else 0.0
+        return stats
+
+    def stop(self):
+        """Ask the producer to stop reading; queued packets are still analyzed"""
+        self._stopping = True
+
+    async def _produce(self, source):
+        queue = self._queue
+        stats = self.stats
+        if hasattr(source, '__aiter__'):
+            try:
+                async for packet in source:
+                    if self._stopping:
+                        break
+                    await self._enqueue(queue, stats, packet)
+            finally:
+                if hasattr(source, 'aclose'):
+                    await source.aclose()
+        else:
+            try:
+                for packet in source:
+                    if self._stopping:
+                        break
+                    await self._enqueue(queue, stats, packet)
+                    # Give the consumer a chance to run between packets of a synchronous source
+                    await asyncio.sleep(0)
+            finally:
+                if hasattr(source, 'close'):
+                    source.close()
+        await queue.put(_DONE)
+
+    async def _enqueue(self, queue, stats, packet):
+        item = (time.monotonic(), packet)
+        if self.policy == 'block':
+            await queue.put(item)
+        else:
+            try:
+                queue.put_nowait(item)
+            except asyncio.QueueFull:
+                stats['dropped'] += 1
+                if self.metrics is not None:
+                    self.metrics.count('dropped_packets_total', reason='queue_full')
+                return
+        stats['queued'] += 1
+        depth = queue.qsize()
+        if depth > stats['max_queue_depth']:
+            stats['max_queue_depth'] = depth
+
+    async def _consume(self):
+        queue = self._queue
+        stats = self.stats
+        consumers = self.consumers
+        until_yield = self.yield_every
+        while True:
+            # queue.get() does not suspend while the queue is non-empty: without this the
+            # whole backlog would be analyzed before the producer could read another packet
+            until_yield -= 1
+            if not until_yield:
+                until_yield = self.yield_every
+                await asyncio.sleep(0)
+            item = await queue.get()
+            if item is _DONE:
+                break
+            enqueued, packet = item
+            latency = time.monotonic() - enqueued
+            stats['total_latency'] += latency
+            if latency > stats['max_latency']:
+                stats['max_latency'] = latency
+            if self.metrics is not None:
+                self.metrics.observe('queue', int(latency * 1e9))
+            for consumer in consumers:
+                consumer(packet)
+            stats['processed'] += 1
+
+    async def run(self, source):
+        """
+        Capture and analyze until the source is exhausted or stop() is called
+        :param source: Async iterable (e.g. PacketCapture.aiter_live_capture()) or iterable of packets
+        :return: Pipeline statistics
+        :raises: The first exception raised by the source or a consumer, after the other
+                 side has been cancelled and the source closed
+        """
+        self._stopping = False
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        tasks = [asyncio.ensure_future(self._produce(source)), asyncio.ensure_future(self._consume())]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # gather() does not cancel the survivor when one side fails: a producer blocked
+            # on a full queue would otherwise keep the capture running
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return self.get_stats()
@@ -0,0 +1,282 @@
+"""
+Raw-byte pre-filter for capture files using a subset of BPF (tcpdump) syntax.
+
+For live captures BPF filters are compiled by libpcap and run in the kernel.
+Capture files have no such stage, so this module compiles the common filter
+primitives to a Python predicate that inspects the link, IP and transport
+headers of a raw frame with struct, before any packet is decoded or dissected.
+
+Supported grammar:
+    primitive : [src|dst] host ADDR | [src|dst] net CIDR
+              | [src|dst] port N | [src|dst] portrange N-M
+              | tcp | udp | icmp | icmp6 | ip | ip6 | arp
+    expr      : primitive | not expr | ! expr | ( expr )
+              | expr and expr | expr && expr | expr or expr | expr || expr
+Juxtaposed primitives are joined with 'and', and 'and'/'or' have equal
+precedence, left to right, as in tcpdump. A protocol before a qualified
+primitive restricts it ('tcp port 80'), and a bare value repeats the last
+qualifiers: 'port 80 or 443' is 'port 80 or port 443', 'tcp dst port 22 or 23'
+is 'tcp dst port 22 or tcp dst port 23'.
+"""
+import ipaddress
+import mmap
+import re
+import socket
+import struct
+
+from .dpkt_reader import _network_offset, ETH_TYPE_IP, ETH_TYPE_IP6, DLT_EN10MB
+
+ETH_TYPE_ARP = 0x0806
+PROTOCOLS = {'tcp': 6, 'udp': 17, 'icmp': 1, 'icmp6': 58}
+PORT_PROTOCOLS = (6, 17, 132)
+
+QUALIFIERS = ('src', 'dst', 'host', 'net', 'port', 'portrange')
+_PROTOCOL_TESTS = {name: (lambda proto: lambda h: h.proto == proto)(proto)
+                   for name, proto in PROTOCOLS.items()}
+_PROTOCOL_TESTS.update({
+    'ip': lambda h: h.ethertype == ETH_TYPE_IP,
+    'ip6': lambda h: h.ethertype == ETH_TYPE_IP6,
+    'arp': lambda h: h.ethertype == ETH_TYPE_ARP
+})
+
+_TOKEN = re.compile(r'\s*(\(|\)|!|&&|\|\||[^\s()!&|]+)')
+_unpack_ports = struct.Struct('!HH').unpack_from
+
+
+class BPFSyntaxError(ValueError):
+    pass
+
+
+class _Header:
+    """Header fields of one raw frame that filter primitives test against"""
+    __slots__ = ('ethertype', 'proto', 'src', 'dst', 'sport', 'dport')
+
+
+def parse_headers(buf, linktype=DLT_EN10MB):
+    """
+    Read the link, network and transport header fields of a raw frame
+    :return: _Header (fields that are absent are None)
+    """
+    header = _Header()
+    header.proto = header.src = header.dst = header.sport = header.dport = None
+    located = _network_offset(buf, linktype)
+    if located is None:
+        header.ethertype = None
+        return header
+    offset, header.ethertype = located
+    if header.ethertype == ETH_TYPE_IP:
+        header.proto = buf[offset + 9]
+        header.src = buf[offset + 12:offset + 16]
+        header.dst = buf[offset + 16:offset + 20]
+        fragment_offset = struct.unpack_from('!H', buf, offset + 6)[0] & 0x1FFF
+        l4 = offset + (buf[offset] & 0x0F) * 4
+        if fragment_offset:
+            return header
+    elif header.ethertype == ETH_TYPE_IP6:
+        header.proto = buf[offset + 6]
+        header.src = buf[offset + 8:offset + 24]
+        header.dst = buf[offset + 24:offset + 40]
+        l4 = offset + 40
+    else:
+        return header
+    if header.proto in PORT_PROTOCOLS and len(buf) >= l4 + 4:
+        header.sport, header.dport = _unpack_ports(buf, l4)
+    return header
+
+
+def _address_test(direction, network):
+    """Build a predicate matching an address or network in the given direction"""
+    length = 4 if network.version == 4 else 16
+    base = network.network_address.packed
+    if network.prefixlen == network.max_prefixlen:
+        match = lambda address: address == base
+    else:
+        mask = int(network.netmask)
+        value = int(network.network_address)
+        match = lambda address: (len(address) == length
+                                 and int.from_bytes(address, 'big') & mask == value)
+    if direction == 'src':
+        return lambda h: h.src is not None and match(h.src)
+    if direction == 'dst':
+        return lambda h: h.dst is not None and match(h.dst)
+    return lambda h: h.src is not None and (match(h.src) or match(h.dst))
+
+
+def _port_test(direction, low, high):
+    if direction == 'src':
+        return lambda h: h.sport is not None and low <= h.sport <= high
+    if direction == 'dst':
+        return lambda h: h.dport is not None and low <= h.dport <= high
+    return lambda h: h.sport is not None and (low <= h.sport <= high or low <= h.dport <= high)
+
+
+class _Parser:
+    def __init__(self, expression):
+        self.tokens = _TOKEN.findall(expression)
+        if ''.join(self.tokens) != re.sub(r'\s+', '', expression):
+            raise BPFSyntaxError(f"Cannot tokenize filter {expression!r}")
+        self.position = 0
+        # (protocol test, direction, keyword) of the last qualified primitive
+        self.qualifiers = None
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        if token is None:
+            raise BPFSyntaxError("Unexpected end of filter expression")
+        self.position += 1
+        return token
+
+    def parse(self):
+        predicate = self.parse_expression()
+        if self.peek() is not None:
+            raise BPFSyntaxError(f"Unexpected token {self.peek()!r}")
+        return predicate
+
+    def parse_expression(self):
+        # pcap-filter(7): 'and' and 'or' have equal precedence and associate to the left;
+        # juxtaposed primitives ('tcp port 80') are an implicit 'and'
+        left = self.parse_not()
+        while self.peek() not in (None, ')'):
+            if self.peek() in ('or', '||'):
+                self.take()
+                right = self.parse_not()
+                left = (lambda a, b: lambda h: a(h) or b(h))(left, right)
+                continue
+            if self.peek() in ('and', '&&'):
+                self.take()
+            right = self.parse_not()
+            left = (lambda a, b: lambda h: a(h) and b(h))(left, right)
+        return left
+
+    def parse_not(self):
+        if self.peek() in ('not', '!'):
+            self.take()
+            inner = self.parse_not()
+            return lambda h: not inner(h)
+        if self.peek() == '(':
+            self.take()
+            inner = self.parse_expression()
+            if self.take() != ')':
+                raise BPFSyntaxError("Missing closing parenthesis")
+            return inner
+        return self.parse_primitive()
+
+    def parse_primitive(self):
+        token = self.take()
+        protocol = _PROTOCOL_TESTS.get(token)
+        if protocol is not None:
+            if self.peek() not in QUALIFIERS:
+                return protocol
+            # 'tcp port 80': the protocol qualifies the primitive that follows
+            return self.parse_qualified(self.take(), protocol)
+        if token in QUALIFIERS:
+            return self.parse_qualified(token, None)
+        if self.qualifiers is not None:
+            # pcap-filter(7): a bare value reuses the last qualifiers ('port 80 or 443')
+            return self.build(*self.qualifiers, token)
+        raise BPFSyntaxError(f"Unsupported filter primitive {token!r}")
+
+    def parse_qualified(self, token, protocol):
+        direction = None
+        if token in ('src', 'dst'):
+            direction = token
+            token = self.take()
+        if token not in ('host', 'net', 'port', 'portrange'):
+            raise BPFSyntaxError(f"Unsupported filter primitive {token!r}")
+        self.qualifiers = (protocol, direction, token)
+        return self.build(protocol, direction, token, self.take())
+
+    @staticmethod
+    def build(protocol, direction, keyword, value):
+        if keyword in ('host', 'net'):
+            try:
+                network = ipaddress.ip_network(value, strict=False)
+            except ValueError:
+                raise BPFSyntaxError(f"Invalid address {value!r}")
+            test = _address_test(direction, network)
+        else:
+            try:
+                if keyword == 'portrange':
+                    low, high = (int(part) for part in value.split('-'))
+                else:
+                    low = high = int(value) if value.isdigit() else socket.getservbyname(value)
+            except (ValueError, OSError):
+                raise BPFSyntaxError(f"Invalid port {value!r}")
+            test = _port_test(direction, low, high)
+        if protocol is None:
+            return test
+        return lambda h: protocol(h) and test(h)
+
+
+def compile_filter(expression, linktype=DLT_EN10MB):
+    """
+    Compile a BPF expression into a predicate over raw frames
+    :param expression: Filter expression, e.g. 'tcp and (port 80 or port 443)'
+    :param linktype: Link-layer type of the frames
+    :return: Callable taking raw frame bytes and returning True to keep the frame
+    :raises BPFSyntaxError: If the expression uses unsupported syntax
+    """
+    predicate = _Parser(expression).parse()
+
+    def matches(buf):
+        try:
+            return predicate(parse_headers(buf, linktype))
+        except (IndexError, struct.error):
+            return False
+
+    return matches
+
+
+def _pcap_header(linktype):
+    """Global header of a little-endian nanosecond-resolution pcap file"""
+    return struct.pack('<IHHiIII', 0xA1B23C4D, 2, 4, 0, 0, 262144, linktype)
+
+
+def filter_pcap(pcap_file, output_file, expression):
+    """
+    Copy the frames of a capture file that match a BPF expression to a new pcap file,
+    keeping their original timestamps and lengths (pcap records are copied verbatim,
+    pcapng packets are written with nanosecond timestamps)
+    :param pcap_file: Path to the pcap or pcapng file to read
+    :param output_file: Path of the pcap file to write
+    :param expression: Filter expression
+    :return: Number of frames written
+    """
+    from .pcap_index import PCAP_MAGIC, PCAPNG_BYTE_ORDER, iter_records
+
+    written = 0
+    with open(pcap_file, 'rb') as src, open(output_file, 'wb') as dst, \
+            mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        records, linktypes = iter_records(data)
+        if bytes(data[:4]) in PCAP_MAGIC:
+            dst.write(data[:24])
+            matches = compile_filter(expression, linktypes[0])
+            for frame, caplen, _, _, end in records:
+                if matches(data[frame:frame + caplen]):
+                    # Record header (ts_sec, ts_usec/ts_nsec, caplen, len) and frame
+                    dst.write(data[frame - 16:end])
+                    written += 1
+            return written
+
+        endian = '<' if struct.unpack_from('<I', data, 8)[0] == PCAPNG_BYTE_ORDER else '>'
+        filters = {}
+        for frame, caplen, timestamp_ns, interface, _ in records:
+            linktype = linktypes[interface]
+            if not filters:
+                dst.write(_pcap_header(linktype))
+            matches = filters.get(linktype)
+            if matches is None:
+                matches = filters[linktype] = compile_filter(expression, linktype)
+            buf = data[frame:frame + caplen]
+            if matches(buf):
+                # Enhanced and simple packet blocks store the original length just before the frame
+                original = struct.unpack_from(endian + 'I', data, frame - 4)[0]
+                dst.write(struct.pack('<IIII', *divmod(timestamp_ns, 1000000000), caplen, original))
+                dst.write(buf)
+                written += 1
+        if not filters:
+            dst.write(_pcap_header(linktypes[0] if linktypes else DLT_EN10MB))
+    return written
@@ -0,0 +1,223 @@
+"""
+Persistent, incremental analysis cache.
+
+Reporting jobs re-analyze the same rotated captures day after day although
+most of them have not changed. ResultCache keeps the AnalysisEngine built
+for every capture file on disk, keyed by the file's path and the analysis
+configuration, together with a fingerprint of the file and the byte offset
+the analysis reached:
+
+* unchanged file: the cached engine is returned without reading the file;
+* file that grew (a capture still being written, or appended to): the
+  cached engine resumes from the stored offset, so only the new packets are
+  decoded;
+* anything else (rewritten, truncated, different configuration): the file
+  is analyzed from the start and the entry replaced.
+
+Files are fingerprinted by size and modification time plus hashes of the
+first and of the last cached bytes ('stat', cheap), or by a SHA-256 of the
+whole analyzed prefix ('content', reads the file but never decodes it).
+"""
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from .bpf import compile_filter
+from .dpkt_reader import decode_packet
+from .engine import AnalysisEngine
+from .pcap_index import iter_records
+
+FINGERPRINTS = ('stat', 'content')
+CACHE_VERSION = 1
+# Bytes hashed at the start of a file and just before the cached offset in 'stat' mode
+SAMPLE_SIZE = 1 << 16
+
+
+def _factory_name(engine_factory):
+    return f"{getattr(engine_factory, '__module__', '')}.{getattr(engine_factory, '__qualname__', repr(engine_factory))}"
+
+
+def _digest(data, start, stop):
+    return hashlib.sha256(data[start:stop]).hexdigest()
+
+
+def _content_digest(data, stop):
+    digest = hashlib.sha256()
+    for position in range(0, stop, 1 << 24):
+        digest.update(data[position:min(position + (1 << 24), stop)])
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, directory, engine_factory=AnalysisEngine, config=None, fingerprint='stat',
+                 bpf_filter=None):
+        """
+        Open (or create) a cache directory
+        :param directory: Directory holding the cache entries
+        :param engine_factory: Picklable callable returning a fresh AnalysisEngine
+        :param config: JSON-serializable description of anything the factory's results depend
+                       on that its name does not capture (e.g. thresholds read from a config file)
+        :param fingerprint: 'stat' (size, mtime and sampled hashes) or 'content' (full SHA-256)
+        :param bpf_filter: BPF expression restricting the analyzed packets
+        """
+        if fingerprint not in FINGERPRINTS:
+            raise ValueError(f"Unknown fingerprint {fingerprint!r}, expected one of {FINGERPRINTS}")
+        self.directory = directory
+        self.engine_factory = engine_factory
+        self.config = config
+        self.fingerprint = fingerprint
+        self.bpf_filter = bpf_filter
+        self.config_key = hashlib.sha256(json.dumps({
+            'version': CACHE_VERSION,
+            'factory': _factory_name(engine_factory),
+            'config': config,
+            'bpf_filter': bpf_filter
+        }, sort_keys=True, default=str).encode()).hexdigest()
+        self.stats = {'hits': 0, 'resumed': 0, 'misses': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def entry_path(self, pcap_file):
+        """Path of the cache entry for a capture file under this configuration"""
+        key = hashlib.sha256(f"{self.config_key}\0{os.path.abspath(pcap_file)}".encode()).hexdigest()
+        return os.path.join(self.directory, key[:32] + '.pkl')
+
+    def _load(self, pcap_file):
+        try:
+            with open(self.entry_path(pcap_file), 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+        if entry.get('version') != CACHE_VERSION or entry.get('config_key') != self.config_key:
+            return None
+        return entry
+
+    def _store(self, pcap_file, entry):
+        """Write an entry atomically, so concurrent readers never see a partial file"""
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self.entry_path(pcap_file))
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    def _prefix_matches(self, entry, data, size):
+        """Whether the first entry['offset'] bytes of the file are the ones analyzed before"""
+        offset = entry['offset']
+        if size < offset:
+            return False
+        if self.fingerprint == 'content':
+            return _content_digest(data, offset) == entry['digest']
+        return (_digest(data, 0, min(offset, SAMPLE_SIZE)) == entry['head'] and
+                _digest(data, max(0, offset - SAMPLE_SIZE), offset) == entry['tail'])
+
+    def analyze(self, pcap_file):
+        """
+        Analysis results of one capture file, reusing and extending the cached results
+        :param pcap_file: Path to a pcap or pcapng file
+        :return: AnalysisEngine for the file (shared with the cache: merge it into another
+                 engine rather than modifying it)
+        """
+        status, engine = self._refresh(pcap_file)
+        self.stats[status] += 1
+        return engine
+
+    def _refresh(self, pcap_file):
+        """
+        Bring one file's entry up to date
+        :return: Tuple of (status, engine) where status is 'hits', 'resumed' or 'misses'
+        """
+        stat = os.stat(pcap_file)
+        entry = self._load(pcap_file)
+        if entry is not None and self.fingerprint == 'stat' and \
+                (stat.st_size, stat.st_mtime_ns) == (entry['size'], entry['mtime_ns']):
+            return 'hits', entry['engine']
+        if not stat.st_size:
+            return 'misses', self.engine_factory()
+
+        with open(pcap_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if entry is not None and self._prefix_matches(entry, data, stat.st_size):
+                if stat.st_size == entry['offset'] or stat.st_size == entry['size']:
+                    status = 'hits'
+                else:
+                    status = 'resumed'
+                engine, offset = entry['engine'], entry['offset']
+            else:
+                status, engine, offset = 'misses', self.engine_factory(), 0
+
+            if status != 'hits' or stat.st_size != entry['size']:
+                offset = self._process(engine, data, offset)
+                self._store(pcap_file, {
+                    'version': CACHE_VERSION,
+                    'config_key': self.config_key,
+                    'path': os.path.abspath(pcap_file),
+                    'size': stat.st_size,
+                    'mtime_ns': stat.st_mtime_ns,
+                    'offset': offset,
+                    'head': _digest(data, 0, min(offset, SAMPLE_SIZE)),
+                    'tail': _digest(data, max(0, offset - SAMPLE_SIZE), offset),
+                    'digest': _content_digest(data, offset) if self.fingerprint == 'content' else None,
+                    'engine': engine
+                })
+        return status, engine
+
+    def _process(self, engine, data, offset):
+        """
+        Feed the records at and after a byte offset to an engine
+        :return: Byte offset just past the last complete record
+        """
+        records, linktypes = iter_records(data, offset)
+        filters = {}
+        for frame, caplen, timestamp_ns, interface, end in records:
+            buf = data[frame:frame + caplen]
+            linktype = linktypes[interface]
+            if self.bpf_filter:
+                matches = filters.get(linktype)
+                if matches is None:
+                    matches = filters[linktype] = compile_filter(self.bpf_filter, linktype)
+                if not matches(buf):
+                    offset = end
+                    continue
+            engine.process_packet(decode_packet(timestamp_ns / 1e9, buf, linktype))
+            offset = end
+        return offset
+
+    def analyze_files(self, pcap_files, workers=1):
+        """
+        Analysis results of several capture files, merged
+        :param pcap_files: Paths of capture files
+        :param workers: Number of processes refreshing out-of-date entries
+        :return: New AnalysisEngine holding the merged results
+        """
+        result = self.engine_factory()
+        pcap_files = list(pcap_files)
+        if workers > 1 and len(pcap_files) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(pcap_files))) as executor:
+                outcomes = list(executor.map(self._refresh, pcap_files))
+        else:
+            outcomes = [self._refresh(pcap_file) for pcap_file in pcap_files]
+        for status, engine in outcomes:
+            self.stats[status] += 1
+            result.merge(engine)
+        return result
+
+    def invalidate(self, pcap_file=None):
+        """
+        Drop cache entries
+        :param pcap_file: File whose entry to drop (None drops every entry in the directory)
+        """
+        if pcap_file is not None:
+            paths = [self.entry_path(pcap_file)]
+        else:
+            paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                     if name.endswith('.pkl')]
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
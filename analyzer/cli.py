@@ -0,0 +1,131 @@
+"""
+Command line interface: capture or read packets, analyze them and write a
+JSON report.
+
+Usage:
+    python -m analyzer.cli --interface eth0 --count 200 --output report.json
+    python -m analyzer.cli --read capture.pcap --filter 'tcp port 443' --top 20
+
+Capture files are decoded with the dpkt reader; live captures use pyshark
+(tshark). The CLI imports only what the chosen path needs: reading a file
+never imports pyshark, and no path imports matplotlib, pandas or numpy.
+Progress messages go to stderr so the report can be piped from stdout.
+"""
+import argparse
+import json
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from itertools import islice
+
+from .engine import AnalysisEngine
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    return str(value)
+
+
+def build_report(engine, top_n=10, threshold=100, ddos_threshold=50):
+    """
+    Summarize an analysis as a JSON-serializable dict
+    :param engine: AnalysisEngine holding the results
+    :param top_n: Number of entries in the top IP, port, conversation, host and query lists
+    :param threshold: Packet count above which a flow is reported as high volume
+    :param ddos_threshold: Distinct source count above which a destination is reported
+    :return: Report dict
+    """
+    dpi = engine.dpi
+    conversations = sorted(engine.get_conversation_stats().items(), key=lambda item: item[1],
+                           reverse=True)[:top_n]
+    anomalies = engine.get_anomalies(threshold, ddos_threshold)
+    return {
+        'packets': engine.packet_count,
+        'protocols': engine.get_protocol_statistics(),
+        'top_ips': dpi.get_ip_statistics(top_n),
+        'top_ports': dpi.get_port_statistics(top_n),
+        'top_conversations': [{'hosts': list(hosts), 'packets': count} for hosts, count in conversations],
+        'http': dpi.get_http_statistics(top_n),
+        'dns': dpi.get_dns_statistics(top_n),
+        'dissectors': dpi.get_dissector_statistics(top_n),
+        'anomalies': {
+            'high_volume_flows': anomalies['high_volume_flows'],
+            'port_scans': dict(anomalies['port_scans']),
+            'possible_ddos': anomalies['possible_ddos']
+        }
+    }
+
+
+def _packets(args):
+    """Packet source selected by the arguments"""
+    if args.read:
+        from .dpkt_reader import read_pcap
+        # --count limits the packets analyzed, i.e. those passing the filter, as in tcpdump
+        return islice(read_pcap(args.read, bpf_filter=args.filter), args.count)
+    from .packet_capture import PacketCapture
+    capture = PacketCapture(args.interface, args.display_filter, backend='pyshark', bpf_filter=args.filter)
+    return capture.iter_live_capture(packet_count=args.count, timeout=args.timeout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m analyzer.cli',
+                                     description="Capture or read packets and write a JSON analysis report")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('-i', '--interface', help="Interface to capture from (defaults to the first one)")
+    source.add_argument('-r', '--read', metavar='PCAP', help="Capture file to analyze instead of capturing")
+    parser.add_argument('-c', '--count', type=int, help="Stop after this many packets")
+    parser.add_argument('-t', '--timeout', type=float, help="Stop a live capture after this many seconds")
+    parser.add_argument('-f', '--filter', help="BPF filter, e.g. 'tcp port 80'")
+    parser.add_argument('--display-filter', help="Wireshark display filter (live captures only)")
+    parser.add_argument('--top', type=int, default=10, help="Length of the top-N lists")
+    parser.add_argument('--threshold', type=int, default=100, help="High volume flow packet count")
+    parser.add_argument('--ddos-threshold', type=int, default=50, help="Distinct sources per target")
+    parser.add_argument('-o', '--output', default='-', help="Report path ('-' writes to stdout)")
+    args = parser.parse_args(argv)
+    if args.read and args.display_filter:
+        parser.error("--display-filter requires a live capture")
+
+    # Unreadable files, invalid filters (BPFSyntaxError is a ValueError) and truncated captures
+    errors = (OSError, ValueError)
+    if args.read:
+        import dpkt
+        errors += (dpkt.Error,)
+
+    engine = AnalysisEngine()
+    started = time.perf_counter()
+    # Keep stdout for the report: capture progress messages go to stderr
+    with redirect_stdout(sys.stderr):
+        try:
+            engine.run(_packets(args))
+        except KeyboardInterrupt:
+            print("Capture interrupted, reporting the packets seen so far")
+        except errors as e:
+            print(f"Error: {e or type(e).__name__}")
+            return 1
+    elapsed = time.perf_counter() - started
+
+    report = {
+        'source': {'pcap': args.read} if args.read else {'interface': args.interface},
+        'filter': args.filter,
+        'elapsed_seconds': round(elapsed, 3),
+        'packets_per_second': round(engine.packet_count / elapsed) if elapsed else None
+    }
+    report.update(build_report(engine, args.top, args.threshold, args.ddos_threshold))
+    text = json.dumps(report, indent=2, default=_json_default)
+    if args.output == '-':
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+        print(f"Report written to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
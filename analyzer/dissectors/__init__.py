@@ -0,0 +1,134 @@
+"""
+Pluggable application-layer dissectors.
+
+DPIAnalyzer dispatches packets to dissectors through two lookup tables built
+from a DissectorRegistry: one keyed by layer name, used for backends that
+deliver named layers (pyshark: ``packet.layers[i].layer_name``), and one
+keyed by transport and port, used for backends that only deliver the raw
+transport payload (the dpkt reader). A packet therefore costs one dict lookup
+per layer (or one or two per packet for ports) however many dissectors are
+registered.
+
+Dissectors are registered as "module:attribute" strings and the module is
+only imported when its protocol first appears in the traffic, so adding
+dissectors does not slow down startup either. A dissector is a class (or
+other zero-argument factory) whose instances provide:
+
+* ``fields``: names of the values it extracts, stored by DPIAnalyzer in a
+  RecordStore named after the dissector
+* ``counted``: optional subset of ``fields`` whose most frequent values are
+  reported by DPIAnalyzer.get_dissector_statistics
+* ``from_layer(layer)``: tuple of values from a pyshark layer, or None
+* ``from_payload(payload)``: tuple of values from raw payload bytes, or None
+
+Example::
+
+    from analyzer.dissectors import register_dissector
+    register_dissector('ssh', 'mypackage.ssh:SSHDissector', layers=('ssh',), ports=(22,),
+                       transport='tcp')
+"""
+import importlib
+
+TRANSPORTS = ('tcp', 'udp')
+
+
+def to_int(value):
+    """Parse a decimal or 0x-prefixed field value, None if it is not a number"""
+    try:
+        return int(value, 0) if isinstance(value, str) else int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class DissectorSpec:
+    __slots__ = ('name', 'target', 'layers', 'ports', 'transport', 'dissector')
+
+    def __init__(self, name, target, layers=(), ports=(), transport=None):
+        self.name = name
+        self.target = target
+        self.layers = tuple(layers)
+        self.ports = tuple(str(port) for port in ports)
+        self.transport = transport
+        self.dissector = None
+
+    def load(self):
+        """Import and instantiate the dissector on first use"""
+        if self.dissector is None:
+            factory = self.target
+            if isinstance(factory, str):
+                module, _, attribute = factory.partition(':')
+                factory = getattr(importlib.import_module(module), attribute)
+            self.dissector = factory()
+        return self.dissector
+
+    def __getstate__(self):
+        # Loaded dissectors are recreated on demand after unpickling
+        return {name: getattr(self, name) for name in self.__slots__ if name != 'dissector'}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.dissector = None
+
+    def __repr__(self):
+        return f"<DissectorSpec {self.name} {self.target!r}>"
+
+
+class DissectorRegistry:
+    def __init__(self):
+        self.specs = {}
+
+    def register(self, name, target, layers=(), ports=(), transport=None):
+        """
+        Register (or replace) a dissector
+        :param name: Dissector name, also the name of its record store
+        :param target: "module:attribute" import path of the dissector class (imported on first
+                       use), or the class itself
+        :param layers: pyshark layer names handled by the dissector
+        :param ports: Ports whose raw payload is handed to the dissector (either direction)
+        :param transport: 'tcp' or 'udp'; required when ports are given
+        """
+        if ports and transport not in TRANSPORTS:
+            raise ValueError(f"Unknown transport {transport!r}, expected one of {TRANSPORTS}")
+        self.specs[name] = DissectorSpec(name, target, layers, ports, transport)
+
+    def unregister(self, name):
+        self.specs.pop(name, None)
+
+    def get(self, name):
+        """Loaded dissector instance of a registered name"""
+        return self.specs[name].load()
+
+    @property
+    def loaded(self):
+        """Names of the dissectors imported so far"""
+        return [name for name, spec in self.specs.items() if spec.dissector is not None]
+
+    def layer_table(self):
+        """Dict of layer name -> dissector name (the first registration of a layer wins)"""
+        table = {}
+        for spec in self.specs.values():
+            for layer in spec.layers:
+                table.setdefault(layer, spec.name)
+        return table
+
+    def port_tables(self):
+        """Dict of transport ('TCP'/'UDP', as in packet.transport_layer) -> {port: dissector name}"""
+        tables = {}
+        for spec in self.specs.values():
+            if spec.ports:
+                table = tables.setdefault(spec.transport.upper(), {})
+                for port in spec.ports:
+                    table.setdefault(port, spec.name)
+        return tables
+
+
+DEFAULT_REGISTRY = DissectorRegistry()
+register_dissector = DEFAULT_REGISTRY.register
+
+register_dissector('tls', 'analyzer.dissectors.tls:TLSDissector', layers=('tls', 'ssl'),
+                   ports=(443, 465, 636, 853, 993, 995, 8443), transport='tcp')
+register_dissector('quic', 'analyzer.dissectors.quic:QUICDissector', layers=('quic',),
+                   ports=(443,), transport='udp')
+register_dissector('smb', 'analyzer.dissectors.smb:SMBDissector', layers=('smb', 'smb2'),
+                   ports=(139, 445), transport='tcp')
@@ -0,0 +1,55 @@
+"""
+QUIC dissector: version, packet type and destination connection ID of
+long-header packets (handshake traffic; short-header packets carry neither
+a version nor a type and are ignored). The server name inside QUIC Initial
+packets is encrypted and is not extracted.
+"""
+import struct
+
+from . import to_int
+
+QUIC_V1 = 0x00000001
+QUIC_V2 = 0x6b3343cf
+VERSIONS = {QUIC_V1: 'QUIC v1', QUIC_V2: 'QUIC v2'}
+# Long packet types in QUIC v1 bit order (v2 rotates the values by one)
+PACKET_TYPES = ('Initial', '0-RTT', 'Handshake', 'Retry')
+MAX_CID_LENGTH = 20
+
+
+def version_name(version):
+    if version == 0:
+        return 'negotiation'
+    return VERSIONS.get(version, f'0x{version:08x}')
+
+
+def packet_type(version, bits):
+    if version == 0:
+        return 'Version Negotiation'
+    if version == QUIC_V2:
+        bits = (bits - 1) % 4
+    return PACKET_TYPES[bits]
+
+
+class QUICDissector:
+    fields = ('version', 'packet_type', 'dcid')
+    counted = ('version',)
+
+    def from_payload(self, payload):
+        if len(payload) < 7 or not payload[0] & 0x80:
+            return None
+        version = struct.unpack_from('!I', payload, 1)[0]
+        length = payload[5]
+        if length > MAX_CID_LENGTH or len(payload) < 6 + length:
+            return None
+        return (version_name(version), packet_type(version, (payload[0] >> 4) & 3),
+                bytes(payload[6:6 + length]).hex())
+
+    def from_layer(self, layer):
+        if to_int(getattr(layer, 'header_form', None)) != 1:
+            return None
+        version = to_int(getattr(layer, 'version', None))
+        bits = to_int(getattr(layer, 'long_packet_type', None))
+        if version is None or bits is None:
+            return None
+        return (version_name(version), packet_type(version, bits & 3),
+                str(getattr(layer, 'dcid', '')).replace(':', ''))
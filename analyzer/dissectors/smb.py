@@ -0,0 +1,62 @@
+"""
+SMB dissector: dialect, command, NT status and direction of SMB1 and
+SMB2/3 messages carried over NetBIOS session service framing (ports 139
+and 445). Encrypted SMB3 messages only reveal that they are encrypted.
+"""
+import struct
+
+from . import to_int
+
+SMB1_MAGIC = b'\xffSMB'
+SMB2_MAGIC = b'\xfeSMB'
+SMB3_TRANSFORM_MAGIC = b'\xfdSMB'
+
+SMB2_COMMANDS = ('NEGOTIATE', 'SESSION_SETUP', 'LOGOFF', 'TREE_CONNECT', 'TREE_DISCONNECT', 'CREATE',
+                 'CLOSE', 'FLUSH', 'READ', 'WRITE', 'LOCK', 'IOCTL', 'CANCEL', 'ECHO',
+                 'QUERY_DIRECTORY', 'CHANGE_NOTIFY', 'QUERY_INFO', 'SET_INFO', 'OPLOCK_BREAK')
+SMB1_COMMANDS = {0x04: 'CLOSE', 0x25: 'TRANSACTION', 0x2b: 'ECHO', 0x2e: 'READ_ANDX', 0x2f: 'WRITE_ANDX',
+                 0x32: 'TRANSACTION2', 0x71: 'TREE_DISCONNECT', 0x72: 'NEGOTIATE',
+                 0x73: 'SESSION_SETUP_ANDX', 0x74: 'LOGOFF_ANDX', 0x75: 'TREE_CONNECT_ANDX',
+                 0xa0: 'NT_TRANSACT', 0xa2: 'NT_CREATE_ANDX'}
+SMB2_FLAGS_SERVER_TO_REDIR = 0x00000001
+SMB1_FLAGS_REPLY = 0x80
+
+
+def command_name(dialect, command):
+    if dialect == 'SMB1':
+        return SMB1_COMMANDS.get(command, f'0x{command:02x}')
+    return SMB2_COMMANDS[command] if command < len(SMB2_COMMANDS) else f'0x{command:04x}'
+
+
+class SMBDissector:
+    fields = ('dialect', 'command', 'status', 'response')
+    counted = ('command',)
+
+    def from_payload(self, payload):
+        # NetBIOS session message: type 0 and a 24-bit length, then the SMB header
+        if len(payload) < 14 or payload[0] != 0:
+            return None
+        magic = bytes(payload[4:8])
+        if magic == SMB2_MAGIC and len(payload) >= 24:
+            status, command = struct.unpack_from('<IH', payload, 12)
+            flags = struct.unpack_from('<I', payload, 20)[0]
+            return ('SMB2', command_name('SMB2', command), f'0x{status:08x}',
+                    bool(flags & SMB2_FLAGS_SERVER_TO_REDIR))
+        if magic == SMB1_MAGIC:
+            command = payload[8]
+            status = struct.unpack_from('<I', payload, 9)[0]
+            return ('SMB1', command_name('SMB1', command), f'0x{status:08x}',
+                    bool(payload[13] & SMB1_FLAGS_REPLY))
+        if magic == SMB3_TRANSFORM_MAGIC:
+            return 'SMB3', 'ENCRYPTED', '', False
+        return None
+
+    def from_layer(self, layer):
+        dialect = 'SMB2' if getattr(layer, 'layer_name', 'smb2') == 'smb2' else 'SMB1'
+        command = to_int(getattr(layer, 'cmd', None))
+        if command is None:
+            return None
+        status = to_int(getattr(layer, 'nt_status', None))
+        response = str(getattr(layer, 'flags_response', '')) in ('1', 'True')
+        return (dialect, command_name(dialect, command), f'0x{status:08x}' if status is not None else '',
+                response)
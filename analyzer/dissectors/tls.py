@@ -0,0 +1,91 @@
+"""
+TLS dissector: server name (SNI), negotiated-version offer and ALPN
+protocols of ClientHello messages.
+
+Raw payloads are parsed directly from the first TCP segment of the hello;
+extensions cut off by the segment boundary are skipped.
+"""
+import struct
+
+from . import to_int
+
+VERSIONS = {0x0300: 'SSL 3.0', 0x0301: 'TLS 1.0', 0x0302: 'TLS 1.1', 0x0303: 'TLS 1.2', 0x0304: 'TLS 1.3'}
+
+CONTENT_HANDSHAKE = 0x16
+HANDSHAKE_CLIENT_HELLO = 0x01
+EXT_SERVER_NAME = 0
+EXT_ALPN = 16
+EXT_SUPPORTED_VERSIONS = 43
+
+_unpack_short = struct.Struct('!H').unpack_from
+
+
+def version_name(version):
+    return VERSIONS.get(version, f'0x{version:04x}')
+
+
+def parse_client_hello(data):
+    """
+    Read a TLS record holding a ClientHello
+    :param data: Payload bytes starting with the TLS record header
+    :return: Tuple of (sni, version, alpn), or None if the payload is not a ClientHello
+    """
+    if len(data) < 9 or data[0] != CONTENT_HANDSHAKE or data[5] != HANDSHAKE_CLIENT_HELLO:
+        return None
+    end = min(len(data), 5 + _unpack_short(data, 3)[0])
+    sni = alpn = ''
+    try:
+        # Record header (5), handshake type and length (4), client version, random (32)
+        version = _unpack_short(data, 9)[0]
+        position = 43
+        position += 1 + data[position]
+        position += 2 + _unpack_short(data, position)[0]
+        position += 1 + data[position]
+        if position + 2 > end:
+            return sni, version_name(version), alpn
+        extensions_end = min(end, position + 2 + _unpack_short(data, position)[0])
+        position += 2
+        while position + 4 <= extensions_end:
+            kind, length = struct.unpack_from('!HH', data, position)
+            body = data[position + 4:position + 4 + length]
+            position += 4 + length
+            if kind == EXT_SERVER_NAME and len(body) >= 5 and body[2] == 0:
+                sni = body[5:5 + _unpack_short(body, 3)[0]].decode('ascii', 'replace')
+            elif kind == EXT_ALPN and len(body) >= 2:
+                protocols = []
+                index, stop = 2, min(len(body), 2 + _unpack_short(body, 0)[0])
+                while index < stop:
+                    protocols.append(body[index + 1:index + 1 + body[index]].decode('ascii', 'replace'))
+                    index += 1 + body[index]
+                alpn = ','.join(protocols)
+            elif kind == EXT_SUPPORTED_VERSIONS and body:
+                # Ignore GREASE values; the highest known offer is the version in use
+                offered = [_unpack_short(body, index)[0]
+                           for index in range(1, min(len(body), 1 + body[0]) - 1, 2)]
+                known = [value for value in offered if value in VERSIONS]
+                if known:
+                    version = max(known)
+    except (IndexError, struct.error):
+        return None
+    return sni, version_name(version), alpn
+
+
+class TLSDissector:
+    fields = ('sni', 'version', 'alpn')
+    counted = ('sni',)
+
+    def from_payload(self, payload):
+        # Most segments on TLS ports are application data; reject them before copying
+        if payload[0] != CONTENT_HANDSHAKE:
+            return None
+        return parse_client_hello(bytes(payload))
+
+    def from_layer(self, layer):
+        if to_int(getattr(layer, 'handshake_type', None)) != HANDSHAKE_CLIENT_HELLO:
+            return None
+        version = to_int(getattr(layer, 'handshake_extensions_supported_version', None))
+        if version is None:
+            version = to_int(getattr(layer, 'handshake_version', None))
+        return (str(getattr(layer, 'handshake_extensions_server_name', '')),
+                version_name(version) if version is not None else '',
+                str(getattr(layer, 'handshake_extensions_alpn_str', '')))
@@ -0,0 +1,484 @@
+"""
+Sharded capture across interfaces, processes and sensor nodes.
+
+Each worker captures from one source (an interface, or a capture file),
+analyzes the packets it owns with its own AnalysisEngine and, every
+``interval`` seconds, ships what it analyzed since the previous shipment
+(a delta: a fresh engine's worth of results, pickled and zlib-compressed)
+to an Aggregator. The aggregator merges every delta into one global
+AnalysisEngine with AnalysisEngine.merge, so its view matches a single
+engine that had seen all the traffic. Like such an engine, it keeps only
+the newest records and timeline entries (see bounded_engine); deltas newer
+than what it holds are appended to them rather than merged and re-sorted.
+
+Several workers can share one busy source: each is given a partition
+number and keeps only the flows that hash to it (CRC-32 of the flow's
+endpoints in canonical order, so both directions of a connection land on
+the same worker). Workers reading a capture file hash the raw headers and
+decode only their own frames, so adding workers splits the decoding and
+the analysis. On a live interface every worker's tshark still dissects
+every packet: there, partitioning splits only the analysis cost, and
+capacity grows by giving workers separate interfaces or sensors.
+
+Workers and the aggregator talk over multiprocessing.connection sockets,
+which authenticate both ends with a shared key (HMAC challenge) before
+any data is unpickled; only run workers you trust with the key. Workers
+on other nodes connect to the aggregator's TCP address:
+
+    python -m analyzer.distributed aggregate --listen 0.0.0.0:7500 --workers 2 --output report.json
+    python -m analyzer.distributed worker --connect collector:7500 --source eth1
+
+Traffic seen on more than one source (e.g. both span ports of a link) is
+counted once per source: give overlapping sources to one partition group
+instead.
+"""
+import argparse
+import json
+import mmap
+import os
+import pickle
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+from multiprocessing import AuthenticationError, Process
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge
+
+from .bpf import compile_filter, parse_headers
+from .dpi_engine import DPIAnalyzer
+from .dpkt_reader import DLT_EN10MB, decode_packet
+from .engine import AnalysisEngine
+from .fields import extract_fields
+
+AUTHKEY_ENV = 'ANALYZER_AUTHKEY'
+# HTTP/DNS records kept by the aggregator's global view (older ones are dropped)
+MAX_RECORDS = 100000
+# Seconds run_sharded waits for final deltas after its workers exited
+FINAL_DELTA_TIMEOUT = 60.0
+# IP protocol numbers of TCP and UDP
+PORT_TRANSPORTS = (6, 17)
+
+
+def _partition(src, srcport, dst, dstport, partitions):
+    a = f'{src}:{srcport}'
+    b = f'{dst}:{dstport}'
+    key = f'{a}|{b}' if a < b else f'{b}|{a}'
+    return zlib.crc32(key.encode()) % partitions
+
+
+def flow_partition(fields, partitions):
+    """
+    Partition owning a packet's flow
+    :param fields: PacketFields of the packet
+    :param partitions: Number of partitions
+    :return: Partition index; packets without an IP layer belong to partition 0
+    """
+    if fields.src is None:
+        return 0
+    return _partition(fields.src, fields.srcport, fields.dst, fields.dstport, partitions)
+
+
+def frame_partition(buf, partitions, linktype=DLT_EN10MB):
+    """
+    Partition owning a raw frame's flow, read from its headers without decoding it
+    (the same partition flow_partition gives the decoded packet)
+    :param buf: Raw frame bytes
+    :param partitions: Number of partitions
+    :param linktype: Link-layer type of the frame
+    :return: Partition index; frames without an IP layer belong to partition 0
+    """
+    try:
+        header = parse_headers(buf, linktype)
+    except (IndexError, struct.error):
+        return 0
+    if header.src is None:
+        return 0
+    family = socket.AF_INET if len(header.src) == 4 else socket.AF_INET6
+    # PacketFields only carries TCP and UDP ports
+    srcport, dstport = (header.sport, header.dport) if header.proto in PORT_TRANSPORTS else (None, None)
+    return _partition(socket.inet_ntop(family, header.src), srcport,
+                      socket.inet_ntop(family, header.dst), dstport, partitions)
+
+
+def bounded_engine():
+    """
+    AnalysisEngine keeping at most MAX_RECORDS records and the default timeline size, so
+    the aggregator's memory and per-delta merge cost stay flat however long workers run
+    """
+    return AnalysisEngine(dpi=DPIAnalyzer(max_records=MAX_RECORDS))
+
+
+def encode_delta(message):
+    return zlib.compress(pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def decode_delta(data):
+    return pickle.loads(zlib.decompress(data))
+
+
+def open_source(source, packet_count=None, bpf_filter=None, timeout=None):
+    """
+    Packets of a source
+    :param source: Path of a capture file (read with dpkt) or an interface name (live
+                   capture with pyshark)
+    :param packet_count: Stop after this many packets
+    :param bpf_filter: BPF filter
+    :param timeout: Stop a live capture after this many seconds
+    :return: Iterable of packets
+    """
+    if os.path.isfile(source):
+        from .dpkt_reader import read_pcap
+        return read_pcap(source, stop=packet_count, bpf_filter=bpf_filter)
+    from .packet_capture import PacketCapture
+    capture = PacketCapture(source, backend='pyshark', bpf_filter=bpf_filter)
+    return capture.iter_live_capture(packet_count=packet_count, timeout=timeout)
+
+
+class ShardWorker:
+    def __init__(self, address, authkey, name=None, partition=0, partitions=1, interval=10.0,
+                 engine_factory=AnalysisEngine):
+        """
+        Connect a worker to an aggregator and start shipping deltas every interval
+        :param address: Aggregator address, (host, port) or a Unix socket path
+        :param authkey: Shared key (bytes)
+        :param name: Worker name reported to the aggregator (defaults to host:pid)
+        :param partition: Flow partition owned by this worker
+        :param partitions: Number of workers sharing the source
+        :param interval: Seconds between delta shipments, sent even when no packet arrived
+        :param engine_factory: Picklable callable returning a fresh AnalysisEngine
+        """
+        if not 0 <= partition < partitions:
+            raise ValueError(f"Partition {partition} out of range for {partitions} partitions")
+        if interval <= 0:
+            raise ValueError(f"Interval must be positive, got {interval!r}")
+        self.connection = Client(address, authkey=authkey)
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.partition = partition
+        self.partitions = partitions
+        self.interval = interval
+        self.engine_factory = engine_factory
+        self.engine = engine_factory()
+        self.sequence = 0
+        self.skipped = 0
+        self.bytes_sent = 0
+        # Held while a packet is analyzed and while the engine is swapped for a fresh one
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._timer = threading.Thread(target=self._ship_periodically, name=f'{self.name} deltas',
+                                       daemon=True)
+        self._timer.start()
+
+    def _ship_periodically(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Error shipping delta to aggregator: {e}")
+                return
+
+    def process_packet(self, packet):
+        """Analyze a packet if its flow belongs to this worker"""
+        try:
+            fields = extract_fields(packet)
+        except AttributeError:
+            return
+        if self.partitions > 1 and flow_partition(fields, self.partitions) != self.partition:
+            self.skipped += 1
+            return
+        with self._lock:
+            self.engine.process_fields(packet, fields)
+
+    def run(self, packets):
+        """Analyze packets until exhausted, then ship the final delta and disconnect"""
+        try:
+            for packet in packets:
+                self.process_packet(packet)
+        finally:
+            self.close()
+        return self
+
+    def run_file(self, pcap_file, packet_count=None, bpf_filter=None):
+        """
+        Analyze this worker's flows of a capture file, then ship the final delta and
+        disconnect; frames of other partitions are skipped before they are decoded
+        :param pcap_file: Path to a pcap or pcapng file
+        :param packet_count: Stop after this many records of the file
+        :param bpf_filter: BPF filter applied to the raw frames
+        """
+        from .pcap_index import iter_records
+
+        try:
+            with open(pcap_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                records, linktypes = iter_records(data)
+                filters = {}
+                for number, (frame, caplen, timestamp_ns, interface, _) in enumerate(records):
+                    if packet_count is not None and number >= packet_count:
+                        break
+                    linktype = linktypes[interface]
+                    buf = data[frame:frame + caplen]
+                    if bpf_filter:
+                        matches = filters.get(linktype)
+                        if matches is None:
+                            matches = filters[linktype] = compile_filter(bpf_filter, linktype)
+                        if not matches(buf):
+                            continue
+                    if self.partitions > 1 and frame_partition(buf, self.partitions, linktype) != self.partition:
+                        self.skipped += 1
+                        continue
+                    packet = decode_packet(timestamp_ns / 1e9, buf, linktype)
+                    with self._lock:
+                        self.engine.process_packet(packet)
+        finally:
+            self.close()
+        return self
+
+    def flush(self, final=False):
+        """Ship the results gathered since the last shipment and start a fresh delta"""
+        with self._lock:
+            delta = self.engine
+            if not final:
+                self.engine = self.engine_factory()
+                # State that must keep matching later packets stays with the worker
+                self.engine.dpi.dns_stats.carry_pending(delta.dpi.dns_stats)
+                if delta.dpi.reassembler is not None:
+                    self.engine.dpi.reassembler, delta.dpi.reassembler = delta.dpi.reassembler, None
+        data = encode_delta({
+            'worker': self.name,
+            'sequence': self.sequence,
+            'final': final,
+            'skipped': self.skipped,
+            'engine': delta
+        })
+        self.connection.send_bytes(data)
+        self.bytes_sent += len(data)
+        self.sequence += 1
+
+    def close(self):
+        """Stop the periodic shipments, ship the final delta and disconnect"""
+        if self.connection is not None:
+            self._stop.set()
+            self._timer.join()
+            self.flush(final=True)
+            self.connection.close()
+            self.connection = None
+
+
+def run_worker(source, address, authkey, name=None, partition=0, partitions=1, interval=10.0,
+               packet_count=None, bpf_filter=None, timeout=None, engine_factory=AnalysisEngine):
+    """
+    Worker process entry point: capture from a source and ship deltas to an aggregator
+    (see open_source and ShardWorker for the arguments)
+    :return: Number of deltas shipped
+    """
+    worker = ShardWorker(address, authkey, name or f"{source}#{partition}", partition, partitions,
+                         interval, engine_factory)
+    if os.path.isfile(source):
+        worker.run_file(source, packet_count, bpf_filter)
+    else:
+        worker.run(open_source(source, packet_count, bpf_filter, timeout))
+    return worker.sequence
+
+
+class Aggregator:
+    def __init__(self, address=('127.0.0.1', 0), authkey=None, engine_factory=bounded_engine):
+        """
+        Start accepting worker connections in the background
+        :param address: Address to listen on, (host, port) or a Unix socket path (port 0
+                        picks a free one, see self.address)
+        :param authkey: Shared key (bytes); a random one is generated if omitted
+        :param engine_factory: Callable returning the AnalysisEngine holding the global view
+        """
+        self.authkey = authkey or os.urandom(32)
+        # Connections authenticate in their own thread (see _serve), so a peer that stalls
+        # or drops during the handshake cannot hold up the accept loop
+        self.listener = Listener(address)
+        self.address = self.listener.address
+        self.engine = engine_factory()
+        # name -> {'deltas', 'packets', 'skipped', 'bytes', 'last_seen', 'final'}
+        self.workers = {}
+        self._lock = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._accept, name='aggregator', daemon=True)
+        self._thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                connection = self.listener.accept()
+            except (AuthenticationError, EOFError, OSError):
+                # Only close() ends the loop: a failed connection (port scan, health
+                # check) must not stop workers from connecting
+                if self._closed:
+                    break
+                continue
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        with connection:
+            try:
+                deliver_challenge(connection, self.authkey)
+                answer_challenge(connection, self.authkey)
+            except (AuthenticationError, EOFError, OSError):
+                return
+            while True:
+                try:
+                    data = connection.recv_bytes()
+                except (EOFError, OSError):
+                    return
+                self.receive(data)
+
+    def receive(self, data):
+        """Merge one encoded delta into the global view"""
+        message = decode_delta(data)
+        delta = message['engine']
+        with self._lock:
+            self.engine.merge(delta)
+            stats = self.workers.setdefault(message['worker'], {
+                'deltas': 0, 'packets': 0, 'skipped': 0, 'bytes': 0, 'last_seen': None, 'final': False})
+            stats['deltas'] += 1
+            stats['packets'] += delta.packet_count
+            stats['skipped'] = message['skipped']
+            stats['bytes'] += len(data)
+            stats['last_seen'] = time.time()
+            stats['final'] = stats['final'] or message['final']
+            self._lock.notify_all()
+
+    def report(self, top_n=10, threshold=100, ddos_threshold=50):
+        """Consistent JSON-serializable summary of the global view (see cli.build_report)"""
+        from .cli import build_report
+
+        with self._lock:
+            report = build_report(self.engine, top_n, threshold, ddos_threshold)
+            report['workers'] = {name: dict(stats) for name, stats in self.workers.items()}
+        return report
+
+    def wait(self, workers, timeout=None):
+        """
+        Wait for workers to ship their final delta
+        :param workers: Number of workers, or iterable of worker names, to wait for
+        :param timeout: Seconds to wait at most (None waits indefinitely)
+        :return: True if they all finished in time
+        """
+        def finished():
+            done = [name for name, stats in self.workers.items() if stats['final']]
+            if isinstance(workers, int):
+                return len(done) >= workers
+            return set(workers) <= set(done)
+
+        with self._lock:
+            return self._lock.wait_for(finished, timeout)
+
+    def close(self):
+        self._closed = True
+        self.listener.close()
+
+
+def run_sharded(sources, workers_per_source=1, packet_count=None, bpf_filter=None, interval=10.0,
+                timeout=None, engine_factory=bounded_engine):
+    """
+    Analyze several sources on this box, one worker process per source and partition
+    :param sources: Interface names and/or capture file paths
+    :param workers_per_source: Worker processes splitting each source's flows between them
+    :param packet_count: Stop each worker after this many packets of its source
+    :param bpf_filter: BPF filter applied by every worker
+    :param interval: Seconds between delta shipments
+    :param timeout: Stop live captures after this many seconds
+    :param engine_factory: Picklable callable returning a fresh AnalysisEngine, for the
+                           workers and the aggregator
+    :return: Aggregator holding the merged results (closed; see aggregator.engine and report())
+    :raises RuntimeError: If a worker exits with an error or its final delta does not arrive
+    """
+    aggregator = Aggregator(engine_factory=engine_factory)
+    processes = []
+    try:
+        for source in sources:
+            for partition in range(workers_per_source):
+                processes.append(Process(
+                    target=run_worker, name=f"{source}#{partition}",
+                    args=(source, aggregator.address, aggregator.authkey, f"{source}#{partition}",
+                          partition, workers_per_source, interval, packet_count, bpf_filter, timeout,
+                          engine_factory),
+                    daemon=True))
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        failed = [f"{process.name} (exit code {process.exitcode})" for process in processes
+                  if process.exitcode]
+        if not aggregator.wait([process.name for process in processes],
+                               timeout=0 if failed else FINAL_DELTA_TIMEOUT):
+            failed += [f"{name} (no final delta)" for name in
+                       (process.name for process in processes if not process.exitcode)
+                       if not aggregator.workers.get(name, {}).get('final')]
+    finally:
+        aggregator.close()
+    if failed:
+        raise RuntimeError(f"Workers failed, results are incomplete: {', '.join(failed)}")
+    return aggregator
+
+
+def _address(value):
+    host, sep, port = value.rpartition(':')
+    return (host or '127.0.0.1', int(port)) if sep else value
+
+
+def _authkey(path):
+    if path:
+        with open(path, 'rb') as f:
+            return f.read().strip()
+    key = os.environ.get(AUTHKEY_ENV)
+    if not key:
+        sys.exit(f"Set {AUTHKEY_ENV} or pass --authkey-file")
+    return key.encode()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m analyzer.distributed',
+                                     description="Distributed capture workers and result aggregator")
+    parser.add_argument('--authkey-file', help=f"File holding the shared key (default: ${AUTHKEY_ENV})")
+    commands = parser.add_subparsers(dest='command', required=True)
+    aggregate = commands.add_parser('aggregate', help="Collect and merge worker deltas")
+    aggregate.add_argument('--listen', default='127.0.0.1:7500', help="host:port or Unix socket path")
+    aggregate.add_argument('--workers', type=int, required=True, help="Workers to wait for")
+    aggregate.add_argument('--top', type=int, default=10)
+    aggregate.add_argument('-o', '--output', default='-', help="Report path ('-' writes to stdout)")
+    worker = commands.add_parser('worker', help="Capture from a source and ship deltas")
+    worker.add_argument('--connect', required=True, help="Aggregator host:port or Unix socket path")
+    worker.add_argument('--source', required=True, help="Interface name or capture file")
+    worker.add_argument('--partition', type=int, default=0)
+    worker.add_argument('--partitions', type=int, default=1)
+    worker.add_argument('--interval', type=float, default=10.0, help="Seconds between deltas")
+    worker.add_argument('-c', '--count', type=int)
+    worker.add_argument('-f', '--filter', help="BPF filter")
+    worker.add_argument('--name')
+    args = parser.parse_args(argv)
+    authkey = _authkey(args.authkey_file)
+
+    if args.command == 'worker':
+        run_worker(args.source, _address(args.connect), authkey, args.name, args.partition,
+                   args.partitions, args.interval, args.count, args.filter)
+        return 0
+
+    aggregator = Aggregator(_address(args.listen), authkey)
+    print(f"Listening on {aggregator.address}", file=sys.stderr)
+    try:
+        aggregator.wait(args.workers)
+    except KeyboardInterrupt:
+        print("Interrupted, reporting the deltas received so far", file=sys.stderr)
+    finally:
+        aggregator.close()
+    from .cli import _json_default
+
+    text = json.dumps(aggregator.report(args.top), indent=2, default=_json_default)
+    if args.output == '-':
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,77 +1,376 @@
-from collections import defaultdict
-import dpkt
-import socket
+from collections import defaultdict, deque
+import heapq
+import os
+from .dissectors import DEFAULT_REGISTRY, to_int
+from .fields import extract_fields
+from .reassembly import TCPReassembler, tcp_segment
+from .records import DNS_FIELDS, HTTP_FIELDS, DNSAggregates, RecordStore, to_epoch
+from .signatures import SignatureEngine, payload_bytes
+from .sketches import SpaceSaving
+from .utils import aggregate_subnets, merge_ordered
+
+# Packet classes from these packages expose their dissected layers as packet.layers
+LAYERED_MODULES = ('pyshark',)
+
 
 class DPIAnalyzer:
-    def __init__(self):
+    def __init__(self, max_records=None, sketch_capacity=None, signatures=None, reassemble=False,
+                 spill_dir=None, dissectors=None):
+        """
+        Initialize the DPI engine
+        :param max_records: Keep only the most recent N HTTP/DNS records (None keeps all)
+        :param sketch_capacity: Track IP/port statistics in fixed-size SpaceSaving
+                                summaries of this many counters instead of exact dicts
+        :param signatures: SignatureEngine (or iterable of Signatures) matched against
+                           raw TCP/UDP payloads (None disables payload matching)
+        :param reassemble: Reassemble TCP streams and parse HTTP/DNS from the ordered byte
+                           stream instead of per-packet layers (True, or a TCPReassembler)
+        :param spill_dir: Directory receiving HTTP/DNS records evicted by max_records as
+                          JSON lines (None discards them)
+        :param dissectors: DissectorRegistry of the application-layer dissectors to run
+                           (None uses analyzer.dissectors.DEFAULT_REGISTRY)
+        """
+        self.sketch_capacity = sketch_capacity
+        if signatures is not None and not isinstance(signatures, SignatureEngine):
+            signatures = SignatureEngine(signatures)
+        self.signatures = signatures
+        self.signature_matches = deque(maxlen=max_records)
+        if reassemble is True:
+            reassemble = TCPReassembler()
+        self.reassembler = reassemble if reassemble is not False else None
         self.protocol_stats = defaultdict(int)
-        self.ip_stats = defaultdict(int)
-        self.port_stats = defaultdict(int)
-        self.http_requests = []
-        self.dns_queries = []
+        if sketch_capacity:
+            self.ip_stats = SpaceSaving(sketch_capacity)
+            self.port_stats = SpaceSaving(sketch_capacity)
+        else:
+            self.ip_stats = defaultdict(int)
+            self.port_stats = defaultdict(int)
+        self.max_records = max_records
+        self.spill_dir = spill_dir
+        self.http_requests = RecordStore(HTTP_FIELDS, max_records, self._spill_path('http_requests'),
+                                         counted=('host', 'user_agent'), sketch_capacity=sketch_capacity)
+        self.dns_queries = RecordStore(DNS_FIELDS, max_records, self._spill_path('dns_queries'))
+        self.dns_stats = DNSAggregates()
+        self.dns_names = SpaceSaving(sketch_capacity) if sketch_capacity else defaultdict(int)
+        # Records of the registered dissectors, created when a dissector first produces one
+        self.dissectors = dissectors if dissectors is not None else DEFAULT_REGISTRY
+        self.dissected = {}
+        self._build_dispatch()
+
+    def _spill_path(self, name):
+        return os.path.join(self.spill_dir, name + '.jsonl') if self.spill_dir is not None else None
+
+    def _build_dispatch(self):
+        """
+        Build the layer-name and port lookup tables. Registered dissectors start out as
+        loaders that import the dissector on first use and then replace themselves.
+        """
+        self._layered_types = {}
+        self._layer_handlers = {'http': self._analyze_http, 'dns': self._analyze_dns}
+        # With reassembly, HTTP and DNS over TCP come from the stream, not per-packet layers
+        self._streamed_handlers = {}
+        loaders = {}
+        for layer, name in self.dissectors.layer_table().items():
+            loader = loaders.setdefault(name, self._loader(name))
+            self._layer_handlers.setdefault(layer, loader)
+            self._streamed_handlers.setdefault(layer, loader)
+        self._port_handlers = {}
+        for transport, ports in self.dissectors.port_tables().items():
+            self._port_handlers[transport] = {port: loaders.setdefault(name, self._loader(name))
+                                              for port, name in ports.items()}
+
+    def _loader(self, name):
+        def load(packet, fields, layer):
+            handler = self._dissector_handler(name, self.dissectors.get(name))
+            for table in (self._layer_handlers, self._streamed_handlers, *self._port_handlers.values()):
+                for key, value in table.items():
+                    if value is load:
+                        table[key] = handler
+            handler(packet, fields, layer)
+        return load
+
+    def _dissector_handler(self, name, dissector):
+        """Handler storing a dissector's values, from a layer or else from the raw payload"""
+        from_layer, from_payload = dissector.from_layer, dissector.from_payload
+
+        def handle(packet, fields, layer):
+            if layer is not None:
+                values = from_layer(layer)
+            else:
+                payload = payload_bytes(packet)
+                values = from_payload(payload) if payload else None
+            if values is None:
+                return
+            store = self.dissected.get(name)
+            if store is None:
+                store = self.dissected[name] = RecordStore(
+                    dissector.fields, self.max_records, self._spill_path(name),
+                    counted=getattr(dissector, 'counted', ()), sketch_capacity=self.sketch_capacity)
+            store.add(fields.timestamp if fields.timestamp is not None else packet.sniff_time, *values)
+        return handle
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('_layered_types', '_layer_handlers', '_streamed_handlers', '_port_handlers'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build_dispatch()
+
+    def inspect(self, packets):
+        """
+        Analyze packets as they stream past
+        :param packets: Iterable of packets
+        :return: Generator yielding each packet after analysis, for chaining into other stages
+        """
+        for packet in packets:
+            self.analyze_packet(packet)
+            yield packet
         
     def analyze_packet(self, packet):
         """Analyze a single packet with DPI"""
         try:
-            # Basic protocol analysis
-            if hasattr(packet, 'transport_layer'):
-                self.protocol_stats[packet.transport_layer] += 1
-            
-            # IP analysis
-            if hasattr(packet, 'ip'):
-                self.ip_stats[packet.ip.src] += 1
-                self.ip_stats[packet.ip.dst] += 1
-                
-            # Port analysis
-            if hasattr(packet, 'tcp'):
-                self.port_stats[packet.tcp.srcport] += 1
-                self.port_stats[packet.tcp.dstport] += 1
-            elif hasattr(packet, 'udp'):
-                self.port_stats[packet.udp.srcport] += 1
-                self.port_stats[packet.udp.dstport] += 1
-                
-            # HTTP analysis
-            if hasattr(packet, 'http'):
-                self._analyze_http(packet)
-                
-            # DNS analysis
-            if hasattr(packet, 'dns'):
-                self._analyze_dns(packet)
-                
+            self.update(packet, extract_fields(packet))
         except AttributeError as e:
             pass
-            
-    def _analyze_http(self, packet):
+
+    def update(self, packet, fields):
+        """
+        Analyze a packet whose common fields have already been extracted
+        :param packet: Packet to inspect (used for application layers)
+        :param fields: PacketFields read from the packet by extract_fields
+        """
+        # Basic protocol analysis
+        if fields.transport is not None:
+            self.protocol_stats[fields.transport] += 1
+
+        if self.sketch_capacity:
+            if fields.src is not None:
+                self.ip_stats.add(fields.src)
+                self.ip_stats.add(fields.dst)
+            if fields.srcport is not None:
+                self.port_stats.add(fields.srcport)
+                self.port_stats.add(fields.dstport)
+        else:
+            # IP analysis
+            if fields.src is not None:
+                self.ip_stats[fields.src] += 1
+                self.ip_stats[fields.dst] += 1
+
+            # Port analysis
+            if fields.srcport is not None:
+                self.port_stats[fields.srcport] += 1
+                self.port_stats[fields.dstport] += 1
+
+        # With reassembly, HTTP and DNS over TCP are parsed from the ordered stream
+        streamed = False
+        if self.reassembler is not None and fields.is_tcp and fields.src is not None:
+            segment = tcp_segment(packet)
+            if segment is not None:
+                self._analyze_stream(fields, segment)
+                streamed = True
+
+        # Application layers: a table lookup per named layer, or per port for raw payloads
+        cls = type(packet)
+        layered = self._layered_types.get(cls)
+        if layered is None:
+            layered = self._layered_types[cls] = cls.__module__.split('.', 1)[0] in LAYERED_MODULES
+        if layered:
+            handlers = self._streamed_handlers if streamed else self._layer_handlers
+            for layer in packet.layers:
+                handler = handlers.get(layer.layer_name)
+                if handler is not None:
+                    handler(packet, fields, layer)
+        else:
+            if not streamed:
+                layer = getattr(packet, 'http', None)
+                if layer is not None:
+                    self._analyze_http(packet, fields, layer)
+                layer = getattr(packet, 'dns', None)
+                if layer is not None:
+                    self._analyze_dns(packet, fields, layer)
+            if fields.srcport is not None and self._port_handlers:
+                ports = self._port_handlers.get(fields.transport)
+                if ports is not None:
+                    handler = ports.get(fields.dstport) or ports.get(fields.srcport)
+                    if handler is not None:
+                        handler(packet, fields, None)
+
+        # Payload signatures
+        if self.signatures is not None and fields.srcport is not None:
+            self._analyze_payload(packet, fields)
+
+    def _analyze_http(self, packet, fields, http_layer):
         """Extract HTTP request information"""
-        http_layer = packet.http
-        request = {
-            'method': getattr(http_layer, 'request_method', ''),
-            'uri': getattr(http_layer, 'request_uri', ''),
-            'host': getattr(http_layer, 'host', ''),
-            'user_agent': getattr(http_layer, 'user_agent', ''),
-            'timestamp': packet.sniff_time.isoformat()
-        }
-        self.http_requests.append(request)
+        self.http_requests.add(packet.sniff_time,
+                               getattr(http_layer, 'request_method', ''),
+                               getattr(http_layer, 'request_uri', ''),
+                               getattr(http_layer, 'host', ''),
+                               getattr(http_layer, 'user_agent', ''))
         
-    def _analyze_dns(self, packet):
+    def _analyze_dns(self, packet, fields, dns_layer):
         """Extract DNS query information"""
-        if packet.dns.qry_name:
-            query = {
-                'query': packet.dns.qry_name,
-                'type': packet.dns.qry_type,
-                'response': bool(packet.dns.flags_response),
-                'timestamp': packet.sniff_time.isoformat()
-            }
-            self.dns_queries.append(query)
+        if dns_layer.qry_name:
+            self._record_dns(to_epoch(packet.sniff_time), fields, dns_layer.qry_name, dns_layer.qry_type,
+                             bool(dns_layer.flags_response), to_int(getattr(dns_layer, 'id', None)),
+                             to_int(getattr(dns_layer, 'flags_rcode', None)))
+
+    def _record_dns(self, epoch, fields, name, qtype, response, dns_id, rcode):
+        """Store a DNS record and update the DNS aggregates"""
+        self.dns_queries.add(epoch, name, qtype, response, rcode)
+        client = fields.dst if response else fields.src
+        self.dns_stats.add(epoch, name, response, dns_id, rcode, client)
+        if not response:
+            if self.sketch_capacity:
+                self.dns_names.add(name)
+            else:
+                self.dns_names[name] += 1
             
+    def _analyze_stream(self, fields, segment):
+        """Feed a TCP segment to the reassembler and record completed messages"""
+        messages = self.reassembler.process(fields, *segment)
+        if not messages:
+            return
+        epoch = to_epoch(fields.timestamp)
+        for kind, message in messages:
+            if kind == 'http':
+                self.http_requests.add(epoch, message['method'], message['uri'],
+                                       message['host'], message['user_agent'])
+            elif kind == 'dns' and message['query']:
+                self._record_dns(epoch, fields, message['query'], message['type'],
+                                 message['response'], message['id'], message['rcode'])
+
+    def _analyze_payload(self, packet, fields):
+        """Match the raw payload against the signature engine"""
+        for signature in self.signatures.scan(fields, payload_bytes(packet)):
+            self.signature_matches.append({
+                'signature': signature.name,
+                'application': signature.application,
+                'src': fields.src,
+                'dst': fields.dst,
+                'srcport': fields.srcport,
+                'dstport': fields.dstport,
+                'timestamp': fields.timestamp.isoformat() if fields.timestamp else None
+            })
+
+    def get_signature_statistics(self):
+        """Per-signature hit counts and per-application flow counts"""
+        if self.signatures is None:
+            return {'hits': {}, 'applications': {}}
+        return {
+            'hits': self.signatures.get_hit_counts(),
+            'applications': self.signatures.get_application_stats()
+        }
+
+    def merge(self, other):
+        """
+        Fold another DPIAnalyzer's results into this one (e.g. from a parallel worker)
+        :param other: DPIAnalyzer to merge
+        :return: self
+        """
+        if bool(self.sketch_capacity) != bool(other.sketch_capacity):
+            raise ValueError("Cannot merge exact and sketch-backed statistics")
+        counters = [(self.protocol_stats, other.protocol_stats)]
+        if self.sketch_capacity:
+            self.ip_stats.merge(other.ip_stats)
+            self.port_stats.merge(other.port_stats)
+        else:
+            counters += [(self.ip_stats, other.ip_stats), (self.port_stats, other.port_stats)]
+        for mine, theirs in counters:
+            for key, count in theirs.items():
+                mine[key] += count
+
+        if self.sketch_capacity:
+            self.dns_names.merge(other.dns_names)
+        else:
+            for name, count in other.dns_names.items():
+                self.dns_names[name] += count
+        self.dns_stats.merge(other.dns_stats)
+
+        # Keep records in timestamp order across both analyzers (newer records are appended)
+        self.http_requests.merge(other.http_requests)
+        self.dns_queries.merge(other.dns_queries)
+        for name, store in other.dissected.items():
+            mine = self.dissected.get(name)
+            if mine is None:
+                self.dissected[name] = store
+            else:
+                mine.merge(store)
+        if other.signatures is not None:
+            if self.signatures is None:
+                raise ValueError("Cannot merge signature results into an analyzer without signatures")
+            self.signatures.merge(other.signatures)
+            self.signature_matches = merge_ordered(self.signature_matches, other.signature_matches,
+                                                   lambda record: record['timestamp'] or '')
+        return self
+
+    def get_http_statistics(self, top_n=10):
+        """
+        Get HTTP request statistics
+        :param top_n: Number of hosts and user agents to list
+        """
+        return {
+            'requests': self.http_requests.total,
+            'top_hosts': dict(self.http_requests.top('host', top_n)),
+            'top_user_agents': dict(self.http_requests.top('user_agent', top_n))
+        }
+
+    def get_dns_statistics(self, top_n=10):
+        """
+        Get DNS statistics: message counts, NXDOMAIN rate, query-to-response latency
+        and the most queried names
+        :param top_n: Number of query names to list
+        """
+        stats = self.dns_stats.summary()
+        stats['top_queries'] = self._top(self.dns_names, top_n)
+        return stats
+
+    def get_dissector_statistics(self, top_n=10):
+        """
+        Get record counts of the application-layer dissectors that produced records,
+        with the most frequent values of their counted fields (e.g. 'top_sni' for TLS)
+        :param top_n: Number of values to list per counted field
+        """
+        stats = {}
+        for name, store in self.dissected.items():
+            stats[name] = {'records': store.total}
+            for field in store.counted:
+                stats[name]['top_' + field] = dict(store.top(field, top_n))
+        return stats
+
     def get_protocol_statistics(self):
         """Get protocol distribution statistics"""
         return dict(self.protocol_stats)
         
-    def get_ip_statistics(self):
-        """Get IP traffic statistics"""
-        return dict(self.ip_stats)
+    def get_ip_statistics(self, top_n=None):
+        """
+        Get IP traffic statistics
+        :param top_n: Only return the N busiest addresses (None returns all tracked)
+        """
+        return self._top(self.ip_stats, top_n)
         
-    def get_port_statistics(self):
-        """Get port usage statistics"""
-        return dict(self.port_stats)
+    def get_port_statistics(self, top_n=None):
+        """
+        Get port usage statistics
+        :param top_n: Only return the N busiest ports (None returns all tracked)
+        """
+        return self._top(self.port_stats, top_n)
+
+    def get_subnet_statistics(self, v4_prefix=24, v6_prefix=48, top_n=None):
+        """
+        Get IP traffic statistics rolled up to subnets
+        :param v4_prefix: Prefix length for IPv4 subnets
+        :param v6_prefix: Prefix length for IPv6 subnets
+        :param top_n: Only return the N busiest subnets (None returns all)
+        """
+        return aggregate_subnets(self._top(self.ip_stats, None), v4_prefix, v6_prefix, top_n)
+
+    def _top(self, stats, top_n):
+        if self.sketch_capacity:
+            return dict(stats.top(top_n))
+        if top_n is None:
+            return dict(stats)
+        return dict(heapq.nlargest(top_n, stats.items(), key=lambda item: item[1]))
+
@@ -0,0 +1,254 @@
+"""
+Fast PCAP/PCAPNG reader built directly on dpkt.
+
+Packets are decoded into lightweight objects that mimic the parts of the
+pyshark packet API used by the analyzers (``packet.ip.src``,
+``packet.tcp.dstport``, ``packet.transport_layer``, ``packet.sniff_time``,
+``packet.http``/``packet.dns``, ...). Layers that are not present are simply
+not set, so ``hasattr(packet, 'tcp')`` behaves as it does with pyshark.
+Field values are strings, again matching pyshark, so statistics collected
+from either backend share the same keys.
+"""
+import socket
+import struct
+from datetime import datetime
+from itertools import islice
+
+import dpkt
+
+# Link-layer types handled by decode_packet
+DLT_NULL = 0
+DLT_EN10MB = 1
+DLT_RAW = 101
+DLT_RAW_ALT = (12, 14)
+DLT_LOOP = 108
+DLT_LINUX_SLL = 113
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_IP6 = 0x86DD
+ETH_TYPE_VLAN = (0x8100, 0x88A8, 0x9100)
+
+HTTP_METHODS = (b'GET ', b'POST ', b'PUT ', b'HEAD ', b'DELETE ', b'OPTIONS ',
+                b'PATCH ', b'CONNECT ', b'TRACE ')
+DNS_PORTS = (53, 5353)
+
+_unpack_ethertype = struct.Struct('!H').unpack_from
+
+
+class IPLayer:
+    __slots__ = ('src', 'dst', 'proto', 'ttl', 'len', 'version')
+
+
+class TCPLayer:
+    __slots__ = ('srcport', 'dstport', 'seq', 'ack', 'flags', 'length', 'len', 'payload')
+
+
+class UDPLayer:
+    __slots__ = ('srcport', 'dstport', 'length', 'payload')
+
+
+class HTTPLayer:
+    __slots__ = ('request_method', 'request_uri', 'host', 'user_agent')
+
+
+class DNSLayer:
+    __slots__ = ('id', 'qry_name', 'qry_type', 'flags_response', 'flags_rcode')
+
+
+class DpktPacket:
+    """
+    Lightweight decoded packet exposing a pyshark-compatible subset of attributes
+    """
+    __slots__ = ('sniff_timestamp', 'length', 'transport_layer', 'highest_layer',
+                 'ip', 'ipv6', 'tcp', 'udp', 'http', 'dns')
+
+    @property
+    def sniff_time(self):
+        """Capture time as a local datetime, computed on demand"""
+        return datetime.fromtimestamp(self.sniff_timestamp)
+
+    def __repr__(self):
+        return f"<DpktPacket {self.highest_layer} {self.length} bytes>"
+
+
+def _ip_layer(ip, version):
+    layer = IPLayer()
+    if version == 4:
+        layer.src = socket.inet_ntoa(ip.src)
+        layer.dst = socket.inet_ntoa(ip.dst)
+        layer.proto = str(ip.p)
+        layer.ttl = str(ip.ttl)
+        layer.len = str(ip.len)
+    else:
+        layer.src = socket.inet_ntop(socket.AF_INET6, ip.src)
+        layer.dst = socket.inet_ntop(socket.AF_INET6, ip.dst)
+        layer.proto = str(ip.nxt)
+        layer.ttl = str(ip.hlim)
+        layer.len = str(ip.plen)
+    layer.version = str(version)
+    return layer
+
+
+def _http_layer(payload):
+    """Parse the request line and headers of an HTTP request segment"""
+    head = payload.split(b'\r\n\r\n', 1)[0]
+    lines = head.split(b'\r\n')
+    parts = lines[0].split(b' ')
+    if len(parts) < 2:
+        return None
+    layer = HTTPLayer()
+    layer.request_method = parts[0].decode('latin-1')
+    layer.request_uri = parts[1].decode('latin-1')
+    layer.host = ''
+    layer.user_agent = ''
+    for line in lines[1:]:
+        name, sep, value = line.partition(b':')
+        if not sep:
+            continue
+        name = name.strip().lower()
+        if name == b'host':
+            layer.host = value.strip().decode('latin-1')
+        elif name == b'user-agent':
+            layer.user_agent = value.strip().decode('latin-1')
+    return layer
+
+
+def _dns_layer(payload):
+    try:
+        msg = dpkt.dns.DNS(payload)
+    except (dpkt.UnpackError, IndexError, struct.error):
+        return None
+    layer = DNSLayer()
+    layer.id = str(msg.id)
+    layer.flags_response = msg.qr == dpkt.dns.DNS_R
+    layer.flags_rcode = str(msg.rcode)
+    if msg.qd:
+        layer.qry_name = msg.qd[0].name
+        layer.qry_type = str(msg.qd[0].type)
+    else:
+        layer.qry_name = ''
+        layer.qry_type = ''
+    return layer
+
+
+def _network_offset(buf, linktype):
+    """
+    Locate the network layer inside a link-layer frame
+    :return: Tuple of (offset, ethertype) or None if the frame is not IP
+    """
+    if linktype == DLT_EN10MB:
+        offset = 12
+        ethertype = _unpack_ethertype(buf, offset)[0]
+        offset += 2
+        while ethertype in ETH_TYPE_VLAN:
+            ethertype = _unpack_ethertype(buf, offset + 2)[0]
+            offset += 4
+        return offset, ethertype
+    if linktype == DLT_RAW or linktype in DLT_RAW_ALT:
+        version = buf[0] >> 4
+        return 0, ETH_TYPE_IP if version == 4 else ETH_TYPE_IP6
+    if linktype == DLT_LINUX_SLL:
+        return 16, _unpack_ethertype(buf, 14)[0]
+    if linktype in (DLT_NULL, DLT_LOOP):
+        version = buf[4] >> 4
+        return 4, ETH_TYPE_IP if version == 4 else ETH_TYPE_IP6
+    return None
+
+
+def decode_packet(timestamp, buf, linktype=DLT_EN10MB):
+    """
+    Decode a raw frame into a DpktPacket
+    :param timestamp: Capture timestamp in epoch seconds
+    :param buf: Raw frame bytes
+    :param linktype: Link-layer type of the capture
+    :return: DpktPacket (layers that fail to decode are left unset)
+    """
+    packet = DpktPacket()
+    packet.sniff_timestamp = timestamp
+    packet.length = len(buf)
+    packet.transport_layer = None
+    packet.highest_layer = 'ETH' if linktype == DLT_EN10MB else 'RAW'
+
+    try:
+        located = _network_offset(buf, linktype)
+        if located is None:
+            return packet
+        offset, ethertype = located
+        if ethertype == ETH_TYPE_IP:
+            ip = dpkt.ip.IP(buf[offset:])
+            packet.ip = _ip_layer(ip, 4)
+            packet.highest_layer = 'IP'
+        elif ethertype == ETH_TYPE_IP6:
+            ip = dpkt.ip6.IP6(buf[offset:])
+            packet.ipv6 = _ip_layer(ip, 6)
+            packet.highest_layer = 'IPV6'
+        else:
+            return packet
+    except (dpkt.UnpackError, IndexError, struct.error, OSError, ValueError):
+        return packet
+
+    segment = ip.data
+    if isinstance(segment, dpkt.tcp.TCP):
+        tcp = TCPLayer()
+        tcp.srcport = str(segment.sport)
+        tcp.dstport = str(segment.dport)
+        tcp.seq = segment.seq
+        tcp.ack = segment.ack
+        tcp.flags = segment.flags
+        tcp.payload = segment.data
+        tcp.length = tcp.len = str(len(segment.data))
+        packet.tcp = tcp
+        packet.transport_layer = packet.highest_layer = 'TCP'
+        if segment.data.startswith(HTTP_METHODS):
+            http = _http_layer(segment.data)
+            if http is not None:
+                packet.http = http
+                packet.highest_layer = 'HTTP'
+        elif segment.data and (segment.sport in DNS_PORTS or segment.dport in DNS_PORTS):
+            # DNS over TCP carries a two byte length prefix
+            dns = _dns_layer(segment.data[2:])
+            if dns is not None:
+                packet.dns = dns
+                packet.highest_layer = 'DNS'
+    elif isinstance(segment, dpkt.udp.UDP):
+        udp = UDPLayer()
+        udp.srcport = str(segment.sport)
+        udp.dstport = str(segment.dport)
+        udp.length = str(segment.ulen)
+        udp.payload = segment.data
+        packet.udp = udp
+        packet.transport_layer = packet.highest_layer = 'UDP'
+        if segment.sport in DNS_PORTS or segment.dport in DNS_PORTS:
+            dns = _dns_layer(segment.data)
+            if dns is not None:
+                packet.dns = dns
+                packet.highest_layer = 'DNS'
+    return packet
+
+
+def read_pcap(pcap_file, start=0, stop=None, bpf_filter=None):
+    """
+    Lazily decode packets from a pcap or pcapng file
+    :param pcap_file: Path to capture file
+    :param start: Index of the first packet to decode (earlier records are skipped undecoded)
+    :param stop: Index one past the last packet to decode (None reads to the end)
+    :param bpf_filter: BPF expression evaluated on the raw frame; frames that do not match
+                       are skipped before decoding (start/stop still count every record)
+    :return: Generator of DpktPacket objects
+    """
+    with open(pcap_file, 'rb') as f:
+        reader = dpkt.pcap.UniversalReader(f)
+        linktype = reader.datalink()
+        records = islice(reader, start, stop)
+        if bpf_filter:
+            from .bpf import compile_filter
+            matches = compile_filter(bpf_filter, linktype)
+            records = ((timestamp, buf) for timestamp, buf in records if matches(buf))
+        for timestamp, buf in records:
+            yield decode_packet(float(timestamp), buf, linktype)
+
+
+def count_packets(pcap_file):
+    """Count the records in a capture file without decoding them"""
+    with open(pcap_file, 'rb') as f:
+        return sum(1 for _ in dpkt.pcap.UniversalReader(f))
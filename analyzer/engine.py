@@ -0,0 +1,148 @@
+from time import perf_counter_ns
+
+from .dpi_engine import DPIAnalyzer
+from .fields import extract_fields
+from .packet_analysis import PacketAnalyzer
+
+class AnalysisEngine:
+    """
+    Single-pass analysis driver.
+
+    Each packet's fields are extracted once and fed to both the DPI engine
+    (protocol/IP/port statistics, HTTP and DNS extraction) and the packet
+    analyzer (flows, conversations, port scan tracking), instead of walking
+    the capture once per analysis method.
+    """
+    def __init__(self, dpi=None, analyzer=None, metrics=None):
+        """
+        Initialize the engine
+        :param dpi: DPIAnalyzer to update (a new one is created if omitted)
+        :param analyzer: PacketAnalyzer to update (a new one is created if omitted)
+        :param metrics: Metrics recording per-stage counts and latencies (None disables timing)
+        """
+        self.dpi = dpi if dpi is not None else DPIAnalyzer()
+        self.analyzer = analyzer if analyzer is not None else PacketAnalyzer()
+        self.metrics = metrics
+        self.packet_count = 0
+
+    def __getstate__(self):
+        # Metrics belong to the running process (they may hold an HTTP server's callbacks)
+        state = self.__dict__.copy()
+        state['metrics'] = None
+        return state
+
+    def process_packet(self, packet):
+        """Run every analysis stage over a single packet"""
+        self.packet_count += 1
+        if self.metrics is not None:
+            weight = self.metrics.tick()
+            if weight:
+                self._process_timed(packet, weight)
+                return
+        self._process(packet)
+
+    def process_fields(self, packet, fields):
+        """
+        Run the analysis stages over a packet whose fields were already extracted, e.g. by a
+        caller that routes packets on them (not timed by metrics)
+        :param packet: Packet to analyze
+        :param fields: PacketFields from extract_fields(packet)
+        """
+        self.packet_count += 1
+        try:
+            self.dpi.update(packet, fields)
+            self.analyzer.update(fields)
+        except AttributeError:
+            pass
+
+    def _process(self, packet):
+        try:
+            fields = extract_fields(packet)
+            self.dpi.update(packet, fields)
+            self.analyzer.update(fields)
+        except AttributeError:
+            pass
+
+    def _process_timed(self, packet, weight):
+        """_process, recording the time spent in each stage"""
+        metrics = self.metrics
+        stage = 'extract'
+        try:
+            start = perf_counter_ns()
+            fields = extract_fields(packet)
+            end = perf_counter_ns()
+            metrics.observe(stage, end - start, weight)
+            stage, start = 'dpi', end
+            self.dpi.update(packet, fields)
+            end = perf_counter_ns()
+            metrics.observe(stage, end - start, weight)
+            stage, start = 'flows', end
+            self.analyzer.update(fields)
+            metrics.observe(stage, perf_counter_ns() - start, weight)
+        except AttributeError:
+            metrics.error(stage, weight)
+
+    def run(self, packets):
+        """
+        Analyze a stream of packets in one traversal
+        :param packets: Iterable of packets
+        :return: The engine, for chaining into the result views
+        """
+        if self.metrics is None:
+            for packet in packets:
+                self.process_packet(packet)
+            return self
+
+        # Time spent waiting on the iterator is the decoding cost of the backend
+        observe = self.metrics.observe
+        tick = self.metrics.tick
+        iterator = iter(packets)
+        while True:
+            weight = tick()
+            start = perf_counter_ns()
+            try:
+                packet = next(iterator)
+            except StopIteration:
+                break
+            self.packet_count += 1
+            if weight:
+                observe('decode', perf_counter_ns() - start, weight)
+                self._process_timed(packet, weight)
+            else:
+                self._process(packet)
+        return self
+
+    def merge(self, other):
+        """
+        Fold the results of another engine into this one
+        :param other: AnalysisEngine to merge
+        :return: self
+        """
+        self.dpi.merge(other.dpi)
+        self.analyzer.merge(other.analyzer)
+        self.packet_count += other.packet_count
+        return self
+
+    def get_flow_stats(self):
+        """Flow statistics, as returned by PacketAnalyzer.analyze_flow"""
+        return self.analyzer.flow_stats
+
+    def get_anomalies(self, threshold=100, ddos_threshold=50):
+        """Potential anomalies, as returned by PacketAnalyzer.detect_anomalies"""
+        return self.analyzer.get_anomalies(threshold, ddos_threshold)
+
+    def get_conversation_stats(self):
+        """Host conversation counts, as returned by PacketAnalyzer.get_conversation_stats"""
+        return self.analyzer.conversations
+
+    def get_protocol_statistics(self):
+        return self.dpi.get_protocol_statistics()
+
+    def get_ip_statistics(self):
+        return self.dpi.get_ip_statistics()
+
+    def get_port_statistics(self):
+        return self.dpi.get_port_statistics()
+
+    def get_subnet_statistics(self, v4_prefix=24, v6_prefix=48, top_n=None):
+        return self.dpi.get_subnet_statistics(v4_prefix, v6_prefix, top_n)
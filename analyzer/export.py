@@ -0,0 +1,488 @@
+"""
+Columnar export and import of analysis results.
+
+Results normally live only in memory: flow statistics, the packet timeline,
+HTTP/DNS records and the protocol/IP/port counters. save_results() writes
+them as column tables so reports and re-analysis can load a day's results
+without decoding the captures again. Every table is a set of NumPy columns;
+repeated strings (addresses, hostnames, user agents) are dictionary encoded,
+i.e. stored as integer codes plus one array of distinct values.
+
+Three on-disk formats are supported:
+
+* ``npy``: one uncompressed .npy file per column. Loading memory-maps the
+  files, so opening a result set is instant and only the pages a query
+  touches are read.
+* ``npz``: one compressed .npz archive per table. Smaller on disk; a table
+  is decompressed when it is first accessed.
+* ``parquet``: one Parquet file per table (zstd compressed), readable by
+  pandas, Spark, DuckDB, etc. Requires pyarrow.
+
+A manifest.json next to the tables records the format and row counts.
+String columns holding None keep a boolean null mask next to them, so None
+does not come back as the string 'None'.
+"""
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+from .flow_table import FlowTable, _to_ns
+
+EXPORT_FORMATS = ('npy', 'npz', 'parquet')
+MANIFEST = 'manifest.json'
+FORMAT_VERSION = 1
+_DICTIONARY_SUFFIX = '.dictionary'
+_NULL_SUFFIX = '.null'
+
+
+class Table:
+    """A table of equal-length NumPy columns, some dictionary encoded"""
+    def __init__(self, columns, dictionaries=None, nulls=None):
+        """
+        :param columns: Dict of column name -> NumPy array
+        :param dictionaries: Dict of column name -> NumPy array of values, for columns
+                             holding codes into those values
+        :param nulls: Dict of column name -> boolean NumPy array marking the rows that are None
+        """
+        self.columns = columns
+        self.dictionaries = dictionaries or {}
+        self.nulls = nulls or {}
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def decode(self, name):
+        """
+        Values of a dictionary-encoded column (a copy), or the column itself; columns
+        with null rows are returned as object arrays holding None in those rows
+        """
+        values = self.columns[name]
+        if name in self.dictionaries:
+            values = self.dictionaries[name][values]
+        if name in self.nulls:
+            values = values.astype(object)
+            values[self.nulls[name]] = None
+        return values
+
+    def to_pandas(self):
+        """DataFrame of the table, with dictionary-encoded columns as categoricals"""
+        import pandas as pd
+
+        data = {}
+        for name, column in self.columns.items():
+            if name in self.dictionaries:
+                codes = column
+                if name in self.nulls:
+                    # Code -1 is a missing value in a Categorical
+                    codes = column.astype('int64')
+                    codes[self.nulls[name]] = -1
+                data[name] = pd.Categorical.from_codes(codes, categories=pd.Index(self.dictionaries[name]))
+            else:
+                data[name] = self.decode(name)
+        return pd.DataFrame(data, copy=False)
+
+
+def _encode(values):
+    """
+    Dictionary-encode a sequence of hashable values
+    :return: Tuple of (codes, distinct values, null mask or None)
+    """
+    import numpy as np
+
+    ids = {}
+    codes = np.fromiter((ids.setdefault(value, len(ids)) for value in values), dtype=np.uint32)
+    return codes, _string_array(ids), _null_mask(codes, list(ids))
+
+
+def _string_array(values):
+    """String array of values, with None stored as '' (see _null_mask)"""
+    import numpy as np
+
+    return np.array(['' if value is None else str(value) for value in values], dtype=str)
+
+
+def _null_mask(codes, values):
+    """Boolean mask of the codes that point at None in values, or None if none do"""
+    import numpy as np
+
+    missing = [i for i, value in enumerate(values) if value is None]
+    return np.isin(codes, missing) if missing else None
+
+
+def _compact_codes(codes, values):
+    """
+    Re-encode codes into a shared value list as codes into the distinct values they use
+    :return: Tuple of (codes, distinct values, null mask or None)
+    """
+    import numpy as np
+
+    used, inverse = np.unique(codes, return_inverse=True)
+    inverse = inverse.astype(np.uint32)
+    used = [values[i] for i in used]
+    return inverse, _string_array(used), _null_mask(inverse, used)
+
+
+def _table(columns, dictionaries, encoded):
+    """Table of columns plus dictionary-encoded columns given as name -> _encode() result"""
+    nulls = {}
+    for name, (codes, values, null) in encoded.items():
+        columns[name] = codes
+        dictionaries[name] = values
+        if null is not None:
+            nulls[name] = null
+    return Table(columns, dictionaries, nulls)
+
+
+def flow_table(flow_stats):
+    """
+    Columns of a flow store (FlowTable or analyze_flow's dict)
+    :return: Table with src/dst (encoded addresses), srcport/dstport (-1 when absent),
+             transport (encoded), protocols (bitmask over the transport dictionary,
+             bit n - 1 set for entry n), packet_count, byte_count, start_ns, end_ns
+    """
+    import numpy as np
+
+    if isinstance(flow_stats, FlowTable):
+        columns = {name: flow_stats.column(name).copy() for name in
+                   ('src', 'dst', 'srcport', 'dstport', 'transport', 'protocols',
+                    'packet_count', 'byte_count', 'start_ns', 'end_ns')}
+        addresses = flow_stats.addresses.addresses
+        transports = _string_array(t or '' for t in flow_stats.transports)
+        return _table(columns, {'transport': transports}, {
+            'src': _compact_codes(columns['src'], addresses),
+            'dst': _compact_codes(columns['dst'], addresses)
+        })
+
+    keys = list(flow_stats.keys())
+    stats = list(flow_stats.values())
+    transports = {'': 0}
+    transport_codes = []
+    masks = []
+    for key, flow in zip(keys, stats):
+        transport = key[4] if len(key) == 5 else None
+        transport_codes.append(transports.setdefault(transport or '', len(transports)))
+        mask = 0
+        for protocol in flow['protocols']:
+            mask |= 1 << (transports.setdefault(protocol, len(transports)) - 1)
+        masks.append(mask)
+    if len(transports) > 9:
+        raise ValueError("Flow export supports at most 8 distinct transport protocols")
+
+    def port(key, index):
+        return int(key[index]) if len(key) == 5 and key[index] is not None else -1
+
+    columns = {
+        'src': None,
+        'dst': None,
+        'srcport': np.array([port(key, 2) for key in keys], dtype=np.int32),
+        'dstport': np.array([port(key, 3) for key in keys], dtype=np.int32),
+        'transport': np.array(transport_codes, dtype=np.uint8),
+        'protocols': np.array(masks, dtype=np.uint8),
+        'packet_count': np.array([flow['packet_count'] for flow in stats], dtype=np.uint64),
+        'byte_count': np.array([flow['byte_count'] for flow in stats], dtype=np.uint64),
+        'start_ns': np.array([_to_ns(flow['start_time']) for flow in stats], dtype=np.int64),
+        'end_ns': np.array([_to_ns(flow['end_time']) for flow in stats], dtype=np.int64),
+    }
+    return _table(columns, {'transport': _string_array(transports)},
+                  {'src': _encode(key[0] for key in keys), 'dst': _encode(key[1] for key in keys)})
+
+
+def window_table(timeline, window=60):
+    """
+    Per-window packet and flow counts of a PacketAnalyzer timeline
+    :param timeline: Iterable of (timestamp, flow key)
+    :param window: Window length in seconds
+    :return: Table with start_ns, packets and flows (distinct flow keys) per non-empty window
+    """
+    import numpy as np
+
+    entries = list(timeline)
+    window_ns = int(window * 1000000000)
+    timestamps = np.array([_to_ns(timestamp) for timestamp, _ in entries], dtype=np.int64)
+    flows = _encode(key for _, key in entries)[0]
+    bins = timestamps // window_ns
+    starts, packets = np.unique(bins, return_counts=True)
+    pairs = np.unique(np.stack([bins, flows.astype(np.int64)]), axis=1) if len(entries) else \
+        np.empty((2, 0), dtype=np.int64)
+    _, distinct = np.unique(pairs[0], return_counts=True)
+    return Table({
+        'start_ns': starts * window_ns,
+        'packets': packets.astype(np.uint64),
+        'flows': distinct.astype(np.uint64)
+    })
+
+
+def record_table(store):
+    """Columns of a RecordStore, with timestamps as epoch nanoseconds"""
+    import numpy as np
+
+    raw, values = store.columns()
+    columns = {}
+    encoded = {}
+    for name, column in raw.items():
+        if name == 'timestamp':
+            columns['timestamp_ns'] = np.round(column * 1e9).astype(np.int64)
+        elif name == 'response':
+            columns[name] = column
+        else:
+            columns[name] = None
+            encoded[name] = _compact_codes(column, values)
+    return _table(columns, {}, encoded)
+
+
+def counter_table(counts):
+    """Columns of a key -> count mapping, largest counts first"""
+    import numpy as np
+
+    items = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+    keys = [key for key, _ in items]
+    null = _null_mask(range(len(keys)), keys)
+    return Table({
+        'key': _string_array(keys),
+        'count': np.array([count for _, count in items], dtype=np.uint64)
+    }, nulls={} if null is None else {'key': null})
+
+
+def collect_tables(engine=None, dpi=None, analyzer=None, window=60):
+    """
+    Gather the result tables of an analysis
+    :param engine: AnalysisEngine (supplies dpi and analyzer)
+    :param dpi: DPIAnalyzer
+    :param analyzer: PacketAnalyzer
+    :param window: Window length in seconds for the per-window counters
+    :return: Dict of table name -> Table
+    """
+    if engine is not None:
+        dpi = engine.dpi if dpi is None else dpi
+        analyzer = engine.analyzer if analyzer is None else analyzer
+    tables = {}
+    if analyzer is not None:
+        tables['flows'] = flow_table(analyzer.flow_stats)
+        tables['windows'] = window_table(analyzer.timeline, window)
+        tables['conversations'] = counter_table({f'{a} {b}': count for (a, b), count
+                                                 in analyzer.conversations.items()})
+    if dpi is not None:
+        tables['http_requests'] = record_table(dpi.http_requests)
+        tables['dns_queries'] = record_table(dpi.dns_queries)
+        for name, store in dpi.dissected.items():
+            tables[name] = record_table(store)
+        tables['protocols'] = counter_table(dpi.get_protocol_statistics())
+        tables['ips'] = counter_table(dpi.get_ip_statistics())
+        tables['ports'] = counter_table(dpi.get_port_statistics())
+    return tables
+
+
+def _flat(table):
+    """
+    Table as one dict of arrays, dictionaries stored under '<column>.dictionary' and
+    null masks under '<column>.null'
+    """
+    arrays = dict(table.columns)
+    for name, values in table.dictionaries.items():
+        arrays[name + _DICTIONARY_SUFFIX] = values
+    for name, mask in table.nulls.items():
+        arrays[name + _NULL_SUFFIX] = mask
+    return arrays
+
+
+def _unflat(arrays):
+    columns = {}
+    dictionaries = {}
+    nulls = {}
+    for name, array in arrays.items():
+        if name.endswith(_DICTIONARY_SUFFIX):
+            dictionaries[name[:-len(_DICTIONARY_SUFFIX)]] = array
+        elif name.endswith(_NULL_SUFFIX):
+            nulls[name[:-len(_NULL_SUFFIX)]] = array
+        else:
+            columns[name] = array
+    return Table(columns, dictionaries, nulls)
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("The parquet format requires pyarrow (pip install pyarrow)") from e
+    return pyarrow
+
+
+def _write_parquet(path, table, compression):
+    pa = _import_pyarrow()
+    arrays = {}
+    for name, column in table.columns.items():
+        mask = table.nulls.get(name)
+        if name in table.dictionaries:
+            arrays[name] = pa.DictionaryArray.from_arrays(pa.array(column.astype('int32'), mask=mask),
+                                                          pa.array(table.dictionaries[name]))
+        else:
+            arrays[name] = pa.array(column, mask=mask)
+    pa.parquet.write_table(pa.table(arrays), path, compression=compression)
+
+
+def _read_parquet(path, mmap):
+    import numpy as np
+
+    pa = _import_pyarrow()
+    arrow_table = pa.parquet.read_table(path, memory_map=mmap)
+    columns = {}
+    dictionaries = {}
+    nulls = {}
+    for name in arrow_table.column_names:
+        column = arrow_table.column(name).combine_chunks()
+        if column.null_count:
+            nulls[name] = column.is_null().to_numpy(zero_copy_only=False)
+        if pa.types.is_dictionary(column.type):
+            columns[name] = column.indices.fill_null(0).to_numpy(zero_copy_only=False).astype(np.uint32)
+            dictionaries[name] = np.array(column.dictionary.to_pylist(), dtype=str)
+        else:
+            columns[name] = column.fill_null('' if pa.types.is_string(column.type) else 0) \
+                .to_numpy(zero_copy_only=False)
+    return Table(columns, dictionaries, nulls)
+
+
+def save_tables(path, tables, format='npy', compression='zstd', metadata=None):
+    """
+    Write tables to a result directory
+    :param path: Directory to write (created if missing; existing tables are replaced)
+    :param tables: Dict of table name -> Table
+    :param format: One of EXPORT_FORMATS
+    :param compression: Parquet compression codec
+    :param metadata: JSON-serializable dict stored in the manifest
+    :return: Path of the manifest
+    """
+    import numpy as np
+
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {format!r}, expected one of {EXPORT_FORMATS}")
+    if format == 'parquet':
+        _import_pyarrow()
+    os.makedirs(path, exist_ok=True)
+    for name, table in tables.items():
+        if format == 'npy':
+            # Columns are written to a new directory that replaces the table's directory, so
+            # columns of an earlier export that this table lacks are not loaded with it
+            directory = os.path.join(path, name)
+            staging = tempfile.mkdtemp(prefix=f'.{name}.', dir=path)
+            try:
+                for column, array in _flat(table).items():
+                    np.save(os.path.join(staging, column + '.npy'), array, allow_pickle=False)
+                if os.path.isdir(directory):
+                    shutil.rmtree(directory)
+                os.rename(staging, directory)
+            except BaseException:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+        elif format == 'npz':
+            np.savez_compressed(os.path.join(path, name + '.npz'), **_flat(table))
+        else:
+            _write_parquet(os.path.join(path, name + '.parquet'), table, compression)
+
+    manifest = {
+        'version': FORMAT_VERSION,
+        'format': format,
+        'created': datetime.now().isoformat(),
+        'tables': {name: len(table) for name, table in tables.items()},
+        'metadata': metadata or {}
+    }
+    manifest_path = os.path.join(path, MANIFEST)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest_path
+
+
+def save_results(path, engine=None, dpi=None, analyzer=None, format='npy', window=60, compression='zstd'):
+    """
+    Export the results of an analysis (see collect_tables) to a result directory
+    :param path: Directory to write
+    :param format: One of EXPORT_FORMATS
+    :param window: Window length in seconds for the per-window counters
+    :param compression: Parquet compression codec
+    :return: Path of the manifest
+    """
+    return save_tables(path, collect_tables(engine, dpi, analyzer, window), format, compression)
+
+
+class ResultSet:
+    """Lazily loaded tables of a result directory written by save_results"""
+    def __init__(self, path, mmap=True):
+        """
+        Open a result directory
+        :param path: Directory containing manifest.json
+        :param mmap: Memory-map npy columns and parquet files instead of reading them
+        """
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported result format version {self.manifest.get('version')!r}")
+        self.path = path
+        self.format = self.manifest['format']
+        self.mmap = mmap
+        self._tables = {}
+
+    @property
+    def metadata(self):
+        return self.manifest.get('metadata', {})
+
+    @property
+    def names(self):
+        return list(self.manifest['tables'])
+
+    def __contains__(self, name):
+        return name in self.manifest['tables']
+
+    def rows(self, name):
+        """Row count of a table, from the manifest"""
+        return self.manifest['tables'][name]
+
+    def table(self, name):
+        """
+        Load a table (cached after the first access)
+        :param name: Table name, see names
+        :return: Table
+        """
+        if name not in self.manifest['tables']:
+            raise KeyError(name)
+        table = self._tables.get(name)
+        if table is None:
+            table = self._tables[name] = self._load(name)
+        return table
+
+    __getitem__ = table
+
+    def _load(self, name):
+        import numpy as np
+
+        if self.format == 'npy':
+            directory = os.path.join(self.path, name)
+            return _unflat({entry[:-4]: np.load(os.path.join(directory, entry),
+                                                mmap_mode='r' if self.mmap else None,
+                                                allow_pickle=False)
+                            for entry in sorted(os.listdir(directory)) if entry.endswith('.npy')})
+        if self.format == 'npz':
+            with np.load(os.path.join(self.path, name + '.npz'), allow_pickle=False) as archive:
+                return _unflat({key: archive[key] for key in archive.files})
+        return _read_parquet(os.path.join(self.path, name + '.parquet'), self.mmap)
+
+    def to_pandas(self, name):
+        """DataFrame of one table"""
+        return self.table(name).to_pandas()
+
+
+def load_results(path, mmap=True):
+    """
+    Open a result directory written by save_results
+    :param path: Directory containing manifest.json
+    :param mmap: Memory-map columns instead of reading them into memory
+    :return: ResultSet
+    """
+    return ResultSet(path, mmap)
@@ -0,0 +1,51 @@
+"""
+Per-packet field extraction shared by the analyzers.
+
+Attribute lookups on pyshark packets are expensive (every access walks the
+layer list), so the fields the analyzers need are read once per packet into a
+small PacketFields record that every analysis stage can share.
+"""
+
+
+class PacketFields:
+    __slots__ = ('transport', 'src', 'dst', 'srcport', 'dstport', 'is_tcp', 'length', 'timestamp')
+
+
+def _layer_length(layer):
+    """Payload length of a transport layer (pyshark names it 'length' or 'len')"""
+    length = getattr(layer, 'length', None)
+    if length is None:
+        length = getattr(layer, 'len', 0)
+    return int(length)
+
+
+def extract_fields(packet):
+    """
+    Read the commonly used fields of a packet in a single pass
+    :param packet: pyshark or DpktPacket packet
+    :return: PacketFields record (src/dst/ports are None when the layer is absent)
+    """
+    fields = PacketFields()
+    fields.transport = getattr(packet, 'transport_layer', None)
+
+    ip = getattr(packet, 'ip', None)
+    if ip is not None:
+        fields.src = ip.src
+        fields.dst = ip.dst
+    else:
+        fields.src = fields.dst = None
+
+    layer = getattr(packet, 'tcp', None)
+    fields.is_tcp = layer is not None
+    if layer is None:
+        layer = getattr(packet, 'udp', None)
+    if layer is not None:
+        fields.srcport = layer.srcport
+        fields.dstport = layer.dstport
+        fields.length = _layer_length(layer)
+    else:
+        fields.srcport = fields.dstport = None
+        fields.length = 0
+
+    fields.timestamp = packet.sniff_time if ip is not None else None
+    return fields
@@ -0,0 +1,398 @@
+"""
+Compact columnar flow storage.
+
+PacketAnalyzer's default flow store is a dict of per-flow dicts, each holding
+a set and two datetimes. FlowTable keeps the same information in typed
+``array`` columns instead: addresses are interned into an integer-encoded
+address table, times are epoch nanoseconds and the protocols seen on a flow
+are a bitmask. Rows are found through an open-addressing hash index that is
+itself array-backed, so a flow costs no Python objects at all. The table
+still behaves as a read-only mapping of flow key to the familiar stats dict,
+so code written against analyze_flow's result keeps working, while column()
+and to_pandas() expose the columns as NumPy views without copying.
+"""
+import socket
+from array import array
+from collections.abc import Mapping
+from datetime import datetime
+
+FLOW_KEYS = ('pair', '5tuple')
+
+# Column name -> array typecode
+FLOW_COLUMNS = (
+    ('src', 'i'),
+    ('dst', 'i'),
+    ('srcport', 'i'),
+    ('dstport', 'i'),
+    ('transport', 'B'),
+    ('protocols', 'B'),
+    ('packet_count', 'Q'),
+    ('byte_count', 'Q'),
+    ('start_ns', 'q'),
+    ('end_ns', 'q'),
+)
+
+_V4_MAPPED = 0xFFFF << 32
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+_GOLDEN = 0x9E3779B97F4A7C15
+_MAX_NS = 2 ** 63 - 1
+_MIN_NS = -2 ** 63
+
+
+def ip_to_int(address):
+    """
+    Encode an IPv4 or IPv6 address as a 128-bit integer (IPv4 is v4-mapped)
+    :param address: Address string
+    :return: Integer form of the address
+    """
+    try:
+        return _V4_MAPPED | int.from_bytes(socket.inet_aton(address), 'big')
+    except OSError:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET6, address), 'big')
+
+
+def int_to_ip(value):
+    """Decode an integer produced by ip_to_int back to an address string"""
+    if value >> 32 == 0xFFFF:
+        return socket.inet_ntoa((value & 0xFFFFFFFF).to_bytes(4, 'big'))
+    return socket.inet_ntop(socket.AF_INET6, value.to_bytes(16, 'big'))
+
+
+def _numpy_view(column, size):
+    import numpy as np
+
+    return np.frombuffer(column, dtype=np.dtype(column.typecode))[:size]
+
+
+def _grow(column, rows):
+    """Append zeroed rows, copying first if a NumPy view pins the old buffer"""
+    extra = array(column.typecode, bytes(column.itemsize * rows))
+    try:
+        column.extend(extra)
+    except BufferError:
+        column = array(column.typecode, column)
+        column.extend(extra)
+    return column
+
+
+class _FlowIndex:
+    """Open-addressing (linear probing) hash index from packed flow keys to row numbers"""
+    def __init__(self, capacity=2048):
+        self._mask = capacity - 1
+        self._slots = array('i', [-1]) * capacity
+        self._hi = array('Q')
+        self._lo = array('Q')
+
+    def __len__(self):
+        return len(self._lo)
+
+    def _slot(self, hi, lo):
+        return ((lo ^ hi * _GOLDEN) * _GOLDEN >> 24) & self._mask
+
+    def get(self, packed):
+        """Row number of a packed key, or None"""
+        hi = packed >> 64
+        lo = packed & _MASK64
+        slots = self._slots
+        index = self._slot(hi, lo)
+        while True:
+            row = slots[index]
+            if row < 0:
+                return None
+            if self._lo[row] == lo and self._hi[row] == hi:
+                return row
+            index = (index + 1) & self._mask
+
+    def add(self, packed):
+        """Register a new key; it is assigned the next row number"""
+        row = len(self._lo)
+        self._hi.append(packed >> 64)
+        self._lo.append(packed & _MASK64)
+        if 2 * len(self._lo) > len(self._slots):
+            self._rebuild(2 * len(self._slots))
+        else:
+            self._place(row)
+        return row
+
+    def _place(self, row):
+        slots = self._slots
+        index = self._slot(self._hi[row], self._lo[row])
+        while slots[index] >= 0:
+            index = (index + 1) & self._mask
+        slots[index] = row
+
+    def _rebuild(self, capacity):
+        self._mask = capacity - 1
+        self._slots = array('i', [-1]) * capacity
+        for row in range(len(self._lo)):
+            self._place(row)
+
+
+class AddressTable:
+    """Interns addresses to dense ids, storing each as two 64-bit integer halves"""
+    def __init__(self):
+        self._ids = {}
+        self._addresses = []
+        self.hi = array('Q')
+        self.lo = array('Q')
+
+    def __len__(self):
+        return len(self._addresses)
+
+    def encode(self, address):
+        """Return the id of an address, adding it on first sight"""
+        address_id = self._ids.get(address)
+        if address_id is None:
+            address_id = len(self._addresses)
+            try:
+                value = ip_to_int(address)
+            except (OSError, TypeError):
+                value = 0
+            self.hi.append(value >> 64)
+            self.lo.append(value & 0xFFFFFFFFFFFFFFFF)
+            self._ids[address] = address_id
+            self._addresses.append(address)
+        return address_id
+
+    def lookup(self, address):
+        """Return the id of a known address, or None"""
+        return self._ids.get(address)
+
+    def decode(self, address_id):
+        return self._addresses[address_id]
+
+    @property
+    def addresses(self):
+        return self._addresses
+
+
+class FlowTable(Mapping):
+    def __init__(self, key='pair', capacity=1024):
+        """
+        Initialize an empty flow table
+        :param key: Flow key, 'pair' for (src, dst) or '5tuple' for
+                    (src, dst, srcport, dstport, transport)
+        :param capacity: Initial number of rows to allocate
+        """
+        if key not in FLOW_KEYS:
+            raise ValueError(f"Unknown flow key {key!r}, expected one of {FLOW_KEYS}")
+        self.key = key
+        self.addresses = AddressTable()
+        self._index = _FlowIndex()
+        self._size = 0
+        self._capacity = capacity
+        self._columns = {name: array(typecode, bytes(array(typecode).itemsize * capacity))
+                         for name, typecode in FLOW_COLUMNS}
+        # Transport names are numbered 1..8 per table; bit (n - 1) marks them in 'protocols'
+        self._transport_ids = {}
+        self._transports = [None]
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for row in range(self._size):
+            yield self._decode_key(row)
+
+    def __getitem__(self, flow_key):
+        row = self._find(flow_key)
+        if row is None:
+            raise KeyError(flow_key)
+        return self.row(row)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_columns'] = {name: column[:self._size] for name, column in self._columns.items()}
+        state['_capacity'] = self._size
+        return state
+
+    @property
+    def transports(self):
+        """Transport names by id; id 0 (None) means no transport"""
+        return list(self._transports)
+
+    def _transport_id(self, transport):
+        if not transport:
+            return 0
+        transport_id = self._transport_ids.get(transport)
+        if transport_id is None:
+            transport_id = len(self._transports)
+            if transport_id > 8:
+                raise ValueError("FlowTable supports at most 8 distinct transport protocols")
+            self._transport_ids[transport] = transport_id
+            self._transports.append(transport)
+        return transport_id
+
+    def _pack(self, src, dst, srcport, dstport, transport_id):
+        key = (src << 31) | dst
+        if self.key == '5tuple':
+            # Ports are stored shifted by one so that 0 means "no port"
+            key = (((key << 17 | srcport + 1) << 17 | dstport + 1) << 4) | transport_id
+        return key
+
+    def _find(self, flow_key):
+        src = self.addresses.lookup(flow_key[0])
+        dst = self.addresses.lookup(flow_key[1])
+        if src is None or dst is None:
+            return None
+        if self.key == '5tuple':
+            _, _, srcport, dstport, transport = flow_key
+            transport_id = self._transport_ids.get(transport, 0) if transport else 0
+            return self._index.get(self._pack(src, dst, _port(srcport), _port(dstport), transport_id))
+        return self._index.get(self._pack(src, dst, 0, 0, 0))
+
+    def _insert(self, packed, src, dst, srcport, dstport, transport_id):
+        row = self._index.add(packed)
+        columns = self._columns
+        if row == self._capacity:
+            rows = max(self._capacity // 2, 1024)
+            for name in columns:
+                columns[name] = _grow(columns[name], rows)
+            self._capacity += rows
+        columns['src'][row] = src
+        columns['dst'][row] = dst
+        columns['srcport'][row] = srcport
+        columns['dstport'][row] = dstport
+        columns['transport'][row] = transport_id
+        columns['start_ns'][row] = _MAX_NS
+        columns['end_ns'][row] = _MIN_NS
+        self._size += 1
+        return row
+
+    def add(self, fields):
+        """
+        Fold a packet into its flow
+        :param fields: PacketFields read from the packet by extract_fields
+        :return: Flow key of the packet
+        """
+        src = self.addresses.encode(fields.src)
+        dst = self.addresses.encode(fields.dst)
+        has_ports = fields.transport and fields.srcport is not None
+        transport_id = self._transport_id(fields.transport) if has_ports else 0
+        if self.key == '5tuple':
+            srcport = _port(fields.srcport)
+            dstport = _port(fields.dstport)
+            packed = self._pack(src, dst, srcport, dstport, transport_id)
+            flow_key = (fields.src, fields.dst, fields.srcport, fields.dstport,
+                        fields.transport if has_ports else None)
+        else:
+            srcport = dstport = -1
+            packed = (src << 31) | dst
+            flow_key = (fields.src, fields.dst)
+
+        row = self._index.get(packed)
+        if row is None:
+            row = self._insert(packed, src, dst, srcport, dstport,
+                               transport_id if self.key == '5tuple' else 0)
+
+        columns = self._columns
+        columns['packet_count'][row] += 1
+        if transport_id:
+            columns['byte_count'][row] += fields.length
+            columns['protocols'][row] |= 1 << (transport_id - 1)
+        timestamp_ns = _to_ns(fields.timestamp)
+        if timestamp_ns < columns['start_ns'][row]:
+            columns['start_ns'][row] = timestamp_ns
+        if timestamp_ns > columns['end_ns'][row]:
+            columns['end_ns'][row] = timestamp_ns
+        return flow_key
+
+    def _decode_key(self, row):
+        columns = self._columns
+        src = self.addresses.decode(columns['src'][row])
+        dst = self.addresses.decode(columns['dst'][row])
+        if self.key == 'pair':
+            return (src, dst)
+        srcport = columns['srcport'][row]
+        dstport = columns['dstport'][row]
+        return (src, dst,
+                None if srcport < 0 else str(srcport),
+                None if dstport < 0 else str(dstport),
+                self._transports[columns['transport'][row]])
+
+    def _decode_protocols(self, mask):
+        return {self._transports[bit + 1] for bit in range(8) if mask >> bit & 1}
+
+    def row(self, row):
+        """
+        Stats of one flow in the same shape as PacketAnalyzer.analyze_flow's values
+        :param row: Row number
+        :return: Dictionary of flow statistics
+        """
+        columns = self._columns
+        return {
+            'packet_count': columns['packet_count'][row],
+            'byte_count': columns['byte_count'][row],
+            'start_time': _from_ns(columns['start_ns'][row]),
+            'end_time': _from_ns(columns['end_ns'][row]),
+            'protocols': self._decode_protocols(columns['protocols'][row])
+        }
+
+    def items(self):
+        for row in range(self._size):
+            yield self._decode_key(row), self.row(row)
+
+    def column(self, name):
+        """NumPy view of one column over the used rows (no copy)"""
+        return _numpy_view(self._columns[name], self._size)
+
+    def merge(self, other):
+        """
+        Fold another FlowTable into this one
+        :param other: FlowTable with the same key type
+        :return: self
+        """
+        if other.key != self.key:
+            raise ValueError("Cannot merge flow tables with different flow keys")
+        theirs = other._columns
+        for row in range(other._size):
+            src = self.addresses.encode(other.addresses.decode(theirs['src'][row]))
+            dst = self.addresses.encode(other.addresses.decode(theirs['dst'][row]))
+            # Protocol ids are per table, so remap the bitmask and transport
+            mask = 0
+            for transport in other._decode_protocols(theirs['protocols'][row]):
+                mask |= 1 << (self._transport_id(transport) - 1)
+            transport_id = self._transport_id(other._transports[theirs['transport'][row]])
+            srcport = theirs['srcport'][row]
+            dstport = theirs['dstport'][row]
+            packed = self._pack(src, dst, srcport, dstport, transport_id)
+            target = self._index.get(packed)
+            if target is None:
+                target = self._insert(packed, src, dst, srcport, dstport, transport_id)
+            mine = self._columns
+            mine['packet_count'][target] += theirs['packet_count'][row]
+            mine['byte_count'][target] += theirs['byte_count'][row]
+            mine['protocols'][target] |= mask
+            mine['start_ns'][target] = min(mine['start_ns'][target], theirs['start_ns'][row])
+            mine['end_ns'][target] = max(mine['end_ns'][target], theirs['end_ns'][row])
+        return self
+
+    def to_pandas(self, decode_addresses=False):
+        """
+        Export the flow table as a DataFrame
+        :param decode_addresses: Add categorical src_ip/dst_ip columns (these are copies);
+                                 the numeric columns always share memory with the table
+        :return: pandas DataFrame with one row per flow
+        """
+        import pandas as pd
+
+        df = pd.DataFrame({name: self.column(name) for name, _ in FLOW_COLUMNS}, copy=False)
+        if decode_addresses:
+            categories = pd.Index(self.addresses.addresses)
+            df['src_ip'] = pd.Categorical.from_codes(self.column('src'), categories=categories)
+            df['dst_ip'] = pd.Categorical.from_codes(self.column('dst'), categories=categories)
+        return df
+
+
+def _port(port):
+    return -1 if port is None else int(port)
+
+
+def _to_ns(timestamp):
+    """Exact epoch nanoseconds of a (naive, local) datetime"""
+    return int(timestamp.timestamp()) * 1000000000 + timestamp.microsecond * 1000
+
+
+def _from_ns(timestamp_ns):
+    seconds, nanoseconds = divmod(timestamp_ns, 1000000000)
+    return datetime.fromtimestamp(seconds).replace(microsecond=nanoseconds // 1000)
@@ -0,0 +1,313 @@
+"""
+Pipeline instrumentation.
+
+A Metrics object collects, per pipeline stage, the number of packets
+handled, errors, and a latency histogram (cumulative time, maximum and
+approximate percentiles), along with free-form counters (e.g. dropped
+packets), gauges (e.g. queue depth, sampled when read) and the process's
+memory growth. Components take an optional ``metrics`` argument and skip
+all timing when it is None, so instrumentation costs a single comparison per
+packet when disabled. Timing every packet roughly halves the engine's
+throughput on the dpkt backend; ``Metrics(sample_every=N)`` times one packet
+in N and extrapolates stage counts and histograms, which brings the cost down
+to a few percent.
+
+Stages recorded by AnalysisEngine:
+
+* ``decode``: time spent producing the next packet (tshark dissection for
+  pyshark, frame decoding for dpkt)
+* ``extract``: reading the common header fields
+* ``dpi``: DPIAnalyzer.update (layer probing, HTTP/DNS, signatures)
+* ``flows``: PacketAnalyzer.update (flow, port scan and conversation state)
+
+AsyncCapturePipeline adds ``queue`` (time packets wait for analysis), the
+``queue_depth`` gauge and ``dropped_packets_total``.
+
+Results are available as a dict (snapshot()), in the Prometheus text format
+(to_prometheus(), write_prometheus() for the node_exporter textfile
+collector) or over HTTP (serve_metrics()).
+"""
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+                   1e-3, 2.5e-3, 5e-3, 1e-2, 0.1, 1.0)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def current_rss():
+    """Resident set size of this process in bytes (peak RSS where the current value is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes (0 where it cannot be read)"""
+    try:
+        import resource
+    except ImportError:
+        # No resource module on Windows: psutil reports the peak working set there
+        try:
+            import psutil
+
+            return psutil.Process().memory_info().peak_wset
+        except (ImportError, AttributeError):
+            return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StageStats:
+    """Packet count, errors and latency histogram of one stage"""
+    __slots__ = ('packets', 'errors', 'total_ns', 'max_ns', 'buckets', '_bounds_ns')
+
+    def __init__(self, bounds_ns):
+        self.packets = 0
+        self.errors = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.buckets = [0] * (len(bounds_ns) + 1)
+        self._bounds_ns = bounds_ns
+
+    def observe(self, elapsed_ns, weight=1):
+        self.packets += weight
+        self.total_ns += elapsed_ns * weight
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+        self.buckets[bisect_left(self._bounds_ns, elapsed_ns)] += weight
+
+    def percentile(self, percentile, bounds):
+        """Upper bound in seconds of the bucket holding the given percentile of observations"""
+        observations = sum(self.buckets)
+        if not observations:
+            return None
+        rank = percentile / 100.0 * observations
+        seen = 0
+        for bound, count in zip(bounds, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max_ns / 1e9
+
+
+class Metrics:
+    def __init__(self, namespace='packet_analyzer', buckets=LATENCY_BUCKETS, sample_every=1):
+        """
+        Initialize an empty registry
+        :param namespace: Prefix of the exported metric names
+        :param buckets: Upper bounds of the latency histogram buckets in seconds
+        :param sample_every: Time one packet in N; stage counts, totals and histograms are
+                             extrapolated from the timed packets (1 times every packet)
+        """
+        if sample_every < 1:
+            raise ValueError("sample_every must be at least 1")
+        self.namespace = namespace
+        self.sample_every = sample_every
+        self._countdown = 1
+        self.buckets = tuple(buckets)
+        self._bounds_ns = [int(bound * 1e9) for bound in self.buckets]
+        self.stages = {}
+        # (name, sorted label items) -> value
+        self.counters = {}
+        self.gauges = {}
+        self._gauge_callbacks = {}
+        self.started = time.time()
+        self.baseline_rss = current_rss()
+
+    def stage(self, name):
+        """StageStats of a stage, created on first use"""
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats(self._bounds_ns)
+        return stats
+
+    def tick(self):
+        """
+        Decide whether to time the next packet
+        :return: 0 to skip timing, else the number of packets the timed one stands for
+        """
+        self._countdown -= 1
+        if self._countdown > 0:
+            return 0
+        self._countdown = self.sample_every
+        return self.sample_every
+
+    def observe(self, stage, elapsed_ns, weight=1):
+        """
+        Record time spent on one packet in a stage
+        :param stage: Stage name
+        :param elapsed_ns: Elapsed time in nanoseconds (time.perf_counter_ns differences)
+        :param weight: Number of packets this observation stands for (see tick())
+        """
+        stats = self.stages.get(stage)
+        if stats is None:
+            stats = self.stage(stage)
+        stats.observe(elapsed_ns, weight)
+
+    def error(self, stage, weight=1):
+        """Count a packet a stage failed on"""
+        self.stage(stage).errors += weight
+
+    def count(self, name, value=1, **labels):
+        """Add to a counter, e.g. count('dropped_packets_total', reason='queue_full')"""
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """Set a gauge to a value"""
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def register_gauge(self, name, callback, **labels):
+        """Sample a gauge from a callable whenever metrics are read (e.g. a queue's depth)"""
+        self._gauge_callbacks[(name, tuple(sorted(labels.items())))] = callback
+
+    def reset(self):
+        """Clear stage statistics and counters (gauges and memory baseline are kept)"""
+        self.stages.clear()
+        self.counters.clear()
+        self.started = time.time()
+
+    def _sampled_gauges(self):
+        gauges = dict(self.gauges)
+        for key, callback in self._gauge_callbacks.items():
+            try:
+                gauges[key] = callback()
+            except Exception:
+                continue
+        rss = current_rss()
+        gauges[('resident_memory_bytes', ())] = rss
+        gauges[('peak_resident_memory_bytes', ())] = peak_rss()
+        gauges[('memory_growth_bytes', ())] = rss - self.baseline_rss
+        return gauges
+
+    def snapshot(self):
+        """
+        Current metrics as a dict
+        :return: {'uptime': seconds, 'stages': {stage: {...}}, 'counters': {...}, 'gauges': {...}}
+        """
+        stages = {}
+        for name, stats in list(self.stages.items()):
+            total = stats.total_ns / 1e9
+            stages[name] = {
+                'packets': stats.packets,
+                'errors': stats.errors,
+                'total_seconds': total,
+                'mean_seconds': total / stats.packets if stats.packets else 0.0,
+                'max_seconds': stats.max_ns / 1e9,
+                'p50_seconds': stats.percentile(50, self.buckets),
+                'p90_seconds': stats.percentile(90, self.buckets),
+                'p99_seconds': stats.percentile(99, self.buckets),
+                'packets_per_second': stats.packets / total if total else None
+            }
+
+        def flatten(values):
+            return {_label_name(name, labels): value for (name, labels), value in values.items()}
+
+        return {
+            'uptime': time.time() - self.started,
+            'stages': stages,
+            'counters': flatten(self.counters),
+            'gauges': flatten(self._sampled_gauges())
+        }
+
+    def to_prometheus(self):
+        """Metrics in the Prometheus text exposition format"""
+        prefix = self.namespace + '_' if self.namespace else ''
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f"# HELP {prefix}{name} {help_text}")
+            lines.append(f"# TYPE {prefix}{name} {kind}")
+
+        stages = list(self.stages.items())
+        header('stage_packets_total', 'counter', 'Packets handled per pipeline stage')
+        for name, stats in stages:
+            lines.append(f'{prefix}stage_packets_total{{stage="{_escape(name)}"}} {stats.packets}')
+        header('stage_errors_total', 'counter', 'Packets a pipeline stage failed on')
+        for name, stats in stages:
+            lines.append(f'{prefix}stage_errors_total{{stage="{_escape(name)}"}} {stats.errors}')
+        header('stage_latency_seconds', 'histogram', 'Time spent per pipeline stage invocation')
+        for name, stats in stages:
+            label = f'stage="{_escape(name)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, stats.buckets):
+                cumulative += count
+                lines.append(f'{prefix}stage_latency_seconds_bucket{{{label},le="{bound:g}"}} {cumulative}')
+            cumulative += stats.buckets[-1]
+            lines.append(f'{prefix}stage_latency_seconds_bucket{{{label},le="+Inf"}} {cumulative}')
+            lines.append(f'{prefix}stage_latency_seconds_sum{{{label}}} {stats.total_ns / 1e9:.9f}')
+            lines.append(f'{prefix}stage_latency_seconds_count{{{label}}} {cumulative}')
+
+        for kind, values in (('counter', dict(self.counters)), ('gauge', self._sampled_gauges())):
+            seen = set()
+            for (name, labels), value in sorted(values.items(), key=lambda item: item[0]):
+                if name not in seen:
+                    seen.add(name)
+                    header(name, kind, name.replace('_', ' '))
+                lines.append(f"{prefix}{_label_name(name, labels)} {value}")
+        lines.append(f"{prefix}uptime_seconds {time.time() - self.started:.3f}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """
+        Write the Prometheus text format to a file atomically (for the node_exporter
+        textfile collector, which must never see a partial file)
+        :param path: Destination path, conventionally ending in .prom
+        """
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(temporary, path)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_name(name, labels):
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    metrics = None
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.metrics.to_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(metrics, port=9108, host='127.0.0.1'):
+    """
+    Serve /metrics over HTTP from a background thread
+    :param metrics: Metrics to expose
+    :param port: TCP port (0 picks a free one, see server.server_address)
+    :param host: Address to bind (loopback by default, for a local scraper)
+    :return: The HTTP server; call shutdown() to stop it
+    """
+    handler = type('MetricsHandler', (_MetricsHandler,), {'metrics': metrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    return server
@@ -1,72 +1,193 @@
-from collections import defaultdict
-from datetime import datetime
-import dpkt
-import socket
+from collections import defaultdict, deque
+from operator import itemgetter
+from .fields import extract_fields
+from .flow_table import FlowTable, FLOW_KEYS
+from .sketches import DistinctCounter
+from .utils import merge_ordered
+
+# Default number of most recent timeline entries kept, so memory stays flat on long streams
+TIMELINE_SIZE = 100000
+
+def _new_flow():
+    return {
+        'packet_count': 0,
+        'byte_count': 0,
+        'start_time': None,
+        'end_time': None,
+        'protocols': set()
+    }
+
+def _distinct_counts(store):
+    """Iterate (key, distinct member count) over a dict of sets or a DistinctCounter"""
+    if isinstance(store, DistinctCounter):
+        return store.cardinalities()
+    return ((key, len(members)) for key, members in store.items())
 
 class PacketAnalyzer:
-    def __init__(self):
-        self.flows = defaultdict(list)
+    def __init__(self, timeline_size=TIMELINE_SIZE, flow_key='pair', flow_table=False,
+                 sketch_capacity=None, sketch_precision=10):
+        """
+        Initialize the analyzer
+        :param timeline_size: Keep only the most recent N timeline entries (None keeps all,
+                              growing by one entry per packet)
+        :param flow_key: 'pair' keys flows by (src, dst), '5tuple' by
+                         (src, dst, srcport, dstport, transport)
+        :param flow_table: Store flows in a compact columnar FlowTable instead of dicts
+        :param sketch_capacity: Count distinct ports per source and sources per destination
+                                with HyperLogLogs for at most this many keys, in fixed memory
+        :param sketch_precision: HyperLogLog precision (2**precision bytes per tracked key)
+        """
+        if flow_key not in FLOW_KEYS:
+            raise ValueError(f"Unknown flow key {flow_key!r}, expected one of {FLOW_KEYS}")
+        self.flow_key = flow_key
+        self.flow_table = flow_table
+        self.flow_stats = self._new_flow_store()
+        self.sketch_capacity = sketch_capacity
+        self.sketch_precision = sketch_precision
+        self.port_access = self._new_distinct_store()
+        self.dst_sources = self._new_distinct_store()
         self.conversations = defaultdict(int)
-        self.timeline = []
-        
+        self.timeline = deque(maxlen=timeline_size)
+
+    def _new_flow_store(self):
+        if self.flow_table:
+            return FlowTable(key=self.flow_key)
+        return defaultdict(_new_flow)
+
+    def _new_distinct_store(self):
+        if self.sketch_capacity:
+            return DistinctCounter(self.sketch_capacity, self.sketch_precision)
+        return defaultdict(set)
+
+    def _update_flow(self, flow_stats, fields):
+        """Fold a single packet into flow_stats"""
+        if self.flow_table:
+            self.timeline.append((fields.timestamp, flow_stats.add(fields)))
+            return
+
+        if self.flow_key == '5tuple':
+            has_ports = fields.transport and fields.srcport is not None
+            flow_key = (fields.src, fields.dst, fields.srcport, fields.dstport,
+                        fields.transport if has_ports else None)
+        else:
+            flow_key = (fields.src, fields.dst)
+
+        # Update flow statistics
+        flow = flow_stats[flow_key]
+        flow['packet_count'] += 1
+        if fields.transport and fields.srcport is not None:
+            flow['byte_count'] += fields.length
+            flow['protocols'].add(fields.transport)
+
+        # Update timeline
+        timestamp = fields.timestamp
+        self.timeline.append((timestamp, flow_key))
+
+        # Track first and last packet times
+        if flow['start_time'] is None or timestamp < flow['start_time']:
+            flow['start_time'] = timestamp
+        if flow['end_time'] is None or timestamp > flow['end_time']:
+            flow['end_time'] = timestamp
+
+    @staticmethod
+    def _update_port_access(port_access, fields):
+        """Track destination ports per source for port scan detection"""
+        if fields.is_tcp:
+            if isinstance(port_access, DistinctCounter):
+                port_access.add(fields.src, fields.dstport)
+            else:
+                port_access[fields.src].add(fields.dstport)
+
+    @staticmethod
+    def _update_dst_sources(dst_sources, fields):
+        """Track sources per destination for DDoS detection"""
+        if isinstance(dst_sources, DistinctCounter):
+            dst_sources.add(fields.dst, fields.src)
+        else:
+            dst_sources[fields.dst].add(fields.src)
+
+    def _update_conversation(self, fields):
+        key = tuple(sorted((fields.src, fields.dst)))
+        self.conversations[key] += 1
+
+    def update(self, fields):
+        """
+        Incrementally fold one packet into the analyzer's running flow, port scan
+        and conversation state
+        :param fields: PacketFields read from the packet by extract_fields
+        """
+        if fields.src is None:
+            return
+        self._update_flow(self.flow_stats, fields)
+        self._update_port_access(self.port_access, fields)
+        self._update_dst_sources(self.dst_sources, fields)
+        self._update_conversation(fields)
+
+    def merge(self, other):
+        """
+        Fold another PacketAnalyzer's running state into this one (e.g. from a parallel worker)
+        :param other: PacketAnalyzer to merge
+        :return: self
+        """
+        if self.flow_table:
+            self.flow_stats.merge(other.flow_stats)
+        else:
+            self._merge_flow_dicts(other.flow_stats)
+
+        if self.sketch_capacity:
+            self.port_access.merge(other.port_access)
+            self.dst_sources.merge(other.dst_sources)
+        else:
+            for src, ports in other.port_access.items():
+                self.port_access[src] |= ports
+
+            for dst, sources in other.dst_sources.items():
+                self.dst_sources[dst] |= sources
+
+        for key, count in other.conversations.items():
+            self.conversations[key] += count
+
+        self.timeline = merge_ordered(self.timeline, other.timeline, itemgetter(0))
+        return self
+
+    def _merge_flow_dicts(self, other_flows):
+        for key, theirs in other_flows.items():
+            flow = self.flow_stats[key]
+            flow['packet_count'] += theirs['packet_count']
+            flow['byte_count'] += theirs['byte_count']
+            flow['protocols'] |= theirs['protocols']
+            if flow['start_time'] is None or theirs['start_time'] < flow['start_time']:
+                flow['start_time'] = theirs['start_time']
+            if flow['end_time'] is None or theirs['end_time'] > flow['end_time']:
+                flow['end_time'] = theirs['end_time']
+
     def analyze_flow(self, packets):
         """
         Analyze packet flows between hosts
-        :param packets: List of packets to analyze
-        :return: Dictionary of flow statistics
+        :param packets: Iterable of packets to analyze (consumed in a single pass)
+        :return: Dictionary of flow statistics (a FlowTable mapping in flow_table mode)
         """
-        flow_stats = defaultdict(lambda: {
-            'packet_count': 0,
-            'byte_count': 0,
-            'start_time': None,
-            'end_time': None,
-            'protocols': set()
-        })
-        
+        flow_stats = self._new_flow_store()
+
         for packet in packets:
             try:
-                if hasattr(packet, 'ip'):
-                    src = packet.ip.src
-                    dst = packet.ip.dst
-                    flow_key = (src, dst)
-                    
-                    # Update flow statistics
-                    flow = flow_stats[flow_key]
-                    flow['packet_count'] += 1
-                    if hasattr(packet, packet.transport_layer):
-                        flow['byte_count'] += int(getattr(packet, packet.transport_layer).length)
-                        flow['protocols'].add(packet.transport_layer)
-                    
-                    # Update timeline
-                    timestamp = packet.sniff_time
-                    self.timeline.append((timestamp, flow_key))
-                    
-                    # Track first and last packet times
-                    if flow['start_time'] is None or timestamp < flow['start_time']:
-                        flow['start_time'] = timestamp
-                    if flow['end_time'] is None or timestamp > flow['end_time']:
-                        flow['end_time'] = timestamp
-                        
+                fields = extract_fields(packet)
+                if fields.src is not None:
+                    self._update_flow(flow_stats, fields)
             except AttributeError:
                 continue
-                
+
         return flow_stats
-        
-    def detect_anomalies(self, packets, threshold=100):
-        """
-        Detect potential network anomalies
-        :param packets: List of packets to analyze
-        :param threshold: Packet count threshold for alerting
-        :return: Dictionary of potential anomalies
-        """
+
+    @staticmethod
+    def _collect_anomalies(flow_stats, port_access, dst_sources, threshold, ddos_threshold):
         anomalies = {
             'high_volume_flows': [],
             'port_scans': defaultdict(int),
             'possible_ddos': []
         }
-        
+
         # Analyze flows for high volume
-        flow_stats = self.analyze_flow(packets)
         for flow, stats in flow_stats.items():
             if stats['packet_count'] > threshold:
                 anomalies['high_volume_flows'].append({
@@ -74,38 +195,67 @@ class PacketAnalyzer:
                     'packet_count': stats['packet_count'],
                     'duration': stats['end_time'] - stats['start_time']
                 })
-        
+
         # Detect port scanning patterns
-        port_access = defaultdict(lambda: defaultdict(int))
+        for src, port_count in _distinct_counts(port_access):
+            if port_count > 10:  # More than 10 distinct ports
+                anomalies['port_scans'][src] = port_count
+
+        # Many distinct sources converging on one destination
+        for dst, source_count in _distinct_counts(dst_sources):
+            if source_count > ddos_threshold:
+                anomalies['possible_ddos'].append({
+                    'target': dst,
+                    'source_count': source_count
+                })
+
+        return anomalies
+
+    def detect_anomalies(self, packets, threshold=100, ddos_threshold=50):
+        """
+        Detect potential network anomalies
+        :param packets: Iterable of packets to analyze (consumed in a single pass)
+        :param threshold: Packet count threshold for alerting
+        :param ddos_threshold: Distinct source count per destination for alerting
+        :return: Dictionary of potential anomalies
+        """
+        flow_stats = self._new_flow_store()
+        port_access = self._new_distinct_store()
+        dst_sources = self._new_distinct_store()
         for packet in packets:
             try:
-                if hasattr(packet, 'tcp'):
-                    src = packet.ip.src
-                    dst_port = packet.tcp.dstport
-                    port_access[src][dst_port] += 1
+                fields = extract_fields(packet)
+                if fields.src is not None:
+                    self._update_flow(flow_stats, fields)
+                    self._update_port_access(port_access, fields)
+                    self._update_dst_sources(dst_sources, fields)
             except AttributeError:
                 continue
-                
-        for src, ports in port_access.items():
-            if len(ports) > 10:  # More than 10 distinct ports
-                anomalies['port_scans'][src] = len(ports)
-                
-        return anomalies
-        
+
+        return self._collect_anomalies(flow_stats, port_access, dst_sources, threshold, ddos_threshold)
+
+    def get_anomalies(self, threshold=100, ddos_threshold=50):
+        """
+        Anomalies over everything folded in with update()
+        :param threshold: Packet count threshold for alerting
+        :param ddos_threshold: Distinct source count per destination for alerting
+        :return: Dictionary of potential anomalies
+        """
+        return self._collect_anomalies(self.flow_stats, self.port_access, self.dst_sources,
+                                       threshold, ddos_threshold)
+
     def get_conversation_stats(self, packets):
         """
         Get statistics about host conversations
-        :param packets: List of packets to analyze
+        :param packets: Iterable of packets to analyze (consumed in a single pass)
         :return: Dictionary of conversation statistics
         """
         for packet in packets:
             try:
-                if hasattr(packet, 'ip'):
-                    src = packet.ip.src
-                    dst = packet.ip.dst
-                    key = tuple(sorted((src, dst)))
-                    self.conversations[key] += 1
+                fields = extract_fields(packet)
+                if fields.src is not None:
+                    self._update_conversation(fields)
             except AttributeError:
                 continue
-                
+
         return self.conversations
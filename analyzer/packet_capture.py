@@ -1,18 +1,57 @@
-import pyshark
+"""
+Packet capture from interfaces and files.
+
+pyshark (and with it tshark's output parsers and asyncio) and the dpkt-based
+readers are imported on first use, so processes that only use one backend,
+or only import this module, do not pay for the other. ``pyshark`` is still
+reachable as a module attribute (``analyzer.packet_capture.pyshark``).
+"""
+import os
+import tempfile
+import time
 from datetime import datetime
 from .utils import get_network_interfaces
 
+BACKENDS = ('pyshark', 'dpkt')
+
+
+def _pyshark():
+    """Import pyshark on first use and bind it as a module global"""
+    module = globals().get('pyshark')
+    if module is None:
+        import pyshark as module
+        globals()['pyshark'] = module
+    return module
+
+
+def __getattr__(name):
+    if name == 'pyshark':
+        return _pyshark()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 class PacketCapture:
-    def __init__(self, interface=None, display_filter=None, output_file=None):
+    def __init__(self, interface=None, display_filter=None, output_file=None, backend='pyshark',
+                 bpf_filter=None):
         """
         Initialize packet capture
         :param interface: Network interface to capture from
-        :param display_filter: BPF filter for capture
+        :param display_filter: Wireshark display filter (e.g. 'http.request'), applied by tshark
+                               after every packet has been captured and dissected
         :param output_file: File to save captured packets
+        :param backend: PCAP decoder, 'pyshark' (tshark dissection) or 'dpkt' (fast native reader)
+        :param bpf_filter: BPF capture filter (e.g. 'tcp port 80'), applied before dissection:
+                           in the kernel for live captures, and by a raw-byte pre-filter for files
         """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+        if backend == 'dpkt' and display_filter:
+            raise ValueError("Display filters require the pyshark backend")
         self.interface = interface or get_network_interfaces()[0]
         self.display_filter = display_filter
+        self.bpf_filter = bpf_filter
         self.output_file = output_file
+        self.backend = backend
         self.capture = None
         
     def start_live_capture(self, packet_count=100, timeout=30):
@@ -23,9 +62,10 @@ class PacketCapture:
         :return: List of captured packets
         """
         try:
-            self.capture = pyshark.LiveCapture(
+            self.capture = _pyshark().LiveCapture(
                 interface=self.interface,
                 display_filter=self.display_filter,
+                bpf_filter=self.bpf_filter,
                 output_file=self.output_file
             )
             
@@ -37,19 +77,152 @@ class PacketCapture:
             print(f"Capture error: {e}")
             return None
             
+    def iter_live_capture(self, packet_count=None, timeout=None):
+        """
+        Stream packets from a live capture as they arrive
+        :param packet_count: Number of packets to capture (None for unlimited)
+        :param timeout: Stop once this many seconds have elapsed (checked as packets arrive)
+        :return: Generator of captured packets
+        """
+        try:
+            self.capture = _pyshark().LiveCapture(
+                interface=self.interface,
+                display_filter=self.display_filter,
+                bpf_filter=self.bpf_filter,
+                output_file=self.output_file
+            )
+
+            print(f"Starting capture on interface {self.interface}...")
+            deadline = time.monotonic() + timeout if timeout else None
+            for packet in self.capture.sniff_continuously(packet_count=packet_count):
+                yield packet
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+
+        except Exception as e:
+            print(f"Capture error: {e}")
+        finally:
+            self.stop_capture()
+
+    async def aiter_live_capture(self, packet_count=None):
+        """
+        Asynchronously stream packets from a live capture, for use in an asyncio event loop
+        :param packet_count: Number of packets to capture (None for unlimited)
+        :return: Async generator of captured packets
+        """
+        import asyncio
+
+        self.capture = _pyshark().LiveCapture(
+            interface=self.interface,
+            display_filter=self.display_filter,
+            bpf_filter=self.bpf_filter,
+            output_file=self.output_file,
+            eventloop=asyncio.get_running_loop()
+        )
+
+        print(f"Starting capture on interface {self.interface}...")
+        tshark_process = await self.capture._get_tshark_process(packet_count=packet_count)
+        parser = self.capture._setup_tshark_output_parser()
+        data = b""
+        captured = 0
+        try:
+            while not packet_count or captured < packet_count:
+                try:
+                    packet, data = await parser.get_packets_from_stream(
+                        tshark_process.stdout, data, got_first_packet=captured > 0)
+                except EOFError:
+                    break
+                if packet:
+                    captured += 1
+                    yield packet
+        finally:
+            await self.capture.close_async()
+
     def analyze_pcap_file(self, pcap_file):
         """
         Analyze packets from a PCAP file
         :param pcap_file: Path to PCAP file
         :return: List of packets
         """
+        filtered = None
         try:
-            self.capture = pyshark.FileCapture(pcap_file, display_filter=self.display_filter)
+            if self.backend == 'dpkt':
+                from .dpkt_reader import read_pcap
+                return list(read_pcap(pcap_file, bpf_filter=self.bpf_filter))
+            if self.bpf_filter:
+                pcap_file = filtered = self._prefilter(pcap_file)
+            self.capture = _pyshark().FileCapture(pcap_file, display_filter=self.display_filter)
             return list(self.capture)
         except Exception as e:
             print(f"PCAP analysis error: {e}")
             return None
+        finally:
+            if filtered is not None:
+                os.remove(filtered)
             
+    def iter_pcap_file(self, pcap_file):
+        """
+        Stream packets from a PCAP file without keeping them in memory
+        :param pcap_file: Path to PCAP file
+        :return: Generator of packets
+        """
+        filtered = None
+        try:
+            if self.backend == 'dpkt':
+                from .dpkt_reader import read_pcap
+                yield from read_pcap(pcap_file, bpf_filter=self.bpf_filter)
+                return
+            if self.bpf_filter:
+                pcap_file = filtered = self._prefilter(pcap_file)
+            self.capture = _pyshark().FileCapture(pcap_file, display_filter=self.display_filter,
+                                               keep_packets=False)
+            yield from self.capture
+        except Exception as e:
+            print(f"PCAP analysis error: {e}")
+        finally:
+            self.stop_capture()
+            if filtered is not None:
+                os.remove(filtered)
+
+    def query_pcap_file(self, pcap_file, start=None, end=None, host=None, port=None, index_path=None):
+        """
+        Decode only the packets of a PCAP file inside a time range and/or to or from a host
+        or port, seeking through a sidecar index (built on first use, see pcap_index)
+        :param pcap_file: Path to PCAP or PCAPNG file
+        :param start: Start of the time range (datetime or epoch seconds, inclusive)
+        :param end: End of the time range (datetime or epoch seconds, inclusive)
+        :param host: Address that must be the packet source or destination
+        :param port: Port that must be the packet source or destination port
+        :param index_path: Location of the index (defaults to <pcap_file>.idx)
+        :return: Generator of packets, decoded with dpkt whatever the backend (the BPF
+                 filter applies, display filters do not)
+        """
+        from .pcap_index import open_index
+
+        try:
+            index = open_index(pcap_file, index_path)
+            yield from index.query(start, end, host, port, bpf_filter=self.bpf_filter)
+        except Exception as e:
+            print(f"PCAP query error: {e}")
+
+    def _prefilter(self, pcap_file):
+        """
+        Apply the BPF filter to a capture file so tshark only dissects matching frames
+        (tshark cannot apply capture filters when reading files)
+        :param pcap_file: Path to PCAP file
+        :return: Path of a temporary pcap file holding the matching frames
+        """
+        from .bpf import filter_pcap
+
+        fd, filtered = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+        try:
+            filter_pcap(pcap_file, filtered, self.bpf_filter)
+        except Exception:
+            os.remove(filtered)
+            raise
+        return filtered
+
     def stop_capture(self):
         """Stop ongoing capture"""
         if self.capture:
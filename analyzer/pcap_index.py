@@ -0,0 +1,497 @@
+"""
+Sidecar indexes for random access into pcap/pcapng files.
+
+Answering "traffic between 14:02 and 14:05 from host X" by reading the
+whole capture costs time proportional to the file, not to the answer. A
+PacketIndex is built once per capture and records, for every packet, the
+byte offset and length of its frame and its timestamp. Packets are grouped
+into fixed-size blocks, and each block keeps its time bounds and Bloom
+filters of the addresses and ports it contains. A query first discards every
+block whose time range or filters rule it out, then checks the remaining
+packets' timestamps and headers, and only decodes the packets that match,
+reading their frames straight out of a memory map of the capture.
+
+The index is stored next to the capture (``<capture>.idx``) as npy columns
+written by the export module, so reopening it is a memory map too. It
+remembers the capture's size and modification time, the byte offset it
+reached and hashes of the indexed bytes. When a capture has only been
+appended to, the index is extended from its last complete block; when the
+indexed bytes changed, it is rebuilt.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from datetime import datetime
+
+from .bpf import compile_filter, parse_headers
+from .dpkt_reader import decode_packet
+from .export import Table, save_tables, load_results
+from .flow_table import _to_ns
+
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 1
+# Bytes hashed at the start of a capture and just before the indexed offset
+SAMPLE_SIZE = 1 << 16
+
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1000),
+    b'\xa1\xb2\xc3\xd4': ('>', 1000),
+    b'\x4d\x3c\xb2\xa1': ('<', 1),
+    b'\xa1\xb2\x3c\x4d': ('>', 1),
+}
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 1
+PCAPNG_OPB = 2
+PCAPNG_SPB = 3
+PCAPNG_EPB = 6
+PCAPNG_BYTE_ORDER = 0x1A2B3C4D
+PCAPNG_IF_TSRESOL = 9
+
+
+class PcapFormatError(ValueError):
+    pass
+
+
+def _bloom_positions(value, bits, hashes):
+    """Bit positions of a value in a Bloom filter of `bits` bits (double hashing over crc32)"""
+    first = zlib.crc32(value)
+    step = zlib.crc32(value, 0x9E3779B9) | 1
+    return [(first + i * step) % bits for i in range(hashes)]
+
+
+def _digest(data, start, stop):
+    return hashlib.sha256(data[start:stop]).hexdigest()
+
+
+def _pcap_records(data, start=0):
+    """
+    Yield (frame offset, captured length, timestamp ns, interface, end of record) from a
+    classic pcap, starting at the record at byte offset `start`
+    """
+    endian, ns_per_unit = PCAP_MAGIC[bytes(data[:4])]
+    record = struct.Struct(endian + 'IIII')
+    offset = max(start, 24)
+    size = len(data)
+    while offset + 16 <= size:
+        seconds, fraction, caplen, _ = record.unpack_from(data, offset)
+        frame = offset + 16
+        if frame + caplen > size:
+            break
+        offset = frame + caplen
+        yield frame, caplen, seconds * 1000000000 + fraction * ns_per_unit, 0, offset
+
+
+def _tsresol_ns(options, endian):
+    """Nanoseconds per timestamp unit from an IDB's options (default microseconds)"""
+    position = 0
+    while position + 4 <= len(options):
+        code, length = struct.unpack_from(endian + 'HH', options, position)
+        if code == 0:
+            break
+        if code == PCAPNG_IF_TSRESOL and length >= 1:
+            value = options[position + 4]
+            if value & 0x80:
+                return 1000000000 / (1 << (value & 0x7F))
+            return 10 ** (9 - value) if value <= 9 else 1 / 10 ** (value - 9)
+        position += 4 + (length + 3) // 4 * 4
+    return 1000
+
+
+def _pcapng_records(data, linktypes, start=0):
+    """
+    Yield (frame offset, captured length, timestamp ns, interface, end of block) from a
+    pcapng file, for the packet blocks at or after byte offset `start` (earlier blocks are
+    only walked for their section and interface headers)
+    :param linktypes: List receiving the link type of every interface, across sections
+    """
+    size = len(data)
+    offset = 0
+    endian = '<'
+    interfaces = []  # (global interface number, ns per timestamp unit) of the current section
+    last_ns = 0
+    while offset + 12 <= size:
+        block_type = struct.unpack_from('<I', data, offset)[0]
+        if block_type == PCAPNG_SHB:
+            magic = struct.unpack_from('<I', data, offset + 8)[0]
+            endian = '<' if magic == PCAPNG_BYTE_ORDER else '>'
+            interfaces = []
+        else:
+            block_type = struct.unpack_from(endian + 'I', data, offset)[0]
+        block_length = struct.unpack_from(endian + 'I', data, offset + 4)[0]
+        if block_length < 12 or offset + block_length > size:
+            break
+        body = offset + 8
+        if block_type == PCAPNG_IDB:
+            linktype = struct.unpack_from(endian + 'H', data, body)[0]
+            options = bytes(data[body + 8:offset + block_length - 4])
+            interfaces.append((len(linktypes), _tsresol_ns(options, endian)))
+            linktypes.append(linktype)
+        elif block_type in (PCAPNG_EPB, PCAPNG_OPB):
+            if block_type == PCAPNG_EPB:
+                interface, high, low, caplen = struct.unpack_from(endian + 'IIII', data, body)
+            else:
+                interface, _, high, low, caplen = struct.unpack_from(endian + 'HHIII', data, body)
+            if interface < len(interfaces):
+                number, ns_per_unit = interfaces[interface]
+                last_ns = int(((high << 32) | low) * ns_per_unit)
+                if offset >= start:
+                    yield body + 20, caplen, last_ns, number, offset + block_length
+        elif block_type == PCAPNG_SPB and interfaces and offset >= start:
+            original = struct.unpack_from(endian + 'I', data, body)[0]
+            # Simple packets carry no timestamp: reuse the previous packet's
+            yield body + 4, min(original, block_length - 16), last_ns, interfaces[0][0], offset + block_length
+        offset += block_length
+
+
+def iter_records(data, start=0):
+    """
+    Walk the frames of a capture without decoding them
+    :param data: Buffer (e.g. mmap) holding a whole pcap or pcapng file
+    :param start: Byte offset of the first record to return (an "end" value from a
+                  previous walk, to pick up records appended since)
+    :return: Tuple of (generator of (offset, caplen, timestamp ns, interface, end), list of
+             link types by interface, filled in as the generator runs); `end` is the byte
+             offset just past the record
+    """
+    magic = bytes(data[:4])
+    if magic in PCAP_MAGIC:
+        endian = PCAP_MAGIC[magic][0]
+        linktypes = [struct.unpack_from(endian + 'I', data, 20)[0] & 0x0FFFFFFF]
+        return _pcap_records(data, start), linktypes
+    if len(data) >= 4 and struct.unpack_from('<I', data, 0)[0] == PCAPNG_SHB:
+        linktypes = []
+        return _pcapng_records(data, linktypes, start), linktypes
+    raise PcapFormatError("Not a pcap or pcapng file")
+
+
+def index_path_for(pcap_file):
+    return pcap_file + INDEX_SUFFIX
+
+
+def _to_query_ns(timestamp):
+    if timestamp is None:
+        return None
+    if isinstance(timestamp, datetime):
+        return _to_ns(timestamp)
+    return int(timestamp * 1000000000)
+
+
+class PacketIndex:
+    def __init__(self, pcap_file, packets, blocks, metadata):
+        """
+        Use build_index() or open_index() rather than constructing directly
+        :param pcap_file: Path to the indexed capture
+        :param packets: Table with offset, caplen, ts_ns and interface per packet
+        :param blocks: Table with first, count, start_ns, end_ns and the addresses/ports Bloom filters
+        :param metadata: Index parameters and the capture's size and mtime
+        """
+        self.pcap_file = pcap_file
+        self.packets = packets
+        self.blocks = blocks
+        self.metadata = metadata
+        self.linktypes = metadata['linktypes']
+
+    def __len__(self):
+        return len(self.packets['offset'])
+
+    def is_current(self):
+        """True while the capture has the size and mtime it had when indexed"""
+        try:
+            stat = os.stat(self.pcap_file)
+        except OSError:
+            return False
+        return stat.st_size == self.metadata['size'] and stat.st_mtime_ns == self.metadata['mtime_ns']
+
+    def is_prefix(self):
+        """True if the capture still starts with the bytes indexed (it was only appended to)"""
+        end = self.metadata.get('end')
+        if end is None:
+            return False
+        try:
+            with open(self.pcap_file, 'rb') as f:
+                if os.fstat(f.fileno()).st_size < end:
+                    return False
+                head = f.read(min(end, SAMPLE_SIZE))
+                f.seek(max(0, end - SAMPLE_SIZE))
+                tail = f.read(min(end, SAMPLE_SIZE))
+        except OSError:
+            return False
+        return (_digest(head, 0, len(head)) == self.metadata.get('head') and
+                _digest(tail, 0, len(tail)) == self.metadata.get('tail'))
+
+    def _bloom_mask(self, column, value, bits):
+        """Blocks whose Bloom filter may contain the value"""
+        import numpy as np
+
+        filters = self.blocks[column]
+        mask = np.ones(len(filters), dtype=bool)
+        for position in _bloom_positions(value, bits, self.metadata['hashes']):
+            mask &= (filters[:, position >> 3] >> (position & 7)) & 1 == 1
+        return mask
+
+    def candidate_blocks(self, start=None, end=None, host=None, port=None):
+        """
+        Blocks that may hold packets matching a query
+        :return: NumPy array of block numbers
+        """
+        import numpy as np
+
+        mask = np.ones(len(self.blocks['first']), dtype=bool)
+        start_ns, end_ns = _to_query_ns(start), _to_query_ns(end)
+        if start_ns is not None:
+            mask &= self.blocks['end_ns'] >= start_ns
+        if end_ns is not None:
+            mask &= self.blocks['start_ns'] <= end_ns
+        if host is not None:
+            mask &= self._bloom_mask('addresses', _packed_address(host), self.metadata['address_bits'])
+        if port is not None:
+            mask &= self._bloom_mask('ports', int(port).to_bytes(2, 'big'), self.metadata['port_bits'])
+        return np.flatnonzero(mask)
+
+    def select(self, start=None, end=None, host=None, port=None):
+        """
+        Packet numbers passing the block filters and the exact time range
+        (host and port are confirmed on the frame by packets())
+        :param start: Start of the time range (datetime or epoch seconds, inclusive)
+        :param end: End of the time range (datetime or epoch seconds, inclusive)
+        :param host: Address that must be the source or destination
+        :param port: Port that must be the source or destination port
+        :return: NumPy array of packet numbers in capture order
+        """
+        import numpy as np
+
+        blocks = self.candidate_blocks(start, end, host, port)
+        if not len(blocks):
+            return np.empty(0, dtype=np.int64)
+        first = self.blocks['first'][blocks].astype(np.int64)
+        count = self.blocks['count'][blocks].astype(np.int64)
+        # Concatenate the packet ranges of the candidate blocks
+        steps = np.ones(int(count.sum()), dtype=np.int64)
+        boundaries = np.cumsum(count)[:-1]
+        steps[0] = first[0]
+        steps[boundaries] = first[1:] - (first[:-1] + count[:-1] - 1)
+        selected = np.cumsum(steps)
+        timestamps = self.packets['ts_ns'][selected]
+        start_ns, end_ns = _to_query_ns(start), _to_query_ns(end)
+        if start_ns is not None:
+            selected = selected[timestamps >= start_ns]
+            timestamps = self.packets['ts_ns'][selected]
+        if end_ns is not None:
+            selected = selected[timestamps <= end_ns]
+        return selected
+
+    def frames(self, start=None, end=None, host=None, port=None, bpf_filter=None):
+        """
+        Raw frames matching a query, read from a memory map of the capture
+        :param bpf_filter: Additional BPF expression the frames must match
+        :return: Generator of (timestamp ns, frame bytes, link type)
+        """
+        selected = self.select(start, end, host, port)
+        if not len(selected):
+            return
+        address = _packed_address(host) if host is not None else None
+        port = int(port) if port is not None else None
+        filters = {}
+        offsets = self.packets['offset']
+        lengths = self.packets['caplen']
+        timestamps = self.packets['ts_ns']
+        interfaces = self.packets['interface']
+        with open(self.pcap_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for number in selected:
+                offset = int(offsets[number])
+                frame = data[offset:offset + int(lengths[number])]
+                linktype = self.linktypes[interfaces[number]]
+                if address is not None or port is not None:
+                    try:
+                        header = parse_headers(frame, linktype)
+                    except (IndexError, struct.error):
+                        continue
+                    if address is not None and address not in (header.src, header.dst):
+                        continue
+                    if port is not None and port not in (header.sport, header.dport):
+                        continue
+                if bpf_filter:
+                    matches = filters.get(linktype)
+                    if matches is None:
+                        matches = filters[linktype] = compile_filter(bpf_filter, linktype)
+                    if not matches(frame):
+                        continue
+                yield int(timestamps[number]), frame, linktype
+
+    def query(self, start=None, end=None, host=None, port=None, bpf_filter=None):
+        """
+        Decode the packets matching a query
+        :return: Generator of DpktPacket objects in capture order
+        """
+        for timestamp_ns, frame, linktype in self.frames(start, end, host, port, bpf_filter):
+            yield decode_packet(timestamp_ns / 1e9, frame, linktype)
+
+
+def _packed_address(host):
+    import socket
+
+    try:
+        return socket.inet_aton(host)
+    except OSError:
+        return socket.inet_pton(socket.AF_INET6, host)
+
+
+def build_index(pcap_file, index_path=None, block_size=4096, address_bits=8192, port_bits=4096, hashes=3,
+                extend=None):
+    """
+    Index a capture file and save the index next to it
+    :param pcap_file: Path to a pcap or pcapng file
+    :param index_path: Where to store the index (defaults to <pcap_file>.idx)
+    :param block_size: Packets per block
+    :param address_bits: Size of each block's address Bloom filter in bits (multiple of 8)
+    :param port_bits: Size of each block's port Bloom filter in bits (multiple of 8)
+    :param hashes: Bit positions set per Bloom filter member
+    :param extend: Index of an earlier prefix of the capture (see PacketIndex.is_prefix) built
+                   with the same parameters; its complete blocks are kept and only the
+                   records after them are read
+    :return: PacketIndex
+    """
+    import numpy as np
+
+    index_path = index_path or index_path_for(pcap_file)
+    stat = os.stat(pcap_file)
+    offsets, lengths, timestamps, interfaces = array('Q'), array('I'), array('q'), array('H')
+    address_filters, port_filters = [], []
+    address_positions, port_positions = {}, {}
+    # Byte offset just past the last record of the last complete block
+    block_end = 0
+    if extend is not None and all(extend.metadata.get(name) == value for name, value in (
+            ('block_size', block_size), ('address_bits', address_bits), ('port_bits', port_bits),
+            ('hashes', hashes))):
+        kept = len(extend) // block_size
+        for values, name in ((offsets, 'offset'), (lengths, 'caplen'), (timestamps, 'ts_ns'),
+                             (interfaces, 'interface')):
+            values.frombytes(extend.packets[name][:kept * block_size].tobytes())
+        address_filters = list(extend.blocks['addresses'][:kept])
+        port_filters = list(extend.blocks['ports'][:kept])
+        block_end = extend.metadata['block_end'] if kept else 0
+
+    def close_block(addresses, ports):
+        address_filter = np.zeros(address_bits // 8, dtype=np.uint8)
+        for value in addresses:
+            positions = address_positions.get(value)
+            if positions is None:
+                positions = address_positions[value] = _bloom_positions(value, address_bits, hashes)
+            for position in positions:
+                address_filter[position >> 3] |= 1 << (position & 7)
+        port_filter = np.zeros(port_bits // 8, dtype=np.uint8)
+        for value in ports:
+            positions = port_positions.get(value)
+            if positions is None:
+                positions = port_positions[value] = _bloom_positions(value.to_bytes(2, 'big'), port_bits, hashes)
+            for position in positions:
+                port_filter[position >> 3] |= 1 << (position & 7)
+        address_filters.append(address_filter)
+        port_filters.append(port_filter)
+        # Bound the memo of hashed values on captures with huge address spaces
+        if len(address_positions) > 1 << 20:
+            address_positions.clear()
+
+    with open(pcap_file, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else memoryview(b'') as data:
+            records, linktypes = iter_records(data, block_end)
+            addresses, ports = set(), set()
+            end = block_end
+            for offset, caplen, timestamp_ns, interface, end in records:
+                offsets.append(offset)
+                lengths.append(caplen)
+                timestamps.append(timestamp_ns)
+                interfaces.append(interface)
+                try:
+                    header = parse_headers(data[offset:offset + caplen], linktypes[interface])
+                except (IndexError, struct.error):
+                    header = None
+                if header is not None and header.src is not None:
+                    addresses.add(header.src)
+                    addresses.add(header.dst)
+                    if header.sport is not None:
+                        ports.add(header.sport)
+                        ports.add(header.dport)
+                if len(offsets) % block_size == 0:
+                    close_block(addresses, ports)
+                    addresses, ports = set(), set()
+                    block_end = end
+            if len(offsets) % block_size:
+                close_block(addresses, ports)
+            head = _digest(data, 0, min(end, SAMPLE_SIZE))
+            tail = _digest(data, max(0, end - SAMPLE_SIZE), end)
+
+    def column(values, dtype):
+        return np.frombuffer(values, dtype=dtype).copy() if len(values) else np.empty(0, dtype=dtype)
+
+    ts_ns = column(timestamps, np.int64)
+    firsts = np.arange(0, len(offsets), block_size, dtype=np.uint64)
+    counts = np.minimum(block_size, len(offsets) - firsts.astype(np.int64)).astype(np.uint32)
+    starts = np.minimum.reduceat(ts_ns, firsts.astype(np.int64)) if len(ts_ns) else np.empty(0, np.int64)
+    ends = np.maximum.reduceat(ts_ns, firsts.astype(np.int64)) if len(ts_ns) else np.empty(0, np.int64)
+    packets = Table({
+        'offset': column(offsets, np.uint64),
+        'caplen': column(lengths, np.uint32),
+        'ts_ns': ts_ns,
+        'interface': column(interfaces, np.uint16)
+    })
+    blocks = Table({
+        'first': firsts,
+        'count': counts,
+        'start_ns': starts,
+        'end_ns': ends,
+        'addresses': np.stack(address_filters) if address_filters else
+            np.empty((0, address_bits // 8), dtype=np.uint8),
+        'ports': np.stack(port_filters) if port_filters else np.empty((0, port_bits // 8), dtype=np.uint8)
+    })
+    metadata = {
+        'version': INDEX_VERSION,
+        'source': os.path.basename(pcap_file),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'end': end,
+        'block_end': block_end,
+        'head': head,
+        'tail': tail,
+        'linktypes': linktypes,
+        'block_size': block_size,
+        'address_bits': address_bits,
+        'port_bits': port_bits,
+        'hashes': hashes
+    }
+    save_tables(index_path, {'packets': packets, 'blocks': blocks}, format='npy', metadata=metadata)
+    return PacketIndex(pcap_file, packets, blocks, metadata)
+
+
+def open_index(pcap_file, index_path=None, build=True, **options):
+    """
+    Load a capture's index, extending it if the capture was appended to and rebuilding
+    it if it is missing or the indexed bytes changed
+    :param pcap_file: Path to a pcap or pcapng file
+    :param index_path: Location of the index (defaults to <pcap_file>.idx)
+    :param build: Build a missing or stale index (otherwise return None)
+    :param options: Passed to build_index (an extended index keeps its parameters
+                    unless they are given)
+    :return: PacketIndex, or None
+    """
+    index_path = index_path or index_path_for(pcap_file)
+    index = None
+    try:
+        results = load_results(index_path)
+        metadata = results.metadata
+        if metadata.get('version') == INDEX_VERSION:
+            index = PacketIndex(pcap_file, results.table('packets'), results.table('blocks'), metadata)
+            if index.is_current():
+                return index
+    except (OSError, ValueError, KeyError):
+        index = None
+    if not build:
+        return None
+    if index is not None and index.is_prefix():
+        for name in ('block_size', 'address_bits', 'port_bits', 'hashes'):
+            options.setdefault(name, index.metadata[name])
+        return build_index(pcap_file, index_path, extend=index, **options)
+    return build_index(pcap_file, index_path, **options)
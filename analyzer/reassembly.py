@@ -0,0 +1,410 @@
+"""
+TCP stream reassembly for application-layer parsing.
+
+Per-packet dissection only sees the bytes of one segment, so an HTTP request
+split across segments is missed and pipelined requests in one segment are
+counted once. TCPReassembler tracks each direction of a connection (keyed by
+5-tuple), orders segments by sequence number, buffers out-of-order segments,
+drops retransmitted bytes and tears streams down on FIN/RST. The ordered byte
+stream of each direction is fed to a stream parser that emits complete
+messages (HTTP requests, DNS-over-TCP messages).
+
+Memory stays bounded: each direction's unparsed buffer and out-of-order
+queue are capped, connections idle for longer than `idle_timeout` are
+evicted, and at most `max_connections` are tracked (least recently active
+are dropped first). Payloads are trimmed with memoryview slices; bytes are
+copied once, into the direction's parse buffer, which parsers consume in
+place.
+"""
+import struct
+from collections import OrderedDict
+
+from .signatures import payload_bytes
+
+TH_FIN = 0x01
+TH_SYN = 0x02
+TH_RST = 0x04
+
+HTTP_PORTS = (80, 8000, 8008, 8080, 8888)
+DNS_PORTS = (53, 5353)
+HTTP_METHODS = (b'GET ', b'POST ', b'PUT ', b'HEAD ', b'DELETE ', b'OPTIONS ',
+                b'PATCH ', b'CONNECT ', b'TRACE ')
+
+_SEQ_MOD = 1 << 32
+
+
+def _seq_diff(a, b):
+    """Signed distance from sequence number b to a, modulo 2**32"""
+    return (a - b + (1 << 31)) % _SEQ_MOD - (1 << 31)
+
+
+def tcp_segment(packet):
+    """
+    Read the sequence number, flags and payload of a TCP packet
+    :param packet: DpktPacket or pyshark packet
+    :return: Tuple of (seq, flags, payload) or None if they are unavailable
+    """
+    tcp = packet.tcp
+    try:
+        seq = getattr(tcp, 'seq_raw', None)
+        seq = int(seq if seq is not None else tcp.seq)
+        flags = tcp.flags
+        flags = int(flags, 16) if isinstance(flags, str) else int(flags)
+    except (TypeError, ValueError):
+        return None
+    return seq, flags, payload_bytes(packet) or b''
+
+
+class HTTPRequestParser:
+    """Incremental parser for a client-to-server HTTP/1.x byte stream"""
+    kind = 'http'
+
+    def __init__(self):
+        # Request body bytes still to skip, or -1 while inside a chunked body
+        self.body_remaining = 0
+        # Bytes of an incomplete header block (from the start of the buffer) already searched
+        # for its end, so a header arriving in many segments is scanned once
+        self.scanned = 0
+
+    def _skip_chunked(self, buffer, position):
+        """Skip chunked body data; return the new position and whether the body ended"""
+        while True:
+            line_end = buffer.find(b'\r\n', position)
+            if line_end < 0:
+                return position, False
+            try:
+                size = int(bytes(buffer[position:line_end]).split(b';', 1)[0], 16)
+            except ValueError:
+                raise ValueError("Malformed chunk size")
+            if size == 0:
+                trailer_end = buffer.find(b'\r\n\r\n', line_end)
+                if buffer[line_end + 2:line_end + 4] == b'\r\n':
+                    return line_end + 4, True
+                if trailer_end < 0:
+                    return position, False
+                return trailer_end + 4, True
+            chunk_end = line_end + 2 + size + 2
+            if chunk_end > len(buffer):
+                return position, False
+            position = chunk_end
+
+    def feed(self, buffer):
+        """
+        Parse complete requests at the start of the buffer
+        :param buffer: bytearray holding the unparsed stream (the caller removes the
+                       consumed bytes before the next call)
+        :return: Tuple of (list of request dicts, number of bytes consumed)
+        """
+        requests = []
+        position = 0
+        while position < len(buffer):
+            if self.body_remaining > 0:
+                skipped = min(self.body_remaining, len(buffer) - position)
+                self.body_remaining -= skipped
+                position += skipped
+                continue
+            if self.body_remaining < 0:
+                position, done = self._skip_chunked(buffer, position)
+                if not done:
+                    break
+                self.body_remaining = 0
+                continue
+
+            header_end = buffer.find(b'\r\n\r\n', position + self.scanned)
+            if header_end < 0:
+                # The unconsumed bytes start at position; keep 3 for a terminator split
+                # across segments
+                self.scanned = max(len(buffer) - position - 3, 0)
+                break
+            self.scanned = 0
+            lines = bytes(buffer[position:header_end]).split(b'\r\n')
+            position = header_end + 4
+            parts = lines[0].split(b' ')
+            if len(parts) < 3 or not parts[2].startswith(b'HTTP/'):
+                raise ValueError("Not an HTTP request stream")
+            request = {
+                'method': parts[0].decode('latin-1'),
+                'uri': parts[1].decode('latin-1'),
+                'host': '',
+                'user_agent': ''
+            }
+            for line in lines[1:]:
+                name, sep, value = line.partition(b':')
+                if not sep:
+                    continue
+                name = name.strip().lower()
+                value = value.strip()
+                if name == b'host':
+                    request['host'] = value.decode('latin-1')
+                elif name == b'user-agent':
+                    request['user_agent'] = value.decode('latin-1')
+                elif name == b'content-length':
+                    self.body_remaining = int(value)
+                elif name == b'transfer-encoding' and value.lower() == b'chunked':
+                    self.body_remaining = -1
+            requests.append(request)
+        return requests, position
+
+
+class DNSStreamParser:
+    """Parser for length-prefixed DNS messages over TCP"""
+    kind = 'dns'
+
+    def feed(self, buffer):
+        """
+        Parse complete DNS messages at the start of the buffer
+        :param buffer: bytearray holding the unparsed stream
+        :return: Tuple of (list of query dicts, number of bytes consumed)
+        """
+        import dpkt
+
+        messages = []
+        position = 0
+        view = memoryview(buffer)
+        try:
+            while len(buffer) - position >= 2:
+                length = struct.unpack_from('!H', buffer, position)[0]
+                if len(buffer) - position - 2 < length:
+                    break
+                try:
+                    msg = dpkt.dns.DNS(bytes(view[position + 2:position + 2 + length]))
+                except (dpkt.UnpackError, IndexError, struct.error):
+                    msg = None
+                position += 2 + length
+                if msg is not None and msg.qd:
+                    messages.append({
+                        'query': msg.qd[0].name,
+                        'type': str(msg.qd[0].type),
+                        'response': msg.qr == dpkt.dns.DNS_R,
+                        'id': msg.id,
+                        'rcode': msg.rcode
+                    })
+        finally:
+            view.release()
+        return messages, position
+
+
+def select_parser(srcport, dstport, payload):
+    """
+    Choose a stream parser for one direction of a connection
+    :param srcport: Source port of the direction
+    :param dstport: Destination port of the direction
+    :param payload: First payload bytes seen in the direction
+    :return: Parser instance, or None to leave the direction unparsed
+    """
+    if srcport in DNS_PORTS or dstport in DNS_PORTS:
+        return DNSStreamParser()
+    if dstport in HTTP_PORTS or bytes(payload[:8]).startswith(HTTP_METHODS):
+        return HTTPRequestParser()
+    return None
+
+
+class _Direction:
+    __slots__ = ('next_seq', 'pending', 'pending_bytes', 'buffer', 'parser', 'fin_seq', 'closed')
+
+    def __init__(self):
+        self.next_seq = None
+        self.pending = {}
+        self.pending_bytes = 0
+        self.buffer = bytearray()
+        # None until the first payload picks a parser, False if the direction is not parsed
+        self.parser = None
+        self.fin_seq = None
+        self.closed = False
+
+
+class _Connection:
+    __slots__ = ('directions', 'last_seen')
+
+    def __init__(self):
+        self.directions = (_Direction(), _Direction())
+        self.last_seen = 0.0
+
+
+class TCPReassembler:
+    def __init__(self, parser_factory=select_parser, max_buffer=1 << 20, max_out_of_order=1 << 18,
+                 idle_timeout=120.0, max_connections=100000):
+        """
+        Initialize the reassembler
+        :param parser_factory: Callable (srcport, dstport, first payload) -> parser or None
+        :param max_buffer: Maximum unparsed bytes kept per direction; beyond it the
+                           direction is considered unparseable and dropped
+        :param max_out_of_order: Maximum out-of-order bytes buffered per direction; beyond
+                                 it the missing data is skipped as a gap
+        :param idle_timeout: Evict connections without packets for this many seconds
+        :param max_connections: Maximum number of connections tracked
+        """
+        self.parser_factory = parser_factory
+        self.max_buffer = max_buffer
+        self.max_out_of_order = max_out_of_order
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self._connections = OrderedDict()
+        self._last_sweep = None
+        self.stats = {
+            'segments': 0,
+            'retransmits': 0,
+            'out_of_order': 0,
+            'gaps': 0,
+            'dropped_bytes': 0,
+            'evicted': 0,
+            'messages': 0
+        }
+
+    def __len__(self):
+        return len(self._connections)
+
+    def process(self, fields, seq, flags, payload):
+        """
+        Add one TCP segment
+        :param fields: PacketFields read from the packet by extract_fields
+        :param seq: Absolute sequence number
+        :param flags: TCP flags as an int
+        :param payload: Segment payload bytes
+        :return: List of (kind, message dict) completed by this segment
+        """
+        srcport = int(fields.srcport)
+        dstport = int(fields.dstport)
+        source = (fields.src, srcport)
+        target = (fields.dst, dstport)
+        key = (source, target) if source <= target else (target, source)
+        now = fields.timestamp.timestamp() if fields.timestamp is not None else 0.0
+        self.stats['segments'] += 1
+
+        connection = self._connections.get(key)
+        if flags & TH_RST:
+            if connection is not None:
+                del self._connections[key]
+            return []
+        if connection is None:
+            connection = self._connections[key] = _Connection()
+            if len(self._connections) > self.max_connections:
+                self._connections.popitem(last=False)
+                self.stats['evicted'] += 1
+        else:
+            self._connections.move_to_end(key)
+        connection.last_seen = now
+        direction = connection.directions[0 if source <= target else 1]
+
+        if flags & TH_SYN:
+            seq = (seq + 1) % _SEQ_MOD
+            direction.next_seq = seq
+        elif direction.next_seq is None:
+            # Stream picked up mid-connection
+            direction.next_seq = seq
+        if flags & TH_FIN:
+            direction.fin_seq = (seq + len(payload)) % _SEQ_MOD
+
+        messages = []
+        if payload and direction.parser is None:
+            direction.parser = self.parser_factory(srcport, dstport, payload) or False
+        if payload and direction.parser:
+            self._add_segment(direction, seq, payload, messages)
+        # Also reached when this segment filled the gap before an earlier, buffered FIN
+        self._close_if_finished(key, connection, direction)
+
+        if self._last_sweep is None:
+            self._last_sweep = now
+        elif now - self._last_sweep >= self.idle_timeout / 2:
+            self.expire(now)
+        return messages
+
+    def _close_if_finished(self, key, connection, direction):
+        """Close a direction once every byte up to its FIN was delivered, and the connection
+        once both directions are closed"""
+        if direction.closed or direction.fin_seq is None:
+            return
+        # Directions left unparsed close at once; others (including those whose parser is
+        # not chosen yet) wait for the bytes still missing before the FIN
+        if direction.parser is not False and _seq_diff(direction.next_seq, direction.fin_seq) < 0:
+            return
+        direction.closed = True
+        if all(d.closed for d in connection.directions):
+            del self._connections[key]
+
+    def _add_segment(self, direction, seq, payload, messages):
+        offset = _seq_diff(seq, direction.next_seq)
+        if offset > 0:
+            # Future data: hold until the gap is filled
+            if seq in direction.pending:
+                self.stats['retransmits'] += 1
+                return
+            direction.pending[seq] = bytes(payload)
+            direction.pending_bytes += len(payload)
+            self.stats['out_of_order'] += 1
+            if direction.pending_bytes > self.max_out_of_order:
+                self._skip_gap(direction)
+                self._drain(direction, messages)
+            return
+        if offset + len(payload) <= 0:
+            self.stats['retransmits'] += 1
+            return
+        if offset < 0:
+            # Partial retransmission: keep only the new bytes
+            payload = memoryview(payload)[-offset:]
+        self._deliver(direction, payload, messages)
+        self._drain(direction, messages)
+
+    def _drain(self, direction, messages):
+        """Deliver buffered segments that have become contiguous"""
+        while direction.pending and direction.parser:
+            seq = min(direction.pending, key=lambda s: _seq_diff(s, direction.next_seq))
+            offset = _seq_diff(seq, direction.next_seq)
+            if offset > 0:
+                break
+            data = direction.pending.pop(seq)
+            direction.pending_bytes -= len(data)
+            if offset + len(data) <= 0:
+                self.stats['retransmits'] += 1
+                continue
+            self._deliver(direction, memoryview(data)[-offset:] if offset else data, messages)
+
+    def _skip_gap(self, direction):
+        """Give up on missing bytes and resume at the earliest buffered segment"""
+        seq = min(direction.pending, key=lambda s: _seq_diff(s, direction.next_seq))
+        self.stats['gaps'] += 1
+        # A message spanning the gap cannot be parsed
+        self.stats['dropped_bytes'] += len(direction.buffer)
+        direction.buffer.clear()
+        direction.parser = type(direction.parser)()
+        direction.next_seq = seq
+
+    def _deliver(self, direction, data, messages):
+        direction.next_seq = (direction.next_seq + len(data)) % _SEQ_MOD
+        buffer = direction.buffer
+        buffer += data
+        kind = direction.parser.kind
+        try:
+            parsed, consumed = direction.parser.feed(buffer)
+        except ValueError:
+            parsed, consumed = [], len(buffer)
+            self.stats['dropped_bytes'] += len(buffer)
+            direction.parser = False
+        if consumed:
+            del buffer[:consumed]
+        if len(buffer) > self.max_buffer:
+            self.stats['dropped_bytes'] += len(buffer)
+            buffer.clear()
+            direction.parser = False
+        for message in parsed:
+            messages.append((kind, message))
+        self.stats['messages'] += len(parsed)
+
+    def expire(self, now):
+        """
+        Evict connections idle for longer than idle_timeout
+        :param now: Current capture time in epoch seconds
+        :return: Number of connections evicted
+        """
+        self._last_sweep = now
+        cutoff = now - self.idle_timeout
+        stale = [key for key, connection in self._connections.items() if connection.last_seen < cutoff]
+        for key in stale:
+            del self._connections[key]
+        self.stats['evicted'] += len(stale)
+        return len(stale)
+
+    def buffered_bytes(self):
+        """Total bytes held in parse buffers and out-of-order queues"""
+        return sum(len(d.buffer) + d.pending_bytes
+                   for connection in self._connections.values() for d in connection.directions)
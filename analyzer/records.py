@@ -0,0 +1,521 @@
+"""
+Compact storage for HTTP request and DNS query records.
+
+A dict per record repeats every key, every hostname and an isoformat()
+timestamp string. RecordStore keeps records as columns instead: field
+values are interned into one table and stored as 32-bit ids, booleans as
+bytes and timestamps as float epoch seconds, all in ``array`` columns. The
+store still behaves like a sequence of dicts (len(), indexing, iteration),
+rebuilding a record only when it is read.
+
+With max_records the store is a ring buffer that keeps the newest records;
+with a spill_path the records pushed out of the ring are appended to a JSON
+lines file instead of being discarded. Aggregates (top values of chosen
+fields and, for DNS, NXDOMAIN rate and query-to-response latency) are
+updated as records arrive, so reading them never re-scans the records.
+"""
+import heapq
+import json
+import os
+from array import array
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from itertools import chain
+from operator import itemgetter
+
+from .sketches import SpaceSaving
+
+HTTP_FIELDS = ('method', 'uri', 'host', 'user_agent')
+DNS_FIELDS = ('query', 'type', 'response', 'rcode')
+
+DNS_RCODE_NXDOMAIN = 3
+
+
+def to_epoch(timestamp):
+    """Epoch seconds of a datetime, float or anything convertible to float"""
+    if isinstance(timestamp, datetime):
+        return timestamp.timestamp()
+    try:
+        return float(timestamp.timestamp())
+    except (AttributeError, TypeError, ValueError):
+        pass
+    try:
+        return float(timestamp)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _isoformat(epoch):
+    return datetime.fromtimestamp(epoch).isoformat()
+
+
+class InternTable:
+    """Bidirectional mapping between hashable values and small integer ids"""
+    __slots__ = ('ids', 'values')
+
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def intern(self, value):
+        index = self.ids.get(value)
+        if index is None:
+            index = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+
+class RecordStore:
+    def __init__(self, fields, max_records=None, spill_path=None, counted=(), sketch_capacity=None):
+        """
+        Initialize an empty store
+        :param fields: Names of the record fields (besides 'timestamp'); a field named
+                       'response' is stored as a boolean
+        :param max_records: Keep only the newest N records (None keeps all)
+        :param spill_path: JSON lines file receiving records pushed out of the ring buffer
+        :param counted: Fields whose values are counted incrementally for top()
+        :param sketch_capacity: Count values in SpaceSaving summaries of this size
+                                instead of exact dicts
+        """
+        self.fields = tuple(fields)
+        self.maxlen = max_records
+        self.spill_path = spill_path
+        self.sketch_capacity = sketch_capacity
+        # Records ever added, including those evicted from the ring buffer
+        self.total = 0
+        self.spilled = 0
+        self._values = InternTable()
+        self._columns = {name: array('B' if name == 'response' else 'I') for name in self.fields}
+        self._column_list = list(self._columns.values())
+        self._positions = {name: i for i, name in enumerate(self.fields)}
+        self._timestamps = array('d')
+        # Index of the oldest record once the ring buffer has wrapped
+        self._start = 0
+        self._spill_file = None
+        # Epoch of the newest record in the spill file
+        self._last_spilled = None
+        self._counts = {name: self._new_counter() for name in counted}
+
+    @property
+    def counted(self):
+        """Fields whose values are counted for top()"""
+        return tuple(self._counts)
+
+    def _new_counter(self):
+        return SpaceSaving(self.sketch_capacity) if self.sketch_capacity else defaultdict(int)
+
+    def __len__(self):
+        return len(self._timestamps)
+
+    def _physical(self, index):
+        size = len(self._timestamps)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("record index out of range")
+        return (self._start + index) % size if self._start else index
+
+    def _row(self, position):
+        values = self._values.values
+        record = {}
+        for name, column in self._columns.items():
+            record[name] = bool(column[position]) if name == 'response' else values[column[position]]
+        record['timestamp'] = _isoformat(self._timestamps[position])
+        return record
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self._row(self._physical(index))
+
+    def __iter__(self):
+        size = len(self._timestamps)
+        for offset in range(size):
+            yield self._row((self._start + offset) % size)
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return f"<RecordStore {len(self)} records>"
+
+    def columns(self):
+        """
+        Raw columns in record order, oldest first
+        :return: Tuple of (dict of field name -> NumPy array, list of interned values);
+                 fields other than 'response' hold indices into the value list, and
+                 'timestamp' holds epoch seconds
+        """
+        import numpy as np
+
+        columns = {}
+        for name, column in list(self._columns.items()) + [('timestamp', self._timestamps)]:
+            data = np.frombuffer(column, dtype=np.dtype(column.typecode)) if len(column) else \
+                np.empty(0, dtype=np.dtype(column.typecode))
+            if self._start:
+                data = np.concatenate([data[self._start:], data[:self._start]])
+            columns[name] = data.astype(bool) if name == 'response' else data.copy()
+        return columns, list(self._values.values)
+
+    def epoch(self, index):
+        """Timestamp of a record in epoch seconds"""
+        return self._timestamps[self._physical(index)]
+
+    def add(self, timestamp, *values):
+        """
+        Add a record
+        :param timestamp: Capture time (datetime or epoch seconds)
+        :param values: Field values in the order of `fields`
+        """
+        self.total += 1
+        for name, counter in self._counts.items():
+            value = values[self._positions[name]]
+            if self.sketch_capacity:
+                counter.add(value)
+            else:
+                counter[value] += 1
+        self._insert(timestamp if type(timestamp) is float else to_epoch(timestamp), values)
+
+    def _insert(self, epoch, values):
+        """Store a record without counting it"""
+        ids = self._values.ids
+        encoded = []
+        for name, value in zip(self.fields, values):
+            if name == 'response':
+                encoded.append(1 if value else 0)
+            else:
+                index = ids.get(value)
+                encoded.append(self._values.intern(value) if index is None else index)
+
+        if self.maxlen is None or len(self._timestamps) < self.maxlen:
+            for column, value in zip(self._column_list, encoded):
+                column.append(value)
+            self._timestamps.append(epoch)
+            return
+        if not self.maxlen:
+            return
+
+        # Ring buffer is full: overwrite the oldest record
+        position = self._start
+        if self.spill_path is not None:
+            self._spill(self._row(position), self._timestamps[position])
+        for column, value in zip(self._column_list, encoded):
+            column[position] = value
+        self._timestamps[position] = epoch
+        self._start = (position + 1) % self.maxlen
+        if len(self._values) > 4 * self.maxlen + 1024:
+            self._compact()
+
+    def append(self, record):
+        """
+        Add a record given as a dict (the form produced by indexing the store)
+        :param record: Dict with the store's fields and a 'timestamp' (datetime, epoch or isoformat)
+        """
+        timestamp = record.get('timestamp')
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp)
+        self.add(timestamp, *(record.get(name, '') for name in self.fields))
+
+    def _compact(self):
+        """Drop interned values no longer referenced by any record"""
+        old = self._values.values
+        table = InternTable()
+        for name, column in self._columns.items():
+            if name != 'response':
+                self._columns[name] = array('I', (table.intern(old[i]) for i in column))
+        self._column_list = list(self._columns.values())
+        self._values = table
+
+    def _spill(self, record, epoch):
+        if self._spill_file is None:
+            self._spill_file = open(self.spill_path, 'a')
+        self._spill_file.write(json.dumps(record, default=str) + '\n')
+        self.spilled += 1
+        if self._last_spilled is None or epoch > self._last_spilled:
+            self._last_spilled = epoch
+
+    def _order_spill_file(self, offset):
+        """
+        Merge the spill file lines written from byte offset on (ordered among themselves)
+        into the ordered lines before it
+        """
+        self.flush()
+        with open(self.spill_path, 'rb') as f:
+            earlier = f.read(offset).splitlines(keepends=True)
+            later = f.read().splitlines(keepends=True)
+
+        def key(line):
+            return datetime.fromisoformat(json.loads(line)['timestamp'])
+
+        # Rewriting in place keeps open append handles of other stores valid
+        with open(self.spill_path, 'wb') as f:
+            f.writelines(heapq.merge(earlier, later, key=key))
+
+    def flush(self):
+        """Write buffered spilled records to disk"""
+        if self._spill_file is not None:
+            self._spill_file.flush()
+
+    def close(self):
+        """Close the spill file (it is reopened if more records are spilled)"""
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+
+    def iter_spilled(self):
+        """Records pushed out of the ring buffer to the spill file, oldest first"""
+        if self.spill_path is None:
+            return
+        self.flush()
+        try:
+            with open(self.spill_path) as f:
+                for line in f:
+                    yield json.loads(line)
+        except FileNotFoundError:
+            return
+
+    def top(self, field, n=None):
+        """
+        Most frequent values of a counted field
+        :param field: Field name given in `counted`
+        :param n: Number of values (None returns all)
+        :return: List of (value, count), largest first
+        """
+        counter = self._counts[field]
+        if self.sketch_capacity:
+            return counter.top(n)
+        ordered = sorted(counter.items(), key=lambda item: item[1], reverse=True)
+        return ordered if n is None else ordered[:n]
+
+    def _raw_rows(self):
+        """(epoch, field values) of each record, oldest first, without building dicts"""
+        values = self._values.values
+        decoders = [(column, name == 'response') for name, column in self._columns.items()]
+        timestamps = self._timestamps
+        size = len(timestamps)
+        for offset in range(size):
+            position = (self._start + offset) % size if self._start else offset
+            yield timestamps[position], [bool(column[position]) if boolean else values[column[position]]
+                                         for column, boolean in decoders]
+
+    def _ordered_columns(self):
+        """Copies of the columns and timestamps, oldest first"""
+        start = self._start
+        return [column[start:] + column[:start] for column in self._column_list + [self._timestamps]]
+
+    def _extend(self, other):
+        """Append the records of a store whose oldest record is not older than our newest"""
+        ids = array('I', (self._values.intern(value) for value in other._values.values))
+        columns = other._ordered_columns()
+        for name, column, theirs in zip(self.fields, self._column_list, columns):
+            column.extend(theirs if name == 'response' else array('I', map(ids.__getitem__, theirs)))
+        self._timestamps.extend(columns[-1])
+
+    def merged(self, other):
+        """
+        Combine two stores into a new one with records in timestamp order, in linear time
+        :param other: RecordStore with the same fields
+        :return: New RecordStore (configured like this one)
+        """
+        result = RecordStore(self.fields, self.maxlen, self.spill_path, (), self.sketch_capacity)
+        first, second = (other, self) if len(other) and len(self) and self.epoch(0) >= other.epoch(-1) \
+            else (self, other)
+        disjoint = not len(first) or not len(second) or second.epoch(0) >= first.epoch(-1)
+        if disjoint and (self.maxlen is None or len(self) + len(other) <= self.maxlen):
+            result._extend(first)
+            result._extend(second)
+        else:
+            if self.spill_path is not None:
+                # The result appends to the same spill file: get buffered lines onto disk first
+                self.flush()
+                other.flush()
+                spilled = [store._last_spilled for store in (self, other)
+                           if store.spill_path == self.spill_path and store._last_spilled is not None]
+                result._last_spilled = max(spilled, default=None)
+                offset = os.path.getsize(self.spill_path) if os.path.exists(self.spill_path) else 0
+            previous = result._last_spilled
+            rows = chain(first._raw_rows(), second._raw_rows()) if disjoint \
+                else heapq.merge(first._raw_rows(), second._raw_rows(), key=itemgetter(0))
+            for epoch, values in rows:
+                result._insert(epoch, values)
+            if result.spilled and previous is not None and (first or second).epoch(0) < previous:
+                # Records pushed out now predate records spilled before the merge
+                result._order_spill_file(offset)
+            result.flush()
+
+        for name, counter in self._counts.items():
+            merged = self._new_counter()
+            if self.sketch_capacity:
+                merged.merge(counter)
+                if name in other._counts:
+                    merged.merge(other._counts[name])
+            else:
+                for source in (counter, other._counts.get(name, {})):
+                    for value, count in source.items():
+                        merged[value] += count
+            result._counts[name] = merged
+        # Records of either store already spilled, plus those pushed out while merging
+        result.spilled += self.spilled + other.spilled
+        result.total = self.total + other.total
+        return result
+
+    def merge(self, other):
+        """
+        Fold another store into this one, keeping records in timestamp order; the records
+        of a store starting where this one ends are appended, so merging a stream of newer
+        deltas costs time proportional to the deltas, not to the records kept
+        :param other: RecordStore with the same fields
+        :return: self
+        """
+        if (len(self) and len(other) and other.epoch(0) < self.epoch(-1)) or \
+                (other.spilled and other.spill_path == self.spill_path):
+            merged = self.merged(other)
+            self.close()
+            self.__dict__.update(merged.__dict__)
+            return self
+        for epoch, values in other._raw_rows():
+            self._insert(epoch, values)
+        for name, counter in self._counts.items():
+            theirs = other._counts.get(name)
+            if theirs is None:
+                continue
+            if self.sketch_capacity:
+                counter.merge(theirs)
+            else:
+                for value, count in theirs.items():
+                    counter[value] += count
+        self.spilled += other.spilled
+        self.total += other.total
+        return self
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_spill_file'] = None
+        return state
+
+
+class DNSAggregates:
+    """
+    Incremental DNS statistics: query/response counts, NXDOMAIN rate and
+    query-to-response latency, matching responses to queries by DNS id,
+    query name and client address
+    """
+    # Upper bounds of the latency histogram buckets, in milliseconds
+    LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self, max_pending=65536, timeout=30.0):
+        """
+        Initialize the aggregates
+        :param max_pending: Maximum number of unanswered queries remembered
+        :param timeout: Seconds after which an unanswered query is counted as lost
+        """
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.queries = 0
+        self.responses = 0
+        self.nxdomain = 0
+        self.unanswered = 0
+        self.latency_count = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latency_histogram = [0] * (len(self.LATENCY_BUCKETS) + 1)
+        # (dns id, name, client) -> query time in epoch seconds
+        self._pending = OrderedDict()
+
+    def add(self, epoch, name, response, dns_id=None, rcode=None, client=None):
+        """
+        Account for one DNS message
+        :param epoch: Capture time in epoch seconds
+        :param name: Query name
+        :param response: True for responses
+        :param dns_id: DNS transaction id
+        :param rcode: Response code as int
+        :param client: Address of the querying host (source of queries, destination of responses)
+        """
+        key = (dns_id, name, client)
+        if not response:
+            self.queries += 1
+            self._pending[key] = epoch
+            self._pending.move_to_end(key)
+            while len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+                self.unanswered += 1
+            return
+
+        self.responses += 1
+        if rcode == DNS_RCODE_NXDOMAIN:
+            self.nxdomain += 1
+        asked = self._pending.pop(key, None)
+        if asked is not None:
+            latency = max(0.0, epoch - asked)
+            self.latency_count += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            milliseconds = latency * 1000
+            bucket = 0
+            while bucket < len(self.LATENCY_BUCKETS) and milliseconds > self.LATENCY_BUCKETS[bucket]:
+                bucket += 1
+            self.latency_histogram[bucket] += 1
+
+        # Expire queries that will not be answered any more
+        while self._pending:
+            oldest_key, oldest = next(iter(self._pending.items()))
+            if epoch - oldest <= self.timeout:
+                break
+            del self._pending[oldest_key]
+            self.unanswered += 1
+
+    @property
+    def nxdomain_rate(self):
+        return self.nxdomain / self.responses if self.responses else 0.0
+
+    def latency_percentile(self, percentile):
+        """Upper bound in milliseconds of the histogram bucket holding the given percentile"""
+        if not self.latency_count:
+            return None
+        rank = percentile / 100.0 * self.latency_count
+        seen = 0
+        for bound, count in zip(self.LATENCY_BUCKETS + (float('inf'),), self.latency_histogram):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def summary(self):
+        """Statistics as a dict"""
+        return {
+            'queries': self.queries,
+            'responses': self.responses,
+            'nxdomain': self.nxdomain,
+            'nxdomain_rate': self.nxdomain_rate,
+            'unanswered': self.unanswered,
+            'pending': len(self._pending),
+            'matched': self.latency_count,
+            'mean_latency_ms': 1000 * self.latency_total / self.latency_count if self.latency_count else None,
+            'max_latency_ms': 1000 * self.latency_max if self.latency_count else None,
+            'p50_latency_ms': self.latency_percentile(50),
+            'p95_latency_ms': self.latency_percentile(95)
+        }
+
+    def carry_pending(self, other):
+        """
+        Take over another instance's unanswered queries, so that responses seen by this one
+        still match them (for streaming workers that ship and restart their statistics)
+        :param other: DNSAggregates giving up its pending queries
+        """
+        self._pending, other._pending = other._pending, OrderedDict()
+
+    def merge(self, other):
+        """Fold another DNSAggregates into this one (pending queries are not matched across)"""
+        for name in ('queries', 'responses', 'nxdomain', 'unanswered', 'latency_count', 'latency_total'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.latency_max = max(self.latency_max, other.latency_max)
+        self.latency_histogram = [a + b for a, b in zip(self.latency_histogram, other.latency_histogram)]
+        self.unanswered += len(other._pending)
+        return self
@@ -0,0 +1,200 @@
+"""
+Cached reverse-DNS resolution.
+
+socket.gethostbyaddr blocks until the OS resolver answers or gives up, which
+for unresolvable addresses can take several seconds per lookup. The
+ReverseResolver keeps answers in an LRU cache with a TTL, caches failures
+for a shorter negative TTL, runs lookups on a thread pool so a list of
+addresses is resolved concurrently, and stops waiting once a deadline
+passes. A lookup that misses its deadline keeps running in the background
+and its answer is cached when it arrives, so the next report gets it for free.
+
+For offline runs the cache can be preloaded from a hosts-style file; those
+entries are pinned: kept apart from the LRU cache, they never expire and
+are never evicted.
+"""
+import math
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+
+def _gethostbyaddr(ip_address):
+    try:
+        return socket.gethostbyaddr(ip_address)[0]
+    except (socket.herror, socket.gaierror, OSError):
+        return None
+
+
+class ReverseResolver:
+    def __init__(self, max_size=65536, ttl=3600, negative_ttl=300, timeout=2.0, workers=32,
+                 lookup=_gethostbyaddr):
+        """
+        Initialize the resolver
+        :param max_size: Maximum number of cached addresses (least recently used are evicted;
+                         pinned entries are not counted)
+        :param ttl: Seconds a resolved hostname stays cached
+        :param negative_ttl: Seconds a failed lookup stays cached
+        :param timeout: Default deadline in seconds for resolve() and resolve_many() (None waits)
+        :param workers: Maximum number of concurrent lookups
+        :param lookup: Callable mapping an IP address to a hostname or None
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.workers = workers
+        self._lookup = lookup
+        # ip -> (hostname or None, expiry in time.monotonic() seconds)
+        self._cache = OrderedDict()
+        # ip -> hostname of entries added with an infinite TTL, never evicted
+        self._pinned = {}
+        self._pending = {}
+        self._lock = threading.RLock()
+        self._executor = None
+        self.stats = {'hits': 0, 'misses': 0, 'timeouts': 0}
+
+    def __len__(self):
+        return len(self._cache) + len(self._pinned)
+
+    def _store(self, ip_address, hostname, ttl):
+        """Insert a cache entry; caller holds the lock"""
+        if ttl == math.inf:
+            self._pinned[ip_address] = hostname
+            self._cache.pop(ip_address, None)
+            return
+        self._pinned.pop(ip_address, None)
+        self._cache[ip_address] = (hostname, time.monotonic() + ttl)
+        self._cache.move_to_end(ip_address)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def _cached(self, ip_address, now):
+        """
+        Look an address up in the cache; caller holds the lock
+        :return: Tuple of (found, hostname or None)
+        """
+        if ip_address in self._pinned:
+            return True, self._pinned[ip_address]
+        entry = self._cache.get(ip_address)
+        if entry is None:
+            return False, None
+        if entry[1] < now:
+            del self._cache[ip_address]
+            return False, None
+        self._cache.move_to_end(ip_address)
+        return True, entry[0]
+
+    def add(self, ip_address, hostname, ttl=None):
+        """
+        Cache a known hostname
+        :param ip_address: IP address
+        :param hostname: Hostname, or None to record a failed lookup
+        :param ttl: Seconds to keep the entry (None uses the resolver TTLs, math.inf pins it)
+        """
+        if ttl is None:
+            ttl = self.ttl if hostname is not None else self.negative_ttl
+        with self._lock:
+            self._store(ip_address, hostname, ttl)
+
+    def load_hosts(self, path):
+        """
+        Preload the cache from a hosts-style file ("<ip> <hostname> [aliases...]" per line)
+        :param path: Path to the file, e.g. /etc/hosts
+        :return: Number of entries loaded
+        """
+        loaded = 0
+        with open(path) as f:
+            for line in f:
+                fields = line.split('#', 1)[0].split()
+                if len(fields) < 2:
+                    continue
+                self.add(fields[0], fields[1], ttl=math.inf)
+                loaded += 1
+        return loaded
+
+    def _resolved(self, ip_address, future):
+        if future.cancelled():
+            with self._lock:
+                self._pending.pop(ip_address, None)
+            return
+        try:
+            hostname = future.result()
+        except Exception:
+            hostname = None
+        with self._lock:
+            self._pending.pop(ip_address, None)
+            self._store(ip_address, hostname, self.ttl if hostname is not None else self.negative_ttl)
+
+    def _submit(self, ip_address):
+        """Start a lookup, or join one already running; caller holds the lock"""
+        future = self._pending.get(ip_address)
+        if future is None:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix='resolver')
+            future = self._pending[ip_address] = self._executor.submit(self._lookup, ip_address)
+            future.add_done_callback(lambda done: self._resolved(ip_address, done))
+        return future
+
+    def resolve(self, ip_address, timeout=None):
+        """
+        Resolve one address
+        :param ip_address: IP address to resolve
+        :param timeout: Deadline in seconds (defaults to the resolver timeout)
+        :return: Hostname, or the address itself if the lookup failed or missed the deadline
+        """
+        return self.resolve_many([ip_address], timeout)[ip_address]
+
+    def resolve_many(self, ip_addresses, timeout=None):
+        """
+        Resolve many addresses concurrently
+        :param ip_addresses: Iterable of IP addresses
+        :param timeout: Deadline in seconds for the whole batch (defaults to the resolver timeout)
+        :return: Dict mapping each address to its hostname, or to itself if the lookup failed
+                 or missed the deadline
+        """
+        results = {}
+        waiting = {}
+        now = time.monotonic()
+        with self._lock:
+            for ip_address in ip_addresses:
+                if ip_address in results or ip_address in waiting:
+                    continue
+                found, hostname = self._cached(ip_address, now)
+                if found:
+                    self.stats['hits'] += 1
+                    results[ip_address] = hostname or ip_address
+                else:
+                    self.stats['misses'] += 1
+                    waiting[ip_address] = self._submit(ip_address)
+        if not waiting:
+            return results
+
+        from concurrent.futures import wait
+        wait(waiting.values(), timeout=self.timeout if timeout is None else timeout)
+        for ip_address, future in waiting.items():
+            if future.done():
+                try:
+                    hostname = future.result()
+                except Exception:
+                    hostname = None
+            else:
+                self.stats['timeouts'] += 1
+                hostname = None
+            results[ip_address] = hostname or ip_address
+        return results
+
+    def clear(self):
+        """Drop every cached entry"""
+        with self._lock:
+            self._cache.clear()
+            self._pinned.clear()
+
+    def close(self):
+        """Stop the lookup threads (lookups still running are abandoned)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,368 @@
+"""
+Multi-pattern payload signature matching.
+
+All literal patterns of all signatures are compiled into one Aho-Corasick
+automaton, so a payload is scanned once no matter how many signatures are
+loaded: the cost grows with payload bytes plus the number of hits, not with
+signatures x packets. While the automaton sits in its root state the scan
+jumps straight to the next byte that can start a pattern using a compiled
+character class (a C-speed search), so payloads without candidate bytes are
+skipped almost entirely. If every signature carries a depth limit, bytes
+past the deepest limit are never scanned.
+
+A signature matches when one of its literals occurs (within `depth` bytes of
+the payload start, if given), on one of its ports if a port hint is given,
+and, if it has a regex, when the regex also matches the payload; literals
+act as the regex's prefilter. Regex signatures without literals cannot use
+the automaton and are tried on every payload, so give them an anchor.
+
+SignatureEngine.scan tracks flows: once a signature with an application name
+matches, the flow is classified and its later packets are not scanned.
+"""
+import json
+import re
+from collections import OrderedDict, defaultdict, deque
+
+TRANSPORTS = ('tcp', 'udp')
+
+
+class Signature:
+    __slots__ = ('name', 'literals', 'regex', 'ports', 'transport', 'depth', 'application')
+
+    def __init__(self, name, literals=(), regex=None, ports=None, transport=None, depth=None,
+                 application=None):
+        """
+        Define a signature
+        :param name: Unique signature name, used as the hit counter key
+        :param literals: Byte strings (or latin-1 strings); any one of them triggers the signature
+        :param regex: Optional bytes/str regex that must also match the payload
+        :param ports: Optional port hint; the signature only matches traffic to or from these ports
+        :param transport: Optional 'tcp' or 'udp' restriction
+        :param depth: Only match literals ending within the first `depth` payload bytes
+        :param application: Application name assigned to flows this signature matches
+                            (None for indicators that should not classify the flow)
+        """
+        if isinstance(literals, (bytes, str)):
+            literals = (literals,)
+        self.name = name
+        self.literals = tuple(lit.encode('latin-1') if isinstance(lit, str) else bytes(lit)
+                              for lit in literals)
+        if not self.literals and regex is None:
+            raise ValueError(f"Signature {name!r} needs at least one literal or a regex")
+        if any(not lit for lit in self.literals):
+            raise ValueError(f"Signature {name!r} has an empty literal")
+        if isinstance(regex, str):
+            regex = regex.encode('latin-1')
+        self.regex = re.compile(regex, re.DOTALL) if regex is not None else None
+        self.ports = frozenset(int(port) for port in ports) if ports else None
+        if transport is not None and transport.lower() not in TRANSPORTS:
+            raise ValueError(f"Unknown transport {transport!r}, expected one of {TRANSPORTS}")
+        self.transport = transport.lower() if transport else None
+        self.depth = depth
+        self.application = application
+
+    @classmethod
+    def from_dict(cls, spec):
+        """Build a signature from a dict using the constructor's argument names"""
+        return cls(spec['name'], spec.get('literals', ()), spec.get('regex'), spec.get('ports'),
+                   spec.get('transport'), spec.get('depth'), spec.get('application'))
+
+    def __repr__(self):
+        return f"<Signature {self.name}>"
+
+
+# Application signatures for common protocols, usable as a starting set
+DEFAULT_SIGNATURES = (
+    Signature('http-request', (b'GET ', b'POST ', b'PUT ', b'HEAD ', b'DELETE ', b'OPTIONS '),
+              regex=rb'^[A-Z]+ \S+ HTTP/1\.[01]\r\n', transport='tcp', depth=8, application='HTTP'),
+    Signature('http-response', b'HTTP/1.', transport='tcp', depth=7, application='HTTP'),
+    Signature('tls-handshake', b'\x16\x03', regex=rb'^\x16\x03[\x00-\x04]', transport='tcp',
+              depth=2, application='TLS'),
+    Signature('ssh-banner', b'SSH-', transport='tcp', depth=4, application='SSH'),
+    Signature('bittorrent-handshake', b'\x13BitTorrent protocol', transport='tcp', depth=20,
+              application='BitTorrent'),
+    Signature('smb', (b'\xffSMB', b'\xfeSMB'), transport='tcp', ports=(139, 445), depth=8,
+              application='SMB'),
+    Signature('smtp-banner', b'220 ', regex=rb'^220 .*SMTP', transport='tcp', ports=(25, 465, 587),
+              depth=4, application='SMTP'),
+)
+
+
+def load_signatures(path):
+    """
+    Load signatures from a JSON file holding a list of signature dicts
+    :param path: Path to the JSON file
+    :return: List of Signature objects
+    """
+    with open(path) as f:
+        return [Signature.from_dict(spec) for spec in json.load(f)]
+
+
+class AhoCorasick:
+    """Aho-Corasick automaton over byte strings"""
+
+    def __init__(self, patterns):
+        """
+        Build the automaton
+        :param patterns: Sequence of non-empty byte strings; matches report their index
+        """
+        goto = [{}]
+        outputs = [[]]
+        for index, pattern in enumerate(patterns):
+            state = 0
+            for byte in pattern:
+                nxt = goto[state].get(byte)
+                if nxt is None:
+                    nxt = goto[state][byte] = len(goto)
+                    goto.append({})
+                    outputs.append([])
+                state = nxt
+            outputs[state].append((index, len(pattern)))
+
+        # Breadth-first failure links; each state's transition dict is merged with
+        # those of its failure chain so the scan never walks failure links
+        fail = [0] * len(goto)
+        delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = deque()
+        for state in goto[0].values():
+            delta[state] = dict(goto[state])
+            queue.append(state)
+        while queue:
+            state = queue.popleft()
+            for byte, child in goto[state].items():
+                target = fail[state]
+                while target and byte not in goto[target]:
+                    target = fail[target]
+                link = goto[target].get(byte, 0)
+                fail[child] = link
+                outputs[child] = outputs[child] + outputs[link]
+                merged = dict(delta[link]) if link else {}
+                merged.update(goto[child])
+                delta[child] = merged
+                queue.append(child)
+
+        self.delta = delta
+        self.outputs = [tuple(out) for out in outputs]
+        first_bytes = sorted(goto[0])
+        self._skip = re.compile(b'[' + b''.join(re.escape(bytes([b])) for b in first_bytes) + b']') \
+            if first_bytes else None
+
+    def iter_matches(self, data, limit=None):
+        """
+        Find every pattern occurrence
+        :param data: Bytes to scan
+        :param limit: Only scan the first `limit` bytes
+        :return: Generator of (pattern index, end offset)
+        """
+        if self._skip is None:
+            return
+        delta = self.delta
+        root = delta[0]
+        outputs = self.outputs
+        skip = self._skip.search
+        end = len(data) if limit is None else min(limit, len(data))
+        state = 0
+        position = 0
+        while position < end:
+            byte = data[position]
+            nxt = delta[state].get(byte)
+            if nxt is None:
+                nxt = root.get(byte)
+                if nxt is None:
+                    # Back at the root: jump to the next byte that can start a pattern
+                    found = skip(data, position + 1, end)
+                    if found is None:
+                        return
+                    position = found.start()
+                    state = 0
+                    continue
+            position += 1
+            state = nxt
+            for index, _ in outputs[state]:
+                yield index, position
+
+
+def payload_bytes(packet):
+    """
+    Raw TCP/UDP payload of a packet
+    :param packet: DpktPacket (bytes payload) or pyshark packet (colon-separated hex payload)
+    :return: Payload bytes, or None if the packet has none
+    """
+    for name in ('tcp', 'udp'):
+        layer = getattr(packet, name, None)
+        if layer is None:
+            continue
+        payload = getattr(layer, 'payload', None)
+        if isinstance(payload, (bytes, bytearray, memoryview)):
+            return payload
+        if isinstance(payload, str):
+            try:
+                return bytes.fromhex(payload.replace(':', ''))
+            except ValueError:
+                return None
+        return None
+    return None
+
+
+class SignatureEngine:
+    def __init__(self, signatures=DEFAULT_SIGNATURES, max_flows=100000, max_flow_packets=None):
+        """
+        Initialize the engine
+        :param signatures: Iterable of Signature objects or signature dicts
+        :param max_flows: Maximum number of flows whose classification is remembered (LRU)
+        :param max_flow_packets: Stop inspecting an unclassified flow after this many payload
+                                 packets (None inspects every packet)
+        """
+        self.signatures = []
+        self.max_flows = max_flows
+        self.max_flow_packets = max_flow_packets
+        self.hits = defaultdict(int)
+        self.application_stats = defaultdict(int)
+        # flow key -> application name, or number of payload packets inspected so far
+        self._flows = OrderedDict()
+        self._automaton = None
+        for signature in signatures:
+            self.add(signature)
+
+    def add(self, signature):
+        """
+        Add a signature (the automaton is rebuilt on the next scan)
+        :param signature: Signature object or signature dict
+        """
+        if isinstance(signature, dict):
+            signature = Signature.from_dict(signature)
+        if any(existing.name == signature.name for existing in self.signatures):
+            raise ValueError(f"Duplicate signature name {signature.name!r}")
+        self.signatures.append(signature)
+        self._automaton = None
+
+    def compile(self):
+        """Build the combined automaton; called automatically on first use"""
+        literals = []
+        owners = []
+        for signature in self.signatures:
+            for literal in signature.literals:
+                literals.append(literal)
+                owners.append(signature)
+        self._automaton = AhoCorasick(literals)
+        self._owners = owners
+        self._unanchored = [signature for signature in self.signatures if not signature.literals]
+        depths = [signature.depth for signature in self.signatures]
+        self._limit = max(depths) if depths and None not in depths else None
+        return self
+
+    @staticmethod
+    def _applies(signature, transport, srcport, dstport):
+        if signature.transport is not None and signature.transport != transport:
+            return False
+        if signature.ports is not None and srcport not in signature.ports and dstport not in signature.ports:
+            return False
+        return True
+
+    def match(self, payload, transport=None, srcport=None, dstport=None):
+        """
+        Match a payload against every signature in a single scan
+        :param payload: Payload bytes
+        :param transport: 'tcp' or 'udp' (None never matches transport-restricted signatures)
+        :param srcport: Source port as int
+        :param dstport: Destination port as int
+        :return: List of matching Signature objects, in signature order
+        """
+        if self._automaton is None:
+            self.compile()
+        owners = self._owners
+        candidates = {}
+        for index, end in self._automaton.iter_matches(payload, self._limit):
+            signature = owners[index]
+            if signature.name in candidates:
+                continue
+            if signature.depth is not None and end > signature.depth:
+                continue
+            candidates[signature.name] = signature
+        for signature in self._unanchored:
+            candidates[signature.name] = signature
+
+        matched = []
+        for signature in candidates.values():
+            if not self._applies(signature, transport, srcport, dstport):
+                continue
+            if signature.regex is not None and signature.regex.search(payload) is None:
+                continue
+            matched.append(signature)
+        return matched
+
+    def classification(self, transport, src, srcport, dst, dstport):
+        """Application a flow has been classified as, or None"""
+        state = self._flows.get(self._flow_key(transport, src, srcport, dst, dstport))
+        return state if isinstance(state, str) else None
+
+    @staticmethod
+    def _flow_key(transport, src, srcport, dst, dstport):
+        if (src, srcport) <= (dst, dstport):
+            return transport, src, srcport, dst, dstport
+        return transport, dst, dstport, src, srcport
+
+    def scan(self, fields, payload):
+        """
+        Match one packet's payload, skipping flows that are already classified
+        :param fields: PacketFields read from the packet by extract_fields
+        :param payload: Payload bytes
+        :return: List of matching Signature objects (empty if the flow was skipped)
+        """
+        if not payload:
+            return []
+        transport = fields.transport.lower() if fields.transport else None
+        srcport = int(fields.srcport) if fields.srcport is not None else None
+        dstport = int(fields.dstport) if fields.dstport is not None else None
+        key = self._flow_key(transport, fields.src, srcport, fields.dst, dstport)
+        flows = self._flows
+        state = flows.get(key, 0)
+        if isinstance(state, str):
+            flows.move_to_end(key)
+            return []
+        if self.max_flow_packets is not None and state >= self.max_flow_packets:
+            return []
+
+        matched = self.match(payload, transport, srcport, dstport)
+        application = None
+        for signature in matched:
+            self.hits[signature.name] += 1
+            if application is None and signature.application is not None:
+                application = signature.application
+        if application is not None:
+            self.application_stats[application] += 1
+            flows[key] = application
+        else:
+            flows[key] = state + 1
+        flows.move_to_end(key)
+        if len(flows) > self.max_flows:
+            flows.popitem(last=False)
+        return matched
+
+    def get_hit_counts(self):
+        """Number of packets each signature matched"""
+        return dict(self.hits)
+
+    def get_application_stats(self):
+        """Number of flows classified as each application"""
+        return dict(self.application_stats)
+
+    def merge(self, other):
+        """
+        Fold another engine's counters into this one
+        :param other: SignatureEngine to merge
+        :return: self
+        """
+        for mine, theirs in ((self.hits, other.hits), (self.application_stats, other.application_stats)):
+            for key, count in theirs.items():
+                mine[key] += count
+        return self
+
+    def __getstate__(self):
+        # The automaton is rebuilt lazily after unpickling (e.g. in a parallel worker)
+        state = dict(self.__dict__)
+        state['_automaton'] = None
+        state.pop('_owners', None)
+        state.pop('_unanchored', None)
+        state.pop('_limit', None)
+        return state
@@ -0,0 +1,219 @@
+"""
+Fixed-memory streaming summaries.
+
+These back the optional sketch mode of DPIAnalyzer and PacketAnalyzer, where
+exact per-key dicts would grow without limit during scans or spoofed-source
+floods.
+
+SpaceSaving (Metwally et al.) keeps at most `capacity` counters. With N items
+counted in total, every reported count overestimates the true count by at
+most N / capacity (the exact bound for a key is kept as its `error`), and any
+key whose true count exceeds N / capacity is guaranteed to be reported.
+
+HyperLogLog (Flajolet et al.) estimates the number of distinct members using
+2**precision one-byte registers, with a relative standard error of about
+1.04 / sqrt(2**precision) (3.3% at the default precision of 10, i.e. 1 KiB).
+Small cardinalities use linear counting and are close to exact.
+
+Hashes come from blake2b rather than hash() so that sketches built in
+different processes (parallel workers, remote sensors) can be merged.
+"""
+import heapq
+import math
+from hashlib import blake2b
+
+
+def hash64(value):
+    """Stable 64-bit hash of a string (or anything with a str() form)"""
+    if not isinstance(value, bytes):
+        value = str(value).encode()
+    return int.from_bytes(blake2b(value, digest_size=8).digest(), 'little')
+
+
+class SpaceSaving:
+    def __init__(self, capacity=1000):
+        """
+        Initialize an empty summary
+        :param capacity: Maximum number of counters kept
+        """
+        self.capacity = capacity
+        self.total = 0
+        self._counts = {}
+        self._errors = {}
+        # Min-heap of (count, key); entries may lag behind _counts and are refreshed lazily
+        self._heap = []
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __contains__(self, key):
+        return key in self._counts
+
+    def __getitem__(self, key):
+        """Estimated count of a key (0 if it is not monitored)"""
+        return self._counts.get(key, 0)
+
+    def _pop_min(self):
+        while True:
+            count, key = heapq.heappop(self._heap)
+            current = self._counts[key]
+            if current == count:
+                return key, count
+            heapq.heappush(self._heap, (current, key))
+
+    def add(self, key, count=1):
+        """
+        Count occurrences of a key
+        :param key: Item to count
+        :param count: Number of occurrences
+        :return: Key that was evicted to make room, or None
+        """
+        self.total += count
+        if key in self._counts:
+            self._counts[key] += count
+            return None
+        if len(self._counts) < self.capacity:
+            self._counts[key] = count
+            self._errors[key] = 0
+            heapq.heappush(self._heap, (count, key))
+            return None
+        # Replace the smallest counter; the newcomer inherits its count as error
+        evicted, floor = self._pop_min()
+        del self._counts[evicted]
+        del self._errors[evicted]
+        self._counts[key] = floor + count
+        self._errors[key] = floor
+        heapq.heappush(self._heap, (floor + count, key))
+        return evicted
+
+    def error(self, key):
+        """Maximum overestimate of a key's count"""
+        return self._errors.get(key, self.total // self.capacity)
+
+    def top(self, n=None):
+        """
+        Heaviest keys
+        :param n: Number of keys to return (None returns all monitored keys)
+        :return: List of (key, estimated count), largest first
+        """
+        if n is None:
+            return sorted(self._counts.items(), key=lambda item: item[1], reverse=True)
+        return heapq.nlargest(n, self._counts.items(), key=lambda item: item[1])
+
+    def items(self):
+        return self._counts.items()
+
+    def merge(self, other):
+        """
+        Fold another summary into this one; the combined error bound is the sum
+        of both bounds
+        :param other: SpaceSaving to merge
+        :return: self
+        """
+        floor = self.total // self.capacity if len(self._counts) >= self.capacity else 0
+        other_floor = other.total // other.capacity if len(other._counts) >= other.capacity else 0
+        counts = {}
+        errors = {}
+        for key in set(self._counts) | set(other._counts):
+            counts[key] = self._counts.get(key, floor) + other._counts.get(key, other_floor)
+            errors[key] = self._errors.get(key, floor) + other._errors.get(key, other_floor)
+        kept = heapq.nlargest(self.capacity, counts.items(), key=lambda item: item[1])
+        self._counts = dict(kept)
+        self._errors = {key: errors[key] for key in self._counts}
+        self._heap = [(count, key) for key, count in self._counts.items()]
+        heapq.heapify(self._heap)
+        self.total += other.total
+        return self
+
+
+class HyperLogLog:
+    __slots__ = ('precision', 'registers')
+
+    def __init__(self, precision=10):
+        """
+        Initialize an empty estimator
+        :param precision: log2 of the number of registers (4-16)
+        """
+        if not 4 <= precision <= 16:
+            raise ValueError("HyperLogLog precision must be between 4 and 16")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, member):
+        hashed = hash64(member)
+        index = hashed >> (64 - self.precision)
+        remainder = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def __len__(self):
+        return int(round(self.estimate()))
+
+    def estimate(self):
+        """Estimated number of distinct members"""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m) if m >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        raw = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)
+        return raw
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLogs with different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+
+class DistinctCounter:
+    """
+    Distinct members per key in fixed memory: a HyperLogLog per key, for at most
+    max_keys keys chosen by SpaceSaving over how often each key is seen. A port
+    scanner keeps sending packets and stays monitored, while the one-off sources
+    of a spoofed flood evict each other.
+    """
+    def __init__(self, max_keys=4096, precision=10):
+        """
+        Initialize the counter
+        :param max_keys: Maximum number of keys tracked (memory is about max_keys * 2**precision bytes)
+        :param precision: HyperLogLog precision per key
+        """
+        self.precision = precision
+        self._keys = SpaceSaving(max_keys)
+        self._sketches = {}
+
+    def __len__(self):
+        return len(self._sketches)
+
+    def add(self, key, member):
+        evicted = self._keys.add(key)
+        if evicted is not None:
+            del self._sketches[evicted]
+        sketch = self._sketches.get(key)
+        if sketch is None:
+            sketch = self._sketches[key] = HyperLogLog(self.precision)
+        sketch.add(member)
+
+    def cardinality(self, key):
+        sketch = self._sketches.get(key)
+        return len(sketch) if sketch is not None else 0
+
+    def cardinalities(self):
+        """Iterate (key, estimated distinct members)"""
+        for key, sketch in self._sketches.items():
+            yield key, len(sketch)
+
+    def merge(self, other):
+        for key, sketch in other._sketches.items():
+            if key in self._sketches:
+                self._sketches[key].merge(sketch)
+            else:
+                copy = HyperLogLog(sketch.precision)
+                copy.registers = bytearray(sketch.registers)
+                self._sketches[key] = copy
+        self._keys.merge(other._keys)
+        for key in [key for key in self._sketches if key not in self._keys]:
+            del self._sketches[key]
+        return self
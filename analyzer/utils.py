@@ -1,12 +1,44 @@
-import psutil
+import heapq
+import ipaddress
 import platform
 import socket
+from collections import deque
+from .flow_table import ip_to_int, int_to_ip
+from .resolver import ReverseResolver
+
+# Address classes recognised by classify_ip/classify_ips
+ADDRESS_CLASSES = {
+    'private': ('10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16', 'fc00::/7'),
+    'loopback': ('127.0.0.0/8', '::1/128'),
+    'multicast': ('224.0.0.0/4', 'ff00::/8'),
+    'link_local': ('169.254.0.0/16', 'fe80::/10'),
+    'cgnat': ('100.64.0.0/10',)
+}
+
+_V4_MAPPED = 0xFFFF << 32
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+_V4_MAPPED_PREFIX = b'\x00' * 10 + b'\xff\xff'
+_INVALID = b'\x00' * 16
+
+_resolver = None
+
+def get_resolver():
+    """
+    Shared reverse-DNS resolver used by ip_to_hostname
+    :return: ReverseResolver (created on first use)
+    """
+    global _resolver
+    if _resolver is None:
+        _resolver = ReverseResolver()
+    return _resolver
 
 def get_network_interfaces():
     """
     Get available network interfaces
     :return: List of interface names
     """
+    import psutil
+
     interfaces = []
     if platform.system() == "Linux":
         for interface, addrs in psutil.net_if_addrs().items():
@@ -16,32 +48,275 @@ def get_network_interfaces():
         interfaces = list(psutil.net_if_addrs().keys())
     return interfaces
 
-def ip_to_hostname(ip_address):
+def ip_to_hostname(ip_address, timeout=None):
     """
-    Resolve IP address to hostname
+    Resolve IP address to hostname (cached, see get_resolver)
     :param ip_address: IP address to resolve
-    :return: Hostname or original IP if resolution fails
+    :param timeout: Seconds to wait for an uncached lookup (defaults to the resolver timeout)
+    :return: Hostname or original IP if resolution fails or times out
     """
-    try:
-        hostname, _, _ = socket.gethostbyaddr(ip_address)
-        return hostname
-    except (socket.herror, socket.gaierror):
-        return ip_address
+    return get_resolver().resolve(ip_address, timeout)
+
+def ips_to_hostnames(ip_addresses, timeout=None):
+    """
+    Resolve many IP addresses concurrently (cached, see get_resolver)
+    :param ip_addresses: Iterable of IP addresses
+    :param timeout: Seconds to wait for the whole batch (defaults to the resolver timeout)
+    :return: Dict mapping each address to its hostname, or to itself if resolution fails
+    """
+    return get_resolver().resolve_many(ip_addresses, timeout)
 
 def is_private_ip(ip_address):
     """
-    Check if IP address is private
+    Check if IP address is private (RFC 1918 or IPv6 unique local)
     :param ip_address: IP address to check
     :return: Boolean indicating if IP is private
     """
+    return classify_ip(ip_address) == 'private'
+
+def _prefix_masks(prefix):
+    """High and low 64-bit halves of a 128-bit netmask"""
+    mask = ((1 << prefix) - 1) << (128 - prefix)
+    return mask >> 64, mask & _MASK64
+
+def _parse_network(cidr):
+    """
+    Parse a CIDR into the 128-bit address space used by ip_to_int
+    :return: Tuple of (prefix length, network as integer)
+    """
+    network = ipaddress.ip_network(cidr, strict=False)
+    if network.version == 4:
+        return 96 + network.prefixlen, _V4_MAPPED | int(network.network_address)
+    return network.prefixlen, int(network.network_address)
+
+def parse_ips(ip_addresses):
+    """
+    Parse IP address strings into 128-bit integers held as two uint64 arrays
+    (IPv4 addresses are v4-mapped, as in ip_to_int)
+    :param ip_addresses: Iterable of address strings
+    :return: Tuple of (high, low, valid) NumPy arrays; invalid entries are zero and not valid
+    """
+    import numpy as np
+    ip_addresses = list(ip_addresses)
     try:
-        ip = list(map(int, ip_address.split('.')))
-        # Check for private IP ranges
-        return (ip[0] == 10) or \
-               (ip[0] == 172 and 16 <= ip[1] <= 31) or \
-               (ip[0] == 192 and ip[1] == 168)
-    except (ValueError, IndexError):
-        return False
+        # Fast path for all-IPv4 input
+        packed = b''.join(map(socket.inet_aton, ip_addresses))
+        low = np.frombuffer(packed, dtype='>u4').astype(np.uint64) | np.uint64(_V4_MAPPED)
+        return np.zeros(len(ip_addresses), dtype=np.uint64), low, np.ones(len(ip_addresses), dtype=bool)
+    except (OSError, TypeError):
+        pass
+
+    chunks = []
+    valid = np.ones(len(ip_addresses), dtype=bool)
+    for index, address in enumerate(ip_addresses):
+        try:
+            chunks.append(_V4_MAPPED_PREFIX + socket.inet_aton(address))
+        except (OSError, TypeError):
+            try:
+                chunks.append(socket.inet_pton(socket.AF_INET6, address))
+            except (OSError, TypeError):
+                chunks.append(_INVALID)
+                valid[index] = False
+    halves = np.frombuffer(b''.join(chunks), dtype='>u8').astype(np.uint64).reshape(-1, 2)
+    return halves[:, 0].copy(), halves[:, 1].copy(), valid
+
+class PrefixTrie:
+    """
+    Longest-prefix-match table over IPv4 and IPv6 CIDRs.
+
+    The trie is stored level by level: one hash table of network -> value per
+    prefix length that has entries. A lookup probes the populated levels from
+    the longest prefix down, which lets lookup_many test a whole array of
+    addresses against one level at a time with NumPy.
+    """
+    def __init__(self, cidrs=None):
+        """
+        Initialize the trie
+        :param cidrs: Optional iterable of CIDRs, or dict of CIDR -> value
+        """
+        # prefix length -> {network: index into _values}
+        self._levels = {}
+        self._values = []
+        self._arrays = None
+        if cidrs is not None:
+            items = cidrs.items() if isinstance(cidrs, dict) else ((cidr, True) for cidr in cidrs)
+            for cidr, value in items:
+                self.insert(cidr, value)
+
+    def __len__(self):
+        return sum(len(level) for level in self._levels.values())
+
+    def insert(self, cidr, value=True):
+        """
+        Add a network
+        :param cidr: Network in CIDR notation, e.g. '10.0.0.0/8' or '2001:db8::/32'
+        :param value: Value returned by lookups that match this network
+        """
+        prefix, network = _parse_network(cidr)
+        self._levels.setdefault(prefix, {})[network] = len(self._values)
+        self._values.append(value)
+        self._arrays = None
+
+    def lookup(self, ip_address, default=None):
+        """
+        Value of the longest prefix containing an address
+        :param ip_address: Address string
+        :param default: Returned when no prefix matches or the address is invalid
+        """
+        try:
+            value = ip_to_int(ip_address)
+        except (OSError, TypeError):
+            return default
+        for prefix in sorted(self._levels, reverse=True):
+            index = self._levels[prefix].get(value & (((1 << prefix) - 1) << (128 - prefix)))
+            if index is not None:
+                return self._values[index]
+        return default
+
+    def _level_arrays(self):
+        """Sorted network arrays per level, grouped by the high half for prefixes over 64 bits"""
+        import numpy as np
+        if self._arrays is None:
+            arrays = []
+            for prefix in sorted(self._levels, reverse=True):
+                groups = {}
+                for network, index in self._levels[prefix].items():
+                    high = network >> 64 if prefix > 64 else 0
+                    key = network & _MASK64 if prefix > 64 else network >> 64
+                    groups.setdefault(high, []).append((key, index))
+                level = []
+                for high, entries in groups.items():
+                    entries.sort()
+                    keys = np.array([key for key, _ in entries], dtype=np.uint64)
+                    indexes = np.array([index for _, index in entries], dtype=np.int64)
+                    level.append((np.uint64(high), keys, indexes))
+                mask_high, mask_low = _prefix_masks(prefix)
+                arrays.append((prefix, np.uint64(mask_high), np.uint64(mask_low), level))
+            self._arrays = arrays
+        return self._arrays
+
+    def match_indices(self, high, low, valid=None):
+        """
+        Longest-prefix match for parsed addresses
+        :param high: High uint64 halves from parse_ips
+        :param low: Low uint64 halves from parse_ips
+        :param valid: Optional validity mask from parse_ips
+        :return: int64 array of indexes into values(), -1 where nothing matches
+        """
+        import numpy as np
+        result = np.full(len(high), -1, dtype=np.int64)
+        pending = np.ones(len(high), dtype=bool) if valid is None else valid.copy()
+        for prefix, mask_high, mask_low, level in self._level_arrays():
+            if not pending.any():
+                break
+            if prefix > 64:
+                masked = low & mask_low
+            else:
+                masked = high & mask_high
+            for net_high, keys, indexes in level:
+                candidates = pending & (high == net_high) if prefix > 64 else pending
+                rows = np.flatnonzero(candidates)
+                if not len(rows):
+                    continue
+                wanted = masked[rows]
+                position = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+                hit = keys[position] == wanted
+                result[rows[hit]] = indexes[position[hit]]
+                pending[rows[hit]] = False
+        return result
+
+    def values(self):
+        return list(self._values)
+
+    def lookup_many(self, ip_addresses, default=None):
+        """
+        Longest-prefix match for many addresses at once
+        :param ip_addresses: Iterable of address strings
+        :param default: Value for addresses without a match
+        :return: List of matched values
+        """
+        indices = self.match_indices(*parse_ips(ip_addresses))
+        values = self._values
+        return [values[index] if index >= 0 else default for index in indices.tolist()]
+
+_class_trie = None
+
+def _address_class_trie():
+    global _class_trie
+    if _class_trie is None:
+        _class_trie = PrefixTrie({cidr: name for name, cidrs in ADDRESS_CLASSES.items() for cidr in cidrs})
+    return _class_trie
+
+def classify_ip(ip_address):
+    """
+    Classify a single address
+    :param ip_address: IP address
+    :return: One of the ADDRESS_CLASSES names, or None for public/invalid addresses
+    """
+    return _address_class_trie().lookup(ip_address)
+
+def classify_ips(ip_addresses, cidrs=None):
+    """
+    Classify many addresses at once with NumPy
+    :param ip_addresses: Iterable of IPv4/IPv6 address strings
+    :param cidrs: Optional user networks (iterable of CIDRs or a PrefixTrie); adds a 'custom' mask
+    :return: Dict of class name -> boolean NumPy array, one entry per address, plus 'valid'
+    """
+    import numpy as np
+    high, low, valid = parse_ips(ip_addresses)
+    trie = _address_class_trie()
+    indices = trie.match_indices(high, low, valid)
+    names = np.array(trie.values(), dtype=object)
+    classes = {'valid': valid}
+    for name in ADDRESS_CLASSES:
+        ids = np.flatnonzero(names == name)
+        classes[name] = np.isin(indices, ids)
+    if cidrs is not None:
+        custom = cidrs if isinstance(cidrs, PrefixTrie) else PrefixTrie(cidrs)
+        classes['custom'] = custom.match_indices(high, low, valid) >= 0
+    return classes
+
+def aggregate_subnets(ip_counts, v4_prefix=24, v6_prefix=48, top_n=None):
+    """
+    Roll per-address counts (e.g. DPIAnalyzer.get_ip_statistics()) up to subnets
+    :param ip_counts: Dict (or other mapping) of address -> count
+    :param v4_prefix: Prefix length for IPv4 subnets
+    :param v6_prefix: Prefix length for IPv6 subnets
+    :param top_n: Only return the N busiest subnets (None returns all)
+    :return: Dict of subnet CIDR -> total count, largest first; invalid addresses are skipped
+    """
+    import numpy as np
+    addresses = list(ip_counts.keys())
+    if not addresses:
+        return {}
+    counts = np.fromiter(ip_counts.values(), dtype=np.float64, count=len(addresses))
+    high, low, valid = parse_ips(addresses)
+    high, low, counts = high[valid], low[valid], counts[valid]
+
+    is_v4 = (high == 0) & ((low >> np.uint64(32)) == np.uint64(0xFFFF))
+    v4_high, v4_low = _prefix_masks(96 + v4_prefix)
+    v6_high, v6_low = _prefix_masks(v6_prefix)
+    high = np.where(is_v4, high & np.uint64(v4_high), high & np.uint64(v6_high))
+    low = np.where(is_v4, low & np.uint64(v4_low), low & np.uint64(v6_low))
+
+    if not high.any():
+        networks, inverse = np.unique(low, return_inverse=True)
+        networks = np.stack([np.zeros_like(networks), networks], axis=1)
+    else:
+        pairs = np.ascontiguousarray(np.stack([high, low], axis=1))
+        keys, inverse = np.unique(pairs.view('V16').ravel(), return_inverse=True)
+        networks = keys.view(np.uint64).reshape(-1, 2)
+    totals = np.bincount(inverse.ravel(), weights=counts)
+
+    order = np.argsort(-totals, kind='stable')
+    if top_n is not None:
+        order = order[:top_n]
+    subnets = {}
+    for row in order.tolist():
+        value = (int(networks[row, 0]) << 64) | int(networks[row, 1])
+        prefix = v4_prefix if value >> 32 == 0xFFFF else v6_prefix
+        subnets[f"{int_to_ip(value)}/{prefix}"] = int(totals[row])
+    return subnets
 
 def format_bytes(size):
     """
@@ -54,3 +329,20 @@ def format_bytes(size):
             return f"{size:.2f} {unit}"
         size /= 1024.0
     return f"{size:.2f} TB"
+
+def merge_ordered(mine, theirs, key):
+    """
+    Merge two deques whose entries are in key order
+    :param mine: Deque receiving the entries (its maxlen is kept)
+    :param theirs: Deque of entries to merge in
+    :param key: Callable returning an entry's sort key (e.g. its timestamp)
+    :return: mine extended in place when theirs starts at or after its end (the usual
+             case for a stream of newer results), otherwise a new deque built by a
+             linear merge of the two
+    """
+    if not theirs:
+        return mine
+    if not mine or key(theirs[0]) >= key(mine[-1]):
+        mine.extend(theirs)
+        return mine
+    return deque(heapq.merge(mine, theirs, key=key), maxlen=mine.maxlen)
@@ -1,60 +1,218 @@
-import matplotlib.pyplot as plt
-import pandas as pd
-from collections import defaultdict
+"""
+Charts of analysis results.
+
+Plotting cost is kept independent of the size of the statistics being
+plotted: top-N charts select their entries with a partial selection
+(heapq.nlargest, or numpy.argpartition for large dicts) instead of sorting
+every key, port categories are summed with vectorized numpy operations, and
+timelines are binned into at most ``max_points`` bins before anything is
+drawn. Timelines can come straight from PacketAnalyzer.timeline, or from the
+per-window counts saved by analyzer.export (``load_results(...).table('windows')``),
+which is how a day-long capture of 100M packets is charted without
+revisiting the packets.
+
+Every plot method takes an ``output`` path. Without one the chart is shown
+with pyplot as before; with one it is drawn on a standalone Figure and
+saved to the file through matplotlib's Agg renderer, so batch rendering
+works headless (no display, no pyplot state to leak between charts).
+matplotlib and numpy are imported on first use.
+"""
+import heapq
+import os
+from datetime import datetime
+from operator import itemgetter
+
+from .records import to_epoch
+
+PORT_CATEGORIES = ('Well-known', 'Registered', 'Dynamic/Private', 'Other')
+# Above this many keys, top-N selection switches from heapq to numpy.argpartition
+ARGPARTITION_THRESHOLD = 10000
+
+
+def top_items(stats, top_n=10):
+    """
+    Largest entries of a counter without sorting all of it
+    :param stats: Dict of key -> count
+    :param top_n: Number of entries to return
+    :return: List of (key, count), largest first
+    """
+    if len(stats) <= ARGPARTITION_THRESHOLD or top_n >= len(stats):
+        return heapq.nlargest(top_n, stats.items(), key=itemgetter(1))
+    import numpy as np
+
+    keys = list(stats)
+    counts = np.fromiter(stats.values(), dtype=np.float64, count=len(keys))
+    selected = np.argpartition(counts, len(counts) - top_n)[len(counts) - top_n:]
+    selected = selected[np.argsort(counts[selected], kind='stable')[::-1]]
+    return [(keys[i], stats[keys[i]]) for i in selected]
+
+
+def bucket_ports(port_stats):
+    """
+    Sum port counts into well-known (0-1023), registered (1024-49151),
+    dynamic/private (49152+) and other (non-numeric) categories
+    :param port_stats: Dict of port (string or int) -> count
+    :return: Dict of category -> count, for the non-empty categories
+    """
+    import numpy as np
+
+    ports = np.array([str(port) for port in port_stats])
+    counts = np.fromiter(port_stats.values(), dtype=np.float64, count=len(ports))
+    numeric = np.char.isdigit(ports)
+    categories = np.full(len(ports), 3, dtype=np.int64)
+    categories[numeric] = np.digitize(ports[numeric].astype(np.int64), (1024, 49152))
+    totals = np.bincount(categories, weights=counts, minlength=len(PORT_CATEGORIES))
+    return {name: int(total) for name, total in zip(PORT_CATEGORIES, totals) if total}
+
+
+def bin_timeline(timeline, max_points=1000, window=None):
+    """
+    Packet counts of a timeline in evenly sized bins
+    :param timeline: PacketAnalyzer.timeline (iterable of (timestamp, flow key)), or a
+                     table/dict with 'start_ns' and 'packets' columns such as the 'windows'
+                     table of analyzer.export
+    :param max_points: Maximum number of bins
+    :param window: Bin width in seconds (None picks the smallest width giving at most
+                   max_points bins; widened if it would exceed max_points)
+    :return: Tuple of (bin start epoch seconds array, packet count array, bin width in seconds)
+    """
+    import numpy as np
+
+    try:
+        times = np.asarray(timeline['start_ns'], dtype=np.float64) / 1e9
+        weights = np.asarray(timeline['packets'], dtype=np.float64)
+    except (TypeError, KeyError, IndexError):
+        entries = timeline if hasattr(timeline, '__len__') else list(timeline)
+        times = np.fromiter((to_epoch(timestamp) for timestamp, _ in entries), dtype=np.float64,
+                            count=len(entries))
+        weights = None
+    if not len(times):
+        return np.empty(0), np.empty(0, dtype=np.int64), window or 0.0
+    low, high = times.min(), times.max()
+    width = max((high - low) / max_points, window or 0.0, 1e-9)
+    bins = min(int((high - low) // width) + 1, max_points)
+    indices = np.minimum(((times - low) // width).astype(np.int64), bins - 1)
+    counts = np.bincount(indices, weights=weights, minlength=bins).astype(np.int64)
+    return low + width * np.arange(bins), counts, width
+
+
+def _figure(output, figsize=(8, 5)):
+    """Figure and axes: standalone (Agg-rendered) when writing to a file, pyplot otherwise"""
+    if output is not None:
+        from matplotlib.figure import Figure
+        figure = Figure(figsize=figsize)
+    else:
+        import matplotlib.pyplot as plt
+        figure = plt.figure(figsize=figsize)
+    return figure, figure.subplots()
+
+
+def _finish(figure, output, dpi=100):
+    """Save the figure to output, or show it when no output is given"""
+    figure.tight_layout()
+    if output is not None:
+        figure.savefig(output, dpi=dpi)
+        return output
+    import matplotlib.pyplot as plt
+    plt.show()
+    return None
+
 
 class TrafficVisualizer:
     @staticmethod
-    def plot_protocol_distribution(protocol_stats, title="Protocol Distribution"):
-        """Plot a pie chart of protocol distribution"""
+    def plot_protocol_distribution(protocol_stats, title="Protocol Distribution", output=None):
+        """
+        Plot a pie chart of protocol distribution
+        :param output: Image path to save the chart to (None shows it)
+        :return: Output path, or None
+        """
         if not protocol_stats:
             print("No protocol data to visualize")
-            return
-            
-        df = pd.DataFrame(list(protocol_stats.items()), columns=['Protocol', 'Count'])
-        df.plot.pie(y='Count', labels=df['Protocol'], autopct='%1.1f%%', legend=False)
-        plt.title(title)
-        plt.ylabel('')
-        plt.show()
-        
+            return None
+        figure, ax = _figure(output)
+        ax.pie(list(protocol_stats.values()), labels=list(protocol_stats), autopct='%1.1f%%')
+        ax.set_title(title)
+        return _finish(figure, output)
+
     @staticmethod
-    def plot_top_ips(ip_stats, top_n=10, title="Top IP Addresses"):
-        """Plot bar chart of top IP addresses"""
+    def plot_top_ips(ip_stats, top_n=10, title="Top IP Addresses", output=None):
+        """
+        Plot bar chart of top IP addresses
+        :param output: Image path to save the chart to (None shows it)
+        :return: Output path, or None
+        """
         if not ip_stats:
             print("No IP data to visualize")
-            return
-            
-        df = pd.DataFrame(list(ip_stats.items()), columns=['IP', 'Count'])
-        df = df.sort_values('Count', ascending=False).head(top_n)
-        df.plot.bar(x='IP', y='Count', legend=False)
-        plt.title(title)
-        plt.ylabel('Packet Count')
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        plt.show()
-        
+            return None
+        top = top_items(ip_stats, top_n)
+        figure, ax = _figure(output)
+        ax.bar([ip for ip, _ in top], [count for _, count in top])
+        ax.set_title(title)
+        ax.set_ylabel('Packet Count')
+        ax.tick_params(axis='x', labelrotation=45)
+        return _finish(figure, output)
+
     @staticmethod
-    def plot_port_heatmap(port_stats, title="Port Usage Heatmap"):
-        """Plot heatmap of port usage"""
+    def plot_port_heatmap(port_stats, title="Port Usage Heatmap", output=None):
+        """
+        Plot heatmap of port usage
+        :param output: Image path to save the chart to (None shows it)
+        :return: Output path, or None
+        """
         if not port_stats:
             print("No port data to visualize")
-            return
-            
-        # Categorize ports
-        port_categories = defaultdict(int)
-        for port, count in port_stats.items():
-            try:
-                port_num = int(port)
-                if port_num <= 1023:
-                    port_categories['Well-known'] += count
-                elif 1024 <= port_num <= 49151:
-                    port_categories['Registered'] += count
-                else:
-                    port_categories['Dynamic/Private'] += count
-            except ValueError:
-                port_categories['Other'] += count
-                
-        df = pd.DataFrame(list(port_categories.items()), columns=['Category', 'Count'])
-        df.plot.bar(x='Category', y='Count', legend=False)
-        plt.title(title)
-        plt.ylabel('Packet Count')
-        plt.show()
+            return None
+        categories = bucket_ports(port_stats)
+        figure, ax = _figure(output)
+        ax.bar(list(categories), list(categories.values()))
+        ax.set_title(title)
+        ax.set_ylabel('Packet Count')
+        return _finish(figure, output)
+
+    @staticmethod
+    def plot_timeline(timeline, max_points=1000, window=None, title="Packets over Time", output=None):
+        """
+        Plot packet counts over time, binned before drawing (see bin_timeline)
+        :param timeline: PacketAnalyzer.timeline or an export 'windows' table
+        :param max_points: Maximum number of bins drawn
+        :param window: Bin width in seconds (None derives it from max_points)
+        :param output: Image path to save the chart to (None shows it)
+        :return: Output path, or None
+        """
+        starts, counts, width = bin_timeline(timeline, max_points, window)
+        if not len(counts):
+            print("No timeline data to visualize")
+            return None
+        figure, ax = _figure(output, figsize=(12, 4))
+        # Capture times are shown in local time, like packet.sniff_time
+        ax.step([datetime.fromtimestamp(start) for start in starts], counts, where='post')
+        ax.set_title(title)
+        ax.set_ylabel(f'Packets per {width:g}s')
+        figure.autofmt_xdate()
+        return _finish(figure, output)
+
+    @staticmethod
+    def render_report(engine, directory, top_n=10, max_points=1000, format='png'):
+        """
+        Render the standard charts of an analysis to image files, without a display
+        :param engine: AnalysisEngine holding the results
+        :param directory: Existing directory receiving the images
+        :param top_n: Number of addresses in the top IP chart
+        :param max_points: Maximum number of timeline bins
+        :param format: Image format / file extension understood by matplotlib
+        :return: Dict of chart name -> written path (charts without data are skipped)
+        """
+        def path(name):
+            return os.path.join(directory, f'{name}.{format}')
+
+        charts = {
+            'protocols': TrafficVisualizer.plot_protocol_distribution(
+                engine.get_protocol_statistics(), output=path('protocols')),
+            'top_ips': TrafficVisualizer.plot_top_ips(
+                engine.get_ip_statistics(), top_n, output=path('top_ips')),
+            'ports': TrafficVisualizer.plot_port_heatmap(
+                engine.get_port_statistics(), output=path('ports')),
+            'timeline': TrafficVisualizer.plot_timeline(
+                engine.analyzer.timeline, max_points, output=path('timeline'))
+        }
+        return {name: written for name, written in charts.items() if written is not None}
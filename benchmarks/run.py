@@ -0,0 +1,249 @@
+"""
+Throughput benchmarks for every analysis path.
+
+Each stage streams a synthetic capture (see benchmarks.generate) through one
+analysis entry point with the dpkt backend and reports packets per second,
+peak resident set size and memory allocations. Stages run in separate
+processes so that every peak RSS figure belongs to one stage only. The
+'decode' stage only reads the capture, so subtracting its time from another
+stage gives the cost of the analysis itself.
+
+Allocations are measured in a second, tracemalloc-instrumented pass over the
+first --trace-packets packets (tracing slows Python down several times, so it
+is kept out of the timed pass).
+
+Usage:
+    python -m benchmarks.run --sizes 10k 100k --profiles mixed portscan flood
+    python -m benchmarks.run --sizes 1M --compare benchmarks/results/previous.json
+
+Results are written as JSON (one record per profile, size and stage) to
+benchmarks/results/ unless --output is given.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from itertools import islice
+
+from analyzer.dpi_engine import DPIAnalyzer
+from analyzer.dpkt_reader import read_pcap
+from analyzer.engine import AnalysisEngine
+from analyzer.metrics import peak_rss
+from analyzer.packet_analysis import PacketAnalyzer
+
+from .generate import PROFILES, generate_pcap
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1M': 1_000_000, '10M': 10_000_000}
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def _decode(packets):
+    for _ in packets:
+        pass
+
+
+def _dpi(packets):
+    dpi = DPIAnalyzer()
+    for packet in packets:
+        dpi.analyze_packet(packet)
+
+
+def _flows(packets):
+    PacketAnalyzer().analyze_flow(packets)
+
+
+def _anomalies(packets):
+    PacketAnalyzer().detect_anomalies(packets)
+
+
+def _conversations(packets):
+    PacketAnalyzer().get_conversation_stats(packets)
+
+
+def _engine(packets):
+    AnalysisEngine().run(packets)
+
+
+STAGES = {
+    'decode': _decode,
+    'dpi': _dpi,
+    'flows': _flows,
+    'anomalies': _anomalies,
+    'conversations': _conversations,
+    'engine': _engine
+}
+
+
+def measure_stage(stage, pcap_file, trace_packets=10000):
+    """
+    Run one stage over a capture file in the current process
+    :param stage: Name of a STAGES entry
+    :param pcap_file: Path to the capture file
+    :param trace_packets: Number of packets to replay under tracemalloc (0 to skip)
+    :return: Result dict
+    """
+    run = STAGES[stage]
+    counter = [0]
+
+    def counted(packets):
+        for packet in packets:
+            counter[0] += 1
+            yield packet
+
+    started = time.perf_counter()
+    run(counted(read_pcap(pcap_file)))
+    seconds = time.perf_counter() - started
+    result = {
+        'stage': stage,
+        'packets': counter[0],
+        'seconds': round(seconds, 4),
+        'pps': round(counter[0] / seconds) if seconds else None,
+        'peak_rss_mb': round(peak_rss() / (1024 * 1024), 1)
+    }
+
+    if trace_packets:
+        tracemalloc.start()
+        blocks_before = sys.getallocatedblocks()
+        run(islice(read_pcap(pcap_file), trace_packets))
+        blocks_after = sys.getallocatedblocks()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        traced = min(trace_packets, counter[0]) or 1
+        result['traced_packets'] = traced
+        result['traced_peak_kb'] = round(peak / 1024, 1)
+        result['traced_bytes_per_packet'] = round(peak / traced, 1)
+        result['retained_blocks'] = blocks_after - blocks_before
+    return result
+
+
+def _isolated(args):
+    return measure_stage(*args)
+
+
+def run_benchmarks(sizes, profiles, stages=None, trace_packets=10000, seed=0, workdir=None):
+    """
+    Generate captures and measure every stage on each of them
+    :param sizes: Packet counts
+    :param profiles: Traffic profiles from benchmarks.generate.PROFILES
+    :param stages: Stage names (defaults to all STAGES)
+    :param trace_packets: Packets replayed under tracemalloc per stage
+    :param seed: Generator seed
+    :param workdir: Directory for the generated captures (a temporary one by default)
+    :return: List of result dicts
+    """
+    stages = stages or list(STAGES)
+    results = []
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        for profile in profiles:
+            for size in sizes:
+                pcap_file = os.path.join(tmp, f'{profile}-{size}.pcap')
+                generate_pcap(pcap_file, size, profile, seed)
+                for stage in stages:
+                    # A fresh single-use process per stage keeps peak RSS per stage
+                    with context.Pool(1, maxtasksperchild=1) as pool:
+                        result = pool.apply(_isolated, ((stage, pcap_file, trace_packets),))
+                    result['profile'] = profile
+                    result['size'] = size
+                    results.append(result)
+                    print(f"{profile:>9} {size:>9} {stage:>13} {result['pps']:>10} pkt/s "
+                          f"{result['peak_rss_mb']:>8} MB", flush=True)
+                os.remove(pcap_file)
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(results, path=None, seed=0):
+    """
+    Write results with run metadata as JSON
+    :param results: Result dicts from run_benchmarks
+    :param path: Output path (defaults to a timestamped file in benchmarks/results/)
+    :param seed: Generator seed used for the run
+    :return: Path of the written file
+    """
+    now = datetime.now()
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"bench-{now.strftime('%Y%m%d-%H%M%S')}.json")
+    report = {
+        'created': now.isoformat(),
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': seed,
+        'results': results
+    }
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def compare_results(baseline, results):
+    """
+    Relative throughput change against an earlier run
+    :param baseline: Report dict loaded from a previous JSON file
+    :param results: Result dicts of the current run
+    :return: List of (profile, size, stage, baseline pps, current pps, change in percent)
+    """
+    previous = {(r['profile'], r['size'], r['stage']): r['pps'] for r in baseline['results']}
+    changes = []
+    for result in results:
+        key = (result['profile'], result['size'], result['stage'])
+        before = previous.get(key)
+        if before and result['pps']:
+            changes.append(key + (before, result['pps'], round(100.0 * (result['pps'] - before) / before, 1)))
+    return changes
+
+
+def _size(value):
+    if value in SIZES:
+        return SIZES[value]
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid size {value!r}, expected a number or one of {tuple(SIZES)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the packet analysis stages")
+    parser.add_argument('--sizes', nargs='+', type=_size, default=[SIZES['10k']],
+                        help="Packet counts, e.g. 10k 100k 1M 10M")
+    parser.add_argument('--profiles', nargs='+', choices=PROFILES, default=list(PROFILES))
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES))
+    parser.add_argument('--trace-packets', type=int, default=10000,
+                        help="Packets replayed under tracemalloc per stage (0 disables)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', help="Directory for generated captures")
+    parser.add_argument('-o', '--output', help="JSON results path")
+    parser.add_argument('--compare', help="Earlier JSON results to compare against")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.profiles, args.stages, args.trace_packets,
+                             args.seed, args.workdir)
+    path = save_results(results, args.output, args.seed)
+    print(f"Results written to {path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for profile, size, stage, before, after, change in compare_results(baseline, results):
+            print(f"{profile:>9} {size:>9} {stage:>13} {before:>10} -> {after:>10} pkt/s ({change:+.1f}%)")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 from analyzer.packet_capture import PacketCapture
 from analyzer.packet_analysis import PacketAnalyzer
 from analyzer.dpi_engine import DPIAnalyzer
+from analyzer.engine import AnalysisEngine
 from analyzer.visualization import TrafficVisualizer
 import matplotlib.pyplot as plt
 
@@ -17,14 +18,11 @@ def advanced_analysis():
         print("No packets captured")
         return
         
-    # Perform deep packet inspection
-    for packet in packets:
-        dpi.analyze_packet(packet)
-    
-    # Perform advanced flow analysis
-    flow_stats = analyzer.analyze_flow(packets)
-    anomalies = analyzer.detect_anomalies(packets)
-    conversations = analyzer.get_conversation_stats(packets)
+    # Perform deep packet inspection and flow analysis in a single pass
+    engine = AnalysisEngine(dpi=dpi, analyzer=analyzer).run(packets)
+    flow_stats = engine.get_flow_stats()
+    anomalies = engine.get_anomalies()
+    conversations = engine.get_conversation_stats()
     
     # Print summary
     print("\n=== Analysis Summary ===")
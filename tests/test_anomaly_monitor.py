@@ -0,0 +1,48 @@
+import unittest
+from analyzer.anomaly_monitor import WindowedAnomalyDetector
+from test_packet_analysis import make_packet
+
+class TestWindowedAnomalyDetector(unittest.TestCase):
+    def test_port_scan_alert_fires_during_capture(self):
+        alerts = []
+        detector = WindowedAnomalyDetector(window=10, port_scan_threshold=10, on_alert=alerts.append)
+
+        for port in range(11):
+            detector.process_packet(make_packet('10.0.0.9', '10.0.0.2', port, seconds=port * 0.1))
+        self.assertEqual([a['type'] for a in alerts], ['port_scan'])
+        self.assertEqual(alerts[0]['key'], '10.0.0.9')
+        self.assertEqual(alerts[0]['count'], 11)
+
+        # No repeat alert for the same source within the window
+        detector.process_packet(make_packet('10.0.0.9', '10.0.0.2', 99, seconds=2))
+        self.assertEqual(len(alerts), 1)
+
+    def test_slow_scan_spread_over_windows(self):
+        detector = WindowedAnomalyDetector(window=10, port_scan_threshold=10)
+        packets = (make_packet('10.0.0.9', '10.0.0.2', port, seconds=port * 5) for port in range(30))
+        self.assertEqual(list(detector.monitor(packets)), [])
+
+    def test_high_volume_and_ddos(self):
+        detector = WindowedAnomalyDetector(window=60, slide=10, volume_threshold=20, ddos_threshold=5)
+        packets = [make_packet('10.0.0.1', '10.0.0.2', 80, seconds=i) for i in range(21)]
+        packets += [make_packet('172.16.0.%d' % i, '10.0.0.2', 80, seconds=30) for i in range(6)]
+        alerts = list(detector.monitor(packets))
+
+        self.assertEqual([(a['type'], a['key']) for a in alerts],
+                         [('high_volume', ('10.0.0.1', '10.0.0.2')), ('possible_ddos', '10.0.0.2')])
+
+    def test_idle_state_is_evicted(self):
+        detector = WindowedAnomalyDetector(window=10, flow_ttl=30)
+        for i in range(100):
+            detector.process_packet(make_packet('10.0.%d.1' % i, '10.0.0.2', 80, seconds=0))
+        self.assertEqual(detector.state_size()['flows'], 100)
+
+        detector.process_packet(make_packet('10.0.0.1', '10.0.0.2', 80, seconds=15))
+        self.assertEqual(detector.state_size()['sources'], 1)
+        self.assertEqual(detector.state_size()['flows'], 100)
+
+        detector.process_packet(make_packet('10.0.0.1', '10.0.0.2', 80, seconds=45))
+        self.assertEqual(detector.state_size(), {'flows': 1, 'sources': 1, 'destinations': 1})
+
+if __name__ == '__main__':
+    unittest.main()
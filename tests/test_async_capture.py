@@ -0,0 +1,105 @@
+import asyncio
+import unittest
+from analyzer.async_capture import AsyncCapturePipeline
+from analyzer.engine import AnalysisEngine
+from test_packet_analysis import make_packet
+
+async def burst(packets):
+    # Yields without awaiting, like a capture outrunning analysis
+    for packet in packets:
+        yield packet
+
+class TestAsyncCapturePipeline(unittest.TestCase):
+    def setUp(self):
+        self.packets = [make_packet('10.0.0.1', '10.0.0.2', 80, seconds=i) for i in range(100)]
+
+    def test_block_policy_processes_everything(self):
+        pipeline = AsyncCapturePipeline(queue_size=8, policy='block')
+        stats = asyncio.run(pipeline.run(burst(self.packets)))
+
+        self.assertEqual(stats['queued'], 100)
+        self.assertEqual(stats['processed'], 100)
+        self.assertEqual(stats['dropped'], 0)
+        self.assertLessEqual(stats['max_queue_depth'], 8)
+        self.assertEqual(pipeline.engine.get_protocol_statistics(), {'TCP': 100})
+
+    def test_drop_policy_counts_drops(self):
+        engine = AnalysisEngine()
+        pipeline = AsyncCapturePipeline(consumers=[engine.process_packet], queue_size=10, policy='drop')
+        stats = asyncio.run(pipeline.run(burst(self.packets)))
+
+        self.assertEqual(stats['dropped'], 90)
+        self.assertEqual(stats['processed'], 10)
+        self.assertEqual(engine.packet_count, 10)
+
+    def test_drop_policy_with_interleaved_producer(self):
+        produced = []
+        # Longest run of packets analyzed, while capture was still running, without the
+        # producer getting to read another packet
+        run = {'last': None, 'length': 0, 'longest': 0}
+
+        async def bursts(packets, size=20):
+            # Delivers 20 packets per event loop turn, faster than the 5 analyzed per turn
+            for i, packet in enumerate(packets):
+                produced.append(packet)
+                yield packet
+                if i % size == size - 1:
+                    await asyncio.sleep(0)
+
+        def consumer(packet):
+            if len(produced) == len(self.packets):
+                return
+            run['length'] = run['length'] + 1 if run['last'] == len(produced) else 1
+            run['last'] = len(produced)
+            run['longest'] = max(run['longest'], run['length'])
+
+        pipeline = AsyncCapturePipeline(consumers=[consumer], queue_size=10, policy='drop', yield_every=5)
+        stats = asyncio.run(pipeline.run(bursts(self.packets)))
+
+        # The consumer hands control back mid-backlog instead of draining the full queue,
+        # and packets are dropped only while it is behind
+        self.assertGreater(run['longest'], 0)
+        self.assertLessEqual(run['longest'], 5)
+        self.assertGreater(stats['dropped'], 0)
+        self.assertEqual(stats['processed'] + stats['dropped'], 100)
+        self.assertLessEqual(stats['max_queue_depth'], 10)
+
+    def test_consumer_error_cancels_capture(self):
+        closed = []
+
+        async def endless():
+            try:
+                while True:
+                    yield self.packets[0]
+                    await asyncio.sleep(0)
+            finally:
+                closed.append(True)
+
+        def failing(packet):
+            raise RuntimeError("analysis failed")
+
+        async def scenario():
+            pipeline = AsyncCapturePipeline(consumers=[failing], queue_size=4, policy='block')
+            with self.assertRaises(RuntimeError):
+                await pipeline.run(endless())
+            # By the time run() raises, the producer is gone and the source closed
+            return closed[:], len(asyncio.all_tasks())
+
+        self.assertEqual(asyncio.run(scenario()), ([True], 1))
+
+    def test_sync_source_overlaps_analysis(self):
+        seen = []
+        pipeline = AsyncCapturePipeline(consumers=[seen.append], queue_size=1, policy='drop')
+        stats = asyncio.run(pipeline.run(iter(self.packets)))
+
+        self.assertEqual(stats['dropped'], 0)
+        self.assertEqual(seen, self.packets)
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            AsyncCapturePipeline(policy='spill')
+        with self.assertRaises(ValueError):
+            AsyncCapturePipeline(yield_every=0)
+
+if __name__ == '__main__':
+    unittest.main()
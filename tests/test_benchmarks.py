@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+
+from analyzer.dpkt_reader import read_pcap
+from benchmarks.generate import generate_pcap, SCANNER, FLOOD_TARGET
+from benchmarks.run import measure_stage, compare_results, STAGES
+
+
+class TestBenchmarks(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def test_generator_is_deterministic(self):
+        first = generate_pcap(self.path('a.pcap'), 500, 'mixed', seed=3)
+        second = generate_pcap(self.path('b.pcap'), 500, 'mixed', seed=3)
+        with open(first, 'rb') as a, open(second, 'rb') as b:
+            self.assertEqual(a.read(), b.read())
+
+    def test_profiles_decode(self):
+        packets = list(read_pcap(generate_pcap(self.path('mixed.pcap'), 2000, 'mixed')))
+        layers = {packet.highest_layer for packet in packets}
+        self.assertTrue({'TCP', 'UDP', 'HTTP', 'DNS'} <= layers)
+
+        scan = list(read_pcap(generate_pcap(self.path('scan.pcap'), 1000, 'portscan')))
+        self.assertGreater(sum(1 for packet in scan if packet.ip.src == SCANNER), 200)
+
+        flood = list(read_pcap(generate_pcap(self.path('flood.pcap'), 1000, 'flood')))
+        sources = {packet.ip.src for packet in flood if packet.ip.dst == FLOOD_TARGET}
+        self.assertGreater(len(sources), 400)
+
+    def test_measure_stage(self):
+        pcap_file = generate_pcap(self.path('bench.pcap'), 300, 'flood')
+        for stage in STAGES:
+            result = measure_stage(stage, pcap_file, trace_packets=100)
+            self.assertEqual(result['packets'], 300)
+            self.assertGreater(result['pps'], 0)
+            self.assertEqual(result['traced_packets'], 100)
+
+    def test_compare_results(self):
+        baseline = {'results': [{'profile': 'mixed', 'size': 10, 'stage': 'dpi', 'pps': 1000}]}
+        current = [{'profile': 'mixed', 'size': 10, 'stage': 'dpi', 'pps': 1100}]
+        self.assertEqual(compare_results(baseline, current), [('mixed', 10, 'dpi', 1000, 1100, 10.0)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+import os
+import struct
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+import dpkt
+
+from analyzer.bpf import compile_filter, filter_pcap, BPFSyntaxError
+from analyzer import dpkt_reader
+from analyzer.dpkt_reader import read_pcap
+from analyzer.pcap_index import iter_records
+from analyzer.packet_capture import PacketCapture
+from test_dpkt_reader import build_frame, http_frame, dns_frame, write_pcap
+
+
+def tcp_frame(src, dst, sport, dport):
+    return build_frame(src, dst, dpkt.tcp.TCP(sport=sport, dport=dport, flags=dpkt.tcp.TH_SYN))
+
+
+class TestBPFFilter(unittest.TestCase):
+    def test_primitives(self):
+        http = http_frame()
+        dns = dns_frame()
+        self.assertTrue(compile_filter('tcp')(http))
+        self.assertFalse(compile_filter('tcp')(dns))
+        self.assertTrue(compile_filter('udp port 53')(dns))
+        self.assertTrue(compile_filter('dst port 80')(http))
+        self.assertFalse(compile_filter('src port 80')(http))
+        self.assertTrue(compile_filter('host 8.8.8.8')(dns))
+        self.assertFalse(compile_filter('src host 8.8.8.8')(dns))
+        self.assertTrue(compile_filter('net 192.168.0.0/16')(http))
+        self.assertTrue(compile_filter('portrange 50-60')(dns))
+        self.assertTrue(compile_filter('port domain')(dns))
+
+    def test_boolean_operators(self):
+        matches = compile_filter('tcp and (port 80 or port 443) and not src net 10.0.0.0/8')
+        self.assertTrue(matches(tcp_frame('192.168.1.1', '1.1.1.1', 40000, 443)))
+        self.assertFalse(matches(tcp_frame('10.1.1.1', '1.1.1.1', 40000, 443)))
+        self.assertFalse(matches(tcp_frame('192.168.1.1', '1.1.1.1', 40000, 22)))
+        self.assertTrue(compile_filter('udp || tcp port 80')(http_frame()))
+        self.assertTrue(compile_filter('tcp port 80')(http_frame()))
+
+    def test_and_or_equal_precedence(self):
+        # Like libpcap: 'a or b and c' is '(a or b) and c', not 'a or (b and c)'
+        frames = [http_frame(), dns_frame(), tcp_frame('192.168.1.1', '1.1.1.1', 40000, 53)]
+        for expression, grouped in (('tcp or udp and port 53', '(tcp or udp) and port 53'),
+                                    ('udp && port 53 || tcp', '(udp && port 53) || tcp'),
+                                    ('not tcp or port 80', '(not tcp) or port 80')):
+            for frame in frames:
+                self.assertEqual(compile_filter(expression)(frame), compile_filter(grouped)(frame),
+                                 expression)
+        self.assertFalse(compile_filter('tcp or udp and port 53')(http_frame()))
+
+    def test_bare_values_repeat_qualifiers(self):
+        ssh = tcp_frame('192.168.1.1', '1.1.1.1', 40000, 22)
+        dns_over_tcp = tcp_frame('192.168.1.1', '8.8.8.8', 40000, 53)
+        frames = [http_frame(), dns_frame(), ssh, dns_over_tcp]
+        for expression, expanded in (('port 80 or 443', 'port 80 or port 443'),
+                                     ('port 22 or 53', 'port 22 or port 53'),
+                                     ('tcp dst port 22 or 53', 'tcp dst port 22 or tcp dst port 53'),
+                                     ('not host 8.8.8.8 and 1.1.1.1',
+                                      'not host 8.8.8.8 and host 1.1.1.1')):
+            for frame in frames:
+                self.assertEqual(compile_filter(expression)(frame), compile_filter(expanded)(frame),
+                                 expression)
+        # The protocol is inherited too: UDP/53 is not 'tcp port 22 or tcp port 53'
+        self.assertFalse(compile_filter('tcp port 22 or 53')(dns_frame()))
+        self.assertTrue(compile_filter('tcp port 22 or 53')(dns_over_tcp))
+        with self.assertRaises(BPFSyntaxError):
+            compile_filter('80 or port 443')
+
+    def test_non_ip_and_truncated_frames(self):
+        arp = bytes(dpkt.ethernet.Ethernet(type=dpkt.ethernet.ETH_TYPE_ARP, data=b'\x00' * 28))
+        self.assertTrue(compile_filter('arp')(arp))
+        self.assertFalse(compile_filter('port 80')(arp))
+        self.assertFalse(compile_filter('tcp')(http_frame()[:20]))
+
+    def test_syntax_errors(self):
+        for expression in ('tcp and', 'host', '(tcp', 'ether host 00:11:22:33:44:55',
+                           'port http-ish', 'tcp & udp'):
+            with self.assertRaises(BPFSyntaxError):
+                compile_filter(expression)
+
+
+class TestFilePrefilter(unittest.TestCase):
+    def setUp(self):
+        fd, self.pcap_path = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+        frames = [http_frame(), dns_frame(), tcp_frame('10.0.0.1', '10.0.0.2', 40000, 22)]
+        write_pcap(self.pcap_path, frames)
+
+    def tearDown(self):
+        os.remove(self.pcap_path)
+
+    def test_read_pcap_skips_before_decoding(self):
+        with patch.object(dpkt_reader, 'decode_packet', wraps=dpkt_reader.decode_packet) as decode:
+            packets = list(read_pcap(self.pcap_path, bpf_filter='udp'))
+        self.assertEqual([packet.transport_layer for packet in packets], ['UDP'])
+        self.assertEqual(decode.call_count, 1)
+
+    def test_dpkt_backend(self):
+        capture = PacketCapture(interface='eth0', backend='dpkt', bpf_filter='tcp')
+        packets = capture.analyze_pcap_file(self.pcap_path)
+        self.assertEqual([packet.tcp.dstport for packet in packets], ['80', '22'])
+
+    def test_filter_pcap(self):
+        fd, output = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+        try:
+            self.assertEqual(filter_pcap(self.pcap_path, output, 'host 10.0.0.2'), 1)
+            packets = list(read_pcap(output))
+            self.assertEqual(packets[0].ip.dst, '10.0.0.2')
+            self.assertEqual(packets[0].sniff_time.timestamp(), 1700000002.0)
+        finally:
+            os.remove(output)
+
+    def test_filter_pcap_keeps_original_timestamps(self):
+        frames = [http_frame(), dns_frame()]
+        fd, output = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+        try:
+            # Nanosecond pcap: records are copied verbatim
+            with open(self.pcap_path, 'wb') as f:
+                f.write(struct.pack('<IHHiIII', 0xA1B23C4D, 2, 4, 0, 0, 65535, 1))
+                for i, frame in enumerate(frames):
+                    f.write(struct.pack('<IIII', 1700000000 + i, 123456789, len(frame), len(frame) + 10))
+                    f.write(frame)
+            self.assertEqual(filter_pcap(self.pcap_path, output, 'udp'), 1)
+            with open(self.pcap_path, 'rb') as f:
+                original = f.read()
+            with open(output, 'rb') as f:
+                self.assertEqual(f.read(), original[:24] + original[24 + 16 + len(frames[0]):])
+
+            # pcapng: written as a nanosecond pcap with the exact timestamps and lengths
+            with open(self.pcap_path, 'wb') as f:
+                writer = dpkt.pcapng.Writer(f)
+                for i, frame in enumerate(frames):
+                    writer.writepkt(frame, ts=1700000000.25 + i)
+            self.assertEqual(filter_pcap(self.pcap_path, output, 'udp or tcp'), 2)
+            with open(self.pcap_path, 'rb') as f, open(output, 'rb') as g:
+                expected = [record[2] for record in iter_records(f.read())[0]]
+                data = g.read()
+                self.assertEqual([record[2] for record in iter_records(data)[0]], expected)
+            self.assertEqual(struct.unpack_from('<IIII', data, 24)[2:], (len(frames[0]), len(frames[0])))
+        finally:
+            os.remove(output)
+
+    @patch('analyzer.packet_capture.pyshark.FileCapture')
+    def test_pyshark_backend_dissects_prefiltered_copy(self, mock_file_capture):
+        seen = {}
+
+        def file_capture(path, **kwargs):
+            seen['path'] = path
+            seen['packets'] = list(read_pcap(path))
+            capture = MagicMock()
+            capture.__iter__.return_value = iter(seen['packets'])
+            return capture
+
+        mock_file_capture.side_effect = file_capture
+        capture = PacketCapture(interface='eth0', bpf_filter='port 53')
+        packets = capture.analyze_pcap_file(self.pcap_path)
+
+        self.assertEqual(len(packets), 1)
+        self.assertNotEqual(seen['path'], self.pcap_path)
+        self.assertFalse(os.path.exists(seen['path']))
+
+    @patch('analyzer.packet_capture.pyshark.LiveCapture')
+    def test_live_capture_passes_bpf_filter(self, mock_live_capture):
+        mock_live_capture.return_value.sniff.return_value = []
+        capture = PacketCapture(interface='eth0', display_filter='http', bpf_filter='tcp port 80')
+        capture.start_live_capture(packet_count=1)
+        mock_live_capture.assert_called_once_with(interface='eth0', display_filter='http',
+                                                  bpf_filter='tcp port 80', output_file=None)
+
+if __name__ == '__main__':
+    unittest.main()
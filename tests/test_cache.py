@@ -0,0 +1,135 @@
+import os
+import tempfile
+import unittest
+
+import dpkt
+
+from analyzer.cache import ResultCache
+from analyzer.dpkt_reader import read_pcap
+from analyzer.engine import AnalysisEngine
+from analyzer.packet_analysis import PacketAnalyzer
+from test_dpkt_reader import build_frame, http_frame, dns_frame
+
+T0 = 1700000000.0
+
+
+def traffic(count):
+    frames = []
+    for i in range(count):
+        tcp = dpkt.tcp.TCP(sport=40000 + i % 3, dport=1 + i % 40, data=b'x' * (i % 5))
+        frames.append(build_frame(f'10.0.0.{i % 4}', '10.0.1.1', tcp))
+        if i % 10 == 0:
+            frames += [http_frame(), dns_frame()]
+    return frames
+
+
+def write_capture(path, frames, pcapng=False, start=T0):
+    with open(path, 'wb') as f:
+        writer = dpkt.pcapng.Writer(f) if pcapng else dpkt.pcap.Writer(f)
+        for i, frame in enumerate(frames):
+            writer.writepkt(frame, ts=start + i * 0.5)
+    # Make sure rewrites are visible to size+mtime fingerprints
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000 * len(frames)))
+
+
+def flow_key_engine():
+    return AnalysisEngine(analyzer=PacketAnalyzer(flow_key='5tuple'))
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp.name, 'cache')
+        self.pcap = os.path.join(self.tmp.name, 'capture.pcap')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def assertSameResults(self, engine, expected):
+        self.assertEqual(engine.packet_count, expected.packet_count)
+        self.assertEqual(engine.get_ip_statistics(), expected.get_ip_statistics())
+        self.assertEqual(engine.get_port_statistics(), expected.get_port_statistics())
+        self.assertEqual(dict(engine.get_flow_stats()), dict(expected.get_flow_stats()))
+        self.assertEqual(list(engine.dpi.http_requests), list(expected.dpi.http_requests))
+        self.assertEqual(list(engine.analyzer.timeline), list(expected.analyzer.timeline))
+
+    def fresh(self, path, factory=AnalysisEngine):
+        return factory().run(read_pcap(path))
+
+    def test_hit_after_first_run(self):
+        write_capture(self.pcap, traffic(50))
+        cache = ResultCache(self.cache_dir)
+        first = cache.analyze(self.pcap)
+        self.assertSameResults(first, self.fresh(self.pcap))
+
+        again = ResultCache(self.cache_dir).analyze(self.pcap)
+        self.assertSameResults(again, first)
+        self.assertEqual(cache.stats, {'hits': 0, 'resumed': 0, 'misses': 1})
+
+    def test_appended_file_resumes_from_offset(self):
+        for pcapng, fingerprint in ((False, 'stat'), (True, 'stat'), (False, 'content')):
+            cache = ResultCache(os.path.join(self.cache_dir, f'{pcapng}{fingerprint}'), fingerprint=fingerprint)
+            frames = traffic(60)
+            write_capture(self.pcap, frames[:30], pcapng)
+            cache.analyze(self.pcap)
+            write_capture(self.pcap, frames, pcapng)
+
+            engine = cache.analyze(self.pcap)
+            self.assertEqual(cache.stats, {'hits': 0, 'resumed': 1, 'misses': 1})
+            self.assertSameResults(engine, self.fresh(self.pcap))
+
+            # A partially written trailing record is left for the next run
+            with open(self.pcap, 'ab') as f:
+                f.write(b'\x00' * 7)
+            self.assertEqual(cache.analyze(self.pcap).packet_count, len(frames))
+
+    def test_rewritten_file_is_reanalyzed(self):
+        write_capture(self.pcap, traffic(40))
+        cache = ResultCache(self.cache_dir)
+        cache.analyze(self.pcap)
+        # Same size, different content
+        frames = traffic(40)
+        frames[0], frames[1] = frames[1], frames[0]
+        write_capture(self.pcap, frames)
+        engine = cache.analyze(self.pcap)
+        self.assertEqual(cache.stats['misses'], 2)
+        self.assertSameResults(engine, self.fresh(self.pcap))
+
+    def test_configuration_is_part_of_the_key(self):
+        write_capture(self.pcap, traffic(20))
+        ResultCache(self.cache_dir).analyze(self.pcap)
+        other = ResultCache(self.cache_dir, engine_factory=flow_key_engine)
+        engine = other.analyze(self.pcap)
+        self.assertEqual(other.stats['misses'], 1)
+        self.assertSameResults(engine, self.fresh(self.pcap, flow_key_engine))
+
+        filtered = ResultCache(self.cache_dir, bpf_filter='udp')
+        self.assertEqual(filtered.analyze(self.pcap).get_protocol_statistics(), {'UDP': 2})
+        with self.assertRaises(ValueError):
+            ResultCache(self.cache_dir, fingerprint='md5')
+
+    def test_analyze_files_merges(self):
+        paths = []
+        for n in range(3):
+            path = os.path.join(self.tmp.name, f'day{n}.pcap')
+            write_capture(path, traffic(20 + n * 5), start=T0 + n * 86400)
+            paths.append(path)
+        expected = AnalysisEngine()
+        for path in paths:
+            expected.run(read_pcap(path))
+
+        cache = ResultCache(self.cache_dir)
+        self.assertSameResults(cache.analyze_files(paths), expected)
+        self.assertSameResults(cache.analyze_files(paths, workers=2), expected)
+        self.assertEqual(cache.stats, {'hits': 3, 'resumed': 0, 'misses': 3})
+
+        cache.invalidate(paths[0])
+        cache.analyze_files(paths)
+        self.assertEqual(cache.stats['misses'], 4)
+        cache.invalidate()
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+
+from analyzer.cli import main
+from test_dpkt_reader import http_frame, dns_frame, write_pcap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules a headless worker or the CLI must not import up front
+HEAVY_MODULES = ('pyshark', 'matplotlib', 'pandas', 'numpy', 'psutil', 'asyncio')
+# Generous budget for importing the CLI (about 0.08s measured), so a regression that
+# pulls a plotting or capture library back in fails while slow CI machines pass
+IMPORT_BUDGET = 0.5
+
+
+def import_in_subprocess(module):
+    code = ("import sys, time\n"
+            "start = time.perf_counter()\n"
+            f"import {module}\n"
+            "elapsed = time.perf_counter() - start\n"
+            f"print(elapsed, ' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True,
+                            check=True).stdout.split()
+    return float(output[0]), output[1:]
+
+
+class TestCLI(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pcap = os.path.join(self.tmp.name, 'capture.pcap')
+        write_pcap(self.pcap, [http_frame(), dns_frame()] * 3)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_pcap_report(self):
+        output = os.path.join(self.tmp.name, 'report.json')
+        self.assertEqual(main(['--read', self.pcap, '--output', output, '--top', '1']), 0)
+        with open(output) as f:
+            report = json.load(f)
+        self.assertEqual(report['packets'], 6)
+        self.assertEqual(report['protocols'], {'TCP': 3, 'UDP': 3})
+        self.assertEqual(len(report['top_ips']), 1)
+        self.assertEqual(report['http']['top_hosts'], {'example.com': 3})
+        self.assertEqual(report['dns']['queries'], 3)
+
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            main(['-r', self.pcap, '-f', 'udp', '-c', '4'])
+        report = json.loads(stdout.getvalue())
+        # The count applies to the packets passing the filter
+        self.assertEqual((report['packets'], report['filter']), (3, 'udp'))
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(main(['-r', self.pcap, '-f', 'udp', '-c', '2']), 0)
+
+    def test_errors(self):
+        truncated = os.path.join(self.tmp.name, 'truncated.pcap')
+        with open(self.pcap, 'rb') as f:
+            data = f.read()
+        with open(truncated, 'wb') as f:
+            f.write(data[:24 + 8])
+        for argv in (['-r', self.pcap, '-f', 'port http or'], ['-r', truncated],
+                     ['-r', os.path.join(self.tmp.name, 'missing.pcap')]):
+            stderr = io.StringIO()
+            with redirect_stdout(io.StringIO()), redirect_stderr(stderr):
+                self.assertEqual(main(argv), 1, argv)
+            self.assertIn("Error:", stderr.getvalue())
+
+    def test_import_budget(self):
+        for module in ('analyzer.cli', 'analyzer.engine', 'analyzer.packet_capture',
+                       'analyzer.visualization'):
+            elapsed, heavy = import_in_subprocess(module)
+            self.assertEqual(heavy, [], module)
+            self.assertLess(elapsed, IMPORT_BUDGET, module)
+
+
+if __name__ == '__main__':
+    unittest.main()
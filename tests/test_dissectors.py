@@ -0,0 +1,143 @@
+import pickle
+import struct
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+
+import dpkt
+
+from analyzer.dissectors import DissectorRegistry, DEFAULT_REGISTRY
+from analyzer.dissectors.tls import parse_client_hello
+from analyzer.dpi_engine import DPIAnalyzer
+from analyzer.dpkt_reader import decode_packet
+from test_dpkt_reader import build_frame, http_frame
+
+
+def client_hello(server_name, alpn=(b'h2', b'http/1.1'), versions=(0x0a0a, 0x0304, 0x0303)):
+    def extension(kind, body):
+        return struct.pack('!HH', kind, len(body)) + body
+
+    name = server_name.encode()
+    protocols = b''.join(bytes([len(p)]) + p for p in alpn)
+    offered = b''.join(struct.pack('!H', v) for v in versions)
+    extensions = (extension(0, struct.pack('!HBH', len(name) + 3, 0, len(name)) + name) +
+                  extension(16, struct.pack('!H', len(protocols)) + protocols) +
+                  extension(43, bytes([len(offered)]) + offered))
+    body = (b'\x03\x03' + b'\x00' * 32 + b'\x00' + b'\x00\x02\x13\x01' + b'\x01\x00' +
+            struct.pack('!H', len(extensions)) + extensions)
+    handshake = b'\x01' + struct.pack('!I', len(body))[1:] + body
+    return b'\x16\x03\x01' + struct.pack('!H', len(handshake)) + handshake
+
+
+def quic_initial():
+    dcid = bytes.fromhex('8394c8f03e515708')
+    return bytes([0xc3]) + struct.pack('!I', 1) + bytes([len(dcid)]) + dcid + b'\x00' + b'\x00' * 40
+
+
+def smb2_negotiate(response=False):
+    header = (b'\xfeSMB' + struct.pack('<HHIHHI', 64, 0, 0, 0, 1, 1 if response else 0) +
+              b'\x00' * 44)
+    return b'\x00' + struct.pack('!I', len(header))[1:] + header
+
+
+def tcp_packet(payload, dport, sport=50000):
+    tcp = dpkt.tcp.TCP(sport=sport, dport=dport, flags=dpkt.tcp.TH_ACK, data=payload)
+    return decode_packet(1700000000.0, build_frame('10.0.0.1', '10.0.0.2', tcp))
+
+
+def udp_packet(payload, dport, sport=50000):
+    udp = dpkt.udp.UDP(sport=sport, dport=dport, data=payload)
+    udp.ulen = len(bytes(udp))
+    return decode_packet(1700000000.0, build_frame('10.0.0.1', '10.0.0.2', udp))
+
+
+def default_registry():
+    registry = DissectorRegistry()
+    for spec in DEFAULT_REGISTRY.specs.values():
+        registry.register(spec.name, spec.target, spec.layers, spec.ports, spec.transport)
+    return registry
+
+
+class LayeredPacket(SimpleNamespace):
+    """Stands in for a pyshark packet, which exposes its dissected layers as a list"""
+    __module__ = 'pyshark.packet.packet'
+
+
+class CountingDissector:
+    fields = ('size',)
+
+    def from_payload(self, payload):
+        return (len(payload),)
+
+    def from_layer(self, layer):
+        return (int(layer.len),)
+
+
+class TestDissectors(unittest.TestCase):
+    def test_client_hello(self):
+        self.assertEqual(parse_client_hello(client_hello('example.org')),
+                         ('example.org', 'TLS 1.3', 'h2,http/1.1'))
+        self.assertEqual(parse_client_hello(client_hello('a.test', alpn=(), versions=()))[1], 'TLS 1.2')
+        # Truncated in the middle of the extensions
+        self.assertEqual(parse_client_hello(client_hello('example.org')[:60])[1], 'TLS 1.2')
+        self.assertIsNone(parse_client_hello(b'\x17\x03\x03\x00\x10' + b'\x00' * 16))
+
+    def test_payload_dispatch_is_lazy(self):
+        registry = default_registry()
+        dpi = DPIAnalyzer(dissectors=registry)
+        dpi.analyze_packet(decode_packet(1700000000.0, http_frame()))
+        dpi.analyze_packet(tcp_packet(b'\x16\x03\x01', 8080))
+        self.assertEqual(registry.loaded, [])
+
+        dpi.analyze_packet(tcp_packet(client_hello('example.org'), 443))
+        dpi.analyze_packet(tcp_packet(client_hello('example.org'), 50000, sport=443))
+        dpi.analyze_packet(udp_packet(quic_initial(), 443))
+        dpi.analyze_packet(tcp_packet(smb2_negotiate(), 445))
+        dpi.analyze_packet(tcp_packet(smb2_negotiate(response=True), 50000, sport=445))
+        self.assertEqual(sorted(registry.loaded), ['quic', 'smb', 'tls'])
+
+        self.assertEqual(dpi.dissected['tls'][0]['sni'], 'example.org')
+        self.assertEqual(dpi.dissected['quic'][0], {'timestamp': datetime.fromtimestamp(1700000000.0).isoformat(),
+                                                    'version': 'QUIC v1', 'packet_type': 'Initial',
+                                                    'dcid': '8394c8f03e515708'})
+        self.assertEqual([record['response'] for record in dpi.dissected['smb']], [False, True])
+        stats = dpi.get_dissector_statistics()
+        self.assertEqual(stats['tls'], {'records': 2, 'top_sni': {'example.org': 2}})
+        self.assertEqual(stats['smb']['top_command'], {'NEGOTIATE': 2})
+        self.assertEqual(len(dpi.http_requests), 1)
+
+    def test_layer_dispatch(self):
+        dpi = DPIAnalyzer(dissectors=default_registry())
+        tls = SimpleNamespace(layer_name='tls', handshake_type='1', handshake_version='0x0303',
+                              handshake_extensions_supported_version='0x0304',
+                              handshake_extensions_server_name='example.org',
+                              handshake_extensions_alpn_str='h2')
+        http = SimpleNamespace(layer_name='http', request_method='GET', request_uri='/', host='example.org',
+                               user_agent='curl')
+        packet = LayeredPacket(transport_layer='TCP', ip=SimpleNamespace(src='10.0.0.1', dst='10.0.0.2'),
+                               tcp=SimpleNamespace(srcport='50000', dstport='443', length='0'),
+                               sniff_time=datetime(2024, 1, 1),
+                               layers=[SimpleNamespace(layer_name='eth'), SimpleNamespace(layer_name='ip'),
+                                       SimpleNamespace(layer_name='tcp'), tls, http])
+        dpi.analyze_packet(packet)
+        record = dpi.dissected['tls'][0]
+        self.assertEqual((record['sni'], record['version'], record['alpn']), ('example.org', 'TLS 1.3', 'h2'))
+        self.assertEqual(dpi.http_requests[0]['host'], 'example.org')
+
+    def test_custom_dissector_survives_pickling_and_merge(self):
+        registry = default_registry()
+        registry.register('counting', CountingDissector, layers=('data',), ports=(9000,), transport='udp')
+        with self.assertRaises(ValueError):
+            registry.register('bad', CountingDissector, ports=(1,))
+
+        first, second = DPIAnalyzer(dissectors=registry), DPIAnalyzer(dissectors=registry)
+        first.analyze_packet(udp_packet(b'abc', 9000))
+        second.analyze_packet(udp_packet(b'abcdef', 40000, sport=9000))
+        restored = pickle.loads(pickle.dumps(first))
+        restored.analyze_packet(udp_packet(b'ab', 9000))
+        restored.merge(second)
+        self.assertEqual(sorted(record['size'] for record in restored.dissected['counting']), [2, 3, 6])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import os
+import socket
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import dpkt
+
+from analyzer.distributed import (MAX_RECORDS, Aggregator, ShardWorker, encode_delta, flow_partition,
+                                  frame_partition, run_sharded)
+from analyzer.dpkt_reader import decode_packet, read_pcap
+from analyzer.engine import AnalysisEngine
+from analyzer.fields import PacketFields, extract_fields
+from analyzer.packet_analysis import TIMELINE_SIZE
+from test_dpkt_reader import build_frame, http_frame, dns_frame, write_pcap
+
+
+class TestDistributed(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        frames = [http_frame(), dns_frame()]
+        frames += [build_frame(f'10.0.0.{i % 7 + 1}', '10.0.1.1',
+                               dpkt.tcp.TCP(sport=40000 + i, dport=80 + i % 3, flags=dpkt.tcp.TH_SYN))
+                   for i in range(40)]
+        self.pcap = os.path.join(self.tmp.name, 'a.pcap')
+        write_pcap(self.pcap, frames)
+        self.other = os.path.join(self.tmp.name, 'b.pcap')
+        write_pcap(self.other, [dns_frame()] * 3)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_partition_is_direction_independent(self):
+        forward = extract_fields(next(iter(read_pcap(self.pcap, stop=1))))
+        backward = PacketFields()
+        backward.src, backward.dst = forward.dst, forward.src
+        backward.srcport, backward.dstport = forward.dstport, forward.srcport
+        for partitions in (2, 3, 8):
+            self.assertEqual(flow_partition(forward, partitions), flow_partition(backward, partitions))
+
+    def test_frame_partition_matches_decoded_packets(self):
+        with open(self.pcap, 'rb') as f:
+            frames = [buf for _, buf in dpkt.pcap.Reader(f)]
+        for frame, packet in zip(frames, read_pcap(self.pcap)):
+            for partitions in (2, 3):
+                self.assertEqual(frame_partition(frame, partitions),
+                                 flow_partition(extract_fields(packet), partitions))
+
+    def test_file_workers_decode_only_their_frames(self):
+        aggregator = Aggregator()
+        decoded = []
+        try:
+            with mock.patch('analyzer.distributed.decode_packet',
+                            side_effect=lambda *args: decoded.append(args) or decode_packet(*args)):
+                for i in range(3):
+                    ShardWorker(aggregator.address, aggregator.authkey, f'w{i}', i, 3).run_file(self.pcap)
+            self.assertTrue(aggregator.wait(3, timeout=10))
+        finally:
+            aggregator.close()
+        expected = AnalysisEngine().run(read_pcap(self.pcap))
+        self.assertEqual(len(decoded), expected.packet_count)
+        self.assertEqual(aggregator.engine.get_flow_stats(), expected.get_flow_stats())
+        workers = aggregator.report()['workers']
+        self.assertEqual([workers[f'w{i}']['packets'] + workers[f'w{i}']['skipped'] for i in range(3)],
+                         [expected.packet_count] * 3)
+
+    def test_worker_deltas_merge_to_single_engine(self):
+        aggregator = Aggregator()
+        try:
+            for i in range(2):
+                worker = ShardWorker(aggregator.address, aggregator.authkey, f'w{i}', i, 2, interval=0.02)
+                worker.run(self.paced(read_pcap(self.pcap)))
+            self.assertTrue(aggregator.wait(['w0', 'w1'], timeout=10))
+        finally:
+            aggregator.close()
+        expected = AnalysisEngine().run(read_pcap(self.pcap))
+        merged = aggregator.engine
+        self.assertEqual(merged.packet_count, expected.packet_count)
+        self.assertEqual(merged.get_ip_statistics(), expected.get_ip_statistics())
+        self.assertEqual(merged.get_port_statistics(), expected.get_port_statistics())
+        self.assertEqual(merged.get_flow_stats(), expected.get_flow_stats())
+        stats = aggregator.report()['workers']
+        self.assertEqual(sum(worker['packets'] for worker in stats.values()), expected.packet_count)
+        self.assertGreater(stats['w0']['deltas'], 1)
+
+    def paced(self, packets):
+        # Pause mid-capture so the worker's timer ships at least one delta before the final one
+        for i, packet in enumerate(packets):
+            if i == 20:
+                time.sleep(0.1)
+            yield packet
+
+    def test_quiet_worker_ships_periodically(self):
+        aggregator = Aggregator()
+        worker = ShardWorker(aggregator.address, aggregator.authkey, 'quiet', interval=0.05)
+        try:
+            worker.process_packet(next(iter(read_pcap(self.pcap))))
+            # No further packets arrive, yet the global view is updated
+            deadline = time.monotonic() + 10
+            while aggregator.engine.packet_count < 1 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(aggregator.engine.packet_count, 1)
+            self.assertFalse(aggregator.workers['quiet']['final'])
+        finally:
+            worker.close()
+            aggregator.close()
+        with self.assertRaises(ValueError):
+            ShardWorker(aggregator.address, aggregator.authkey, interval=0)
+
+    def test_dropped_connection_keeps_accepting(self):
+        aggregator = Aggregator()
+        try:
+            # A port scan or health check that disconnects during the handshake
+            socket.create_connection(aggregator.address).close()
+            socket.create_connection(aggregator.address).close()
+            time.sleep(0.1)
+            self.assertTrue(aggregator._thread.is_alive())
+            ShardWorker(aggregator.address, aggregator.authkey, 'after-scan').run(read_pcap(self.other))
+            # Unnamed workers report as host:pid
+            ShardWorker(aggregator.address, aggregator.authkey).close()
+            self.assertTrue(aggregator.wait(['after-scan', f'{socket.gethostname()}:{os.getpid()}'],
+                                            timeout=10))
+        finally:
+            aggregator.close()
+        self.assertEqual(aggregator.engine.packet_count, 3)
+
+    def test_aggregator_view_is_bounded(self):
+        aggregator = Aggregator()
+        aggregator.close()
+        dpi, analyzer = aggregator.engine.dpi, aggregator.engine.analyzer
+        self.assertEqual((dpi.http_requests.maxlen, dpi.dns_queries.maxlen), (MAX_RECORDS, MAX_RECORDS))
+        self.assertEqual(analyzer.timeline.maxlen, TIMELINE_SIZE)
+
+        # Successive deltas are appended to the timeline kept so far
+        timeline = analyzer.timeline
+        packets = list(read_pcap(self.pcap))
+        for start in (0, 20):
+            delta = AnalysisEngine().run(packets[start:start + 20])
+            aggregator.receive(encode_delta({'worker': 'w', 'sequence': 0, 'final': False,
+                                             'skipped': 0, 'engine': delta}))
+        self.assertIs(aggregator.engine.analyzer.timeline, timeline)
+        self.assertEqual(list(timeline), list(AnalysisEngine().run(packets[:40]).analyzer.timeline))
+
+    def test_rejects_wrong_authkey(self):
+        aggregator = Aggregator()
+        try:
+            with self.assertRaises(Exception):
+                ShardWorker(aggregator.address, b'wrong', 'intruder')
+        finally:
+            aggregator.close()
+        self.assertEqual(aggregator.workers, {})
+
+    def test_run_sharded_processes(self):
+        aggregator = run_sharded([self.pcap, self.other], workers_per_source=2)
+        self.assertEqual(len(aggregator.workers), 4)
+        self.assertEqual(aggregator.engine.packet_count, 45)
+        self.assertEqual(aggregator.engine.dpi.get_dns_statistics()['queries'], 4)
+
+    def test_run_sharded_reports_failed_workers(self):
+        broken = os.path.join(self.tmp.name, 'broken.pcap')
+        with open(broken, 'wb') as f:
+            f.write(b'not a capture file')
+        with self.assertRaisesRegex(RuntimeError, r'broken\.pcap#0 \(exit code 1\)'):
+            run_sharded([self.other, broken])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import socket
+import tempfile
+import unittest
+
+import dpkt
+
+from analyzer.dpkt_reader import read_pcap, decode_packet
+from analyzer.dpi_engine import DPIAnalyzer
+from analyzer.packet_capture import PacketCapture
+
+
+def build_frame(src, dst, segment):
+    """Wrap a TCP/UDP segment in IPv4 and Ethernet headers"""
+    proto = dpkt.ip.IP_PROTO_TCP if isinstance(segment, dpkt.tcp.TCP) else dpkt.ip.IP_PROTO_UDP
+    ip = dpkt.ip.IP(src=socket.inet_aton(src), dst=socket.inet_aton(dst), p=proto, data=segment)
+    ip.len = len(bytes(ip))
+    eth = dpkt.ethernet.Ethernet(src=b'\x00' * 6, dst=b'\x00' * 6,
+                                 type=dpkt.ethernet.ETH_TYPE_IP, data=ip)
+    return bytes(eth)
+
+
+def http_frame():
+    payload = b'GET /index.html HTTP/1.1\r\nHost: example.com\r\nUser-Agent: TestAgent\r\n\r\n'
+    tcp = dpkt.tcp.TCP(sport=12345, dport=80, seq=1, flags=dpkt.tcp.TH_ACK | dpkt.tcp.TH_PUSH,
+                       data=payload)
+    return build_frame('192.168.1.1', '192.168.1.2', tcp)
+
+
+def dns_frame():
+    dns = dpkt.dns.DNS(id=7, qd=[dpkt.dns.DNS.Q(name='example.com', type=dpkt.dns.DNS_A)])
+    udp = dpkt.udp.UDP(sport=5000, dport=53, data=bytes(dns))
+    udp.ulen = len(bytes(udp))
+    return build_frame('192.168.1.1', '8.8.8.8', udp)
+
+
+def write_pcap(path, frames, start=1700000000.0):
+    with open(path, 'wb') as f:
+        writer = dpkt.pcap.Writer(f)
+        for i, frame in enumerate(frames):
+            writer.writepkt(frame, ts=start + i)
+
+
+class TestDpktReader(unittest.TestCase):
+    def setUp(self):
+        fd, self.pcap_path = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+        write_pcap(self.pcap_path, [http_frame(), dns_frame()])
+
+    def tearDown(self):
+        os.remove(self.pcap_path)
+
+    def test_decode_layers(self):
+        packets = list(read_pcap(self.pcap_path))
+        self.assertEqual(len(packets), 2)
+
+        http_packet, dns_packet = packets
+        self.assertEqual(http_packet.transport_layer, 'TCP')
+        self.assertEqual(http_packet.ip.src, '192.168.1.1')
+        self.assertEqual(http_packet.tcp.dstport, '80')
+        self.assertEqual(http_packet.http.host, 'example.com')
+        self.assertFalse(hasattr(http_packet, 'udp'))
+        self.assertFalse(hasattr(http_packet, 'dns'))
+
+        self.assertEqual(dns_packet.transport_layer, 'UDP')
+        self.assertEqual(dns_packet.udp.dstport, '53')
+        self.assertEqual(dns_packet.dns.qry_name, 'example.com')
+        self.assertFalse(dns_packet.dns.flags_response)
+        self.assertEqual(dns_packet.sniff_time.timestamp(), 1700000001.0)
+
+    def test_non_ip_frame(self):
+        arp = dpkt.ethernet.Ethernet(type=dpkt.ethernet.ETH_TYPE_ARP, data=b'\x00' * 28)
+        packet = decode_packet(0.0, bytes(arp))
+        self.assertIsNone(packet.transport_layer)
+        self.assertFalse(hasattr(packet, 'ip'))
+
+    def test_dpi_on_dpkt_backend(self):
+        capture = PacketCapture(interface='eth0', backend='dpkt')
+        dpi = DPIAnalyzer()
+        for packet in capture.analyze_pcap_file(self.pcap_path):
+            dpi.analyze_packet(packet)
+
+        self.assertEqual(dpi.get_protocol_statistics(), {'TCP': 1, 'UDP': 1})
+        self.assertEqual(dpi.get_ip_statistics()['192.168.1.1'], 2)
+        self.assertEqual(dpi.get_port_statistics()['53'], 1)
+        self.assertEqual(dpi.http_requests[0]['uri'], '/index.html')
+        self.assertEqual(dpi.dns_queries[0]['query'], 'example.com')
+
+    def test_streaming_iteration(self):
+        capture = PacketCapture(interface='eth0', backend='dpkt')
+        stream = capture.iter_pcap_file(self.pcap_path)
+        self.assertFalse(isinstance(stream, list))
+        self.assertEqual(next(stream).transport_layer, 'TCP')
+        self.assertEqual(next(stream).transport_layer, 'UDP')
+        self.assertIsNone(next(stream, None))
+
+    def test_invalid_backend(self):
+        with self.assertRaises(ValueError):
+            PacketCapture(interface='eth0', backend='scapy')
+        with self.assertRaises(ValueError):
+            PacketCapture(interface='eth0', display_filter='tcp', backend='dpkt')
+
+if __name__ == '__main__':
+    unittest.main()
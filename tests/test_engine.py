@@ -0,0 +1,58 @@
+import unittest
+from unittest.mock import MagicMock
+from analyzer.engine import AnalysisEngine
+from analyzer.packet_analysis import PacketAnalyzer
+from test_packet_analysis import make_packet
+
+class CountingPacket:
+    """Wraps a packet and counts attribute lookups"""
+    def __init__(self, packet, counter):
+        self._packet = packet
+        self._counter = counter
+
+    def __getattr__(self, name):
+        self._counter[0] += 1
+        return getattr(self._packet, name)
+
+class TestAnalysisEngine(unittest.TestCase):
+    def setUp(self):
+        self.packets = [make_packet('10.0.0.9', '10.0.0.2', port, seconds=port) for port in range(20)]
+        self.packets.append(make_packet('10.0.0.2', '10.0.0.9', 40000, srcport='80'))
+
+    def test_matches_separate_passes(self):
+        engine = AnalysisEngine().run(iter(self.packets))
+
+        reference = PacketAnalyzer()
+        flows = reference.analyze_flow(self.packets)
+        anomalies = reference.detect_anomalies(self.packets, threshold=10)
+        conversations = reference.get_conversation_stats(self.packets)
+
+        self.assertEqual(dict(engine.get_flow_stats()), dict(flows))
+        self.assertEqual(engine.get_anomalies(threshold=10), anomalies)
+        self.assertEqual(dict(engine.get_conversation_stats()), dict(conversations))
+        self.assertEqual(engine.get_protocol_statistics(), {'TCP': 21})
+        self.assertEqual(engine.get_ip_statistics()['10.0.0.9'], 21)
+        self.assertEqual(engine.packet_count, 21)
+
+    def test_single_decode_per_packet(self):
+        counter = [0]
+        engine = AnalysisEngine()
+        engine.process_packet(CountingPacket(self.packets[0], counter))
+        # transport_layer, ip, tcp, sniff_time, http, dns
+        self.assertLessEqual(counter[0], 6)
+
+    def test_http_and_dns_extraction(self):
+        packet = MagicMock()
+        packet.ip.src = '10.0.0.1'
+        packet.ip.dst = '10.0.0.2'
+        packet.http.request_method = 'GET'
+        packet.dns.qry_name = 'example.com'
+        packet.sniff_time.isoformat.return_value = '2023-01-01T00:00:00'
+
+        engine = AnalysisEngine()
+        engine.process_packet(packet)
+        self.assertEqual(engine.dpi.http_requests[0]['method'], 'GET')
+        self.assertEqual(engine.dpi.dns_queries[0]['query'], 'example.com')
+
+if __name__ == '__main__':
+    unittest.main()
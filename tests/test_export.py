@@ -0,0 +1,130 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+
+import dpkt
+import numpy as np
+
+from analyzer.dpi_engine import DPIAnalyzer
+from analyzer.dpkt_reader import decode_packet
+from analyzer.engine import AnalysisEngine
+from analyzer.export import (save_results, save_tables, load_results, collect_tables, counter_table,
+                             record_table, window_table)
+from analyzer.packet_analysis import PacketAnalyzer
+from analyzer.records import RecordStore
+from test_dpkt_reader import build_frame, http_frame, dns_frame
+
+T0 = 1700000000.0
+
+
+def run_engine(flow_table=False, flow_key='pair'):
+    engine = AnalysisEngine(analyzer=PacketAnalyzer(flow_table=flow_table, flow_key=flow_key))
+    frames = [http_frame(), dns_frame(), http_frame(),
+              build_frame('10.0.0.5', '10.0.0.6', dpkt.tcp.TCP(sport=1000, dport=22))]
+    for i, frame in enumerate(frames):
+        engine.process_packet(decode_packet(T0 + 45 * i, frame))
+    return engine
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'results')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def check_round_trip(self, engine, format, mmap=True):
+        save_results(self.path, engine, format=format, window=60)
+        results = load_results(self.path, mmap=mmap)
+
+        self.assertEqual(results.format, format)
+        self.assertEqual(set(results.names), {'flows', 'windows', 'conversations', 'http_requests',
+                                              'dns_queries', 'protocols', 'ips', 'ports'})
+        flows = results.to_pandas('flows')
+        by_pair = {(row.src, row.dst): row for row in flows.itertuples()}
+        self.assertEqual(by_pair[('192.168.1.1', '192.168.1.2')].packet_count, 2)
+        self.assertEqual(len(flows), len(engine.get_flow_stats()))
+
+        http = results.table('http_requests')
+        self.assertEqual(len(http), 2)
+        self.assertEqual(list(http.decode('uri')), ['/index.html', '/index.html'])
+        self.assertEqual(int(http['timestamp_ns'][1]), int((T0 + 90) * 1e9))
+        self.assertEqual(list(results.table('dns_queries').decode('query')), ['example.com'])
+
+        windows = results.table('windows')
+        self.assertEqual(list(windows['packets']), [1, 2, 1])  # windows align to the epoch
+        self.assertEqual(int(windows['packets'].sum()), engine.packet_count)
+
+        protocols = results.table('protocols')
+        self.assertEqual(dict(zip(protocols['key'], protocols['count'])), {'TCP': 3, 'UDP': 1})
+        return results
+
+    def test_npy_round_trip_is_memory_mapped(self):
+        results = self.check_round_trip(run_engine(), 'npy')
+        self.assertIsInstance(results.table('flows')['packet_count'], np.memmap)
+
+    def test_npz_round_trip(self):
+        self.check_round_trip(run_engine(), 'npz')
+
+    def test_flow_table_and_dict_flows_export_alike(self):
+        for flow_key in ('pair', '5tuple'):
+            exact = collect_tables(run_engine(flow_key=flow_key))['flows'].to_pandas()
+            compact = collect_tables(run_engine(flow_table=True, flow_key=flow_key))['flows'].to_pandas()
+            columns = ['src', 'dst', 'srcport', 'dstport', 'packet_count', 'byte_count', 'start_ns', 'end_ns']
+            exact = exact[columns].astype({'src': str, 'dst': str}).sort_values(columns).reset_index(drop=True)
+            compact = compact[columns].astype({'src': str, 'dst': str}).sort_values(columns).reset_index(drop=True)
+            self.assertTrue(exact.equals(compact), flow_key)
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), "pyarrow not installed")
+    def test_parquet_round_trip(self):
+        self.check_round_trip(run_engine(flow_table=True), 'parquet')
+
+    def test_parquet_without_pyarrow(self):
+        if importlib.util.find_spec('pyarrow'):
+            self.skipTest("pyarrow installed")
+        with self.assertRaises(ImportError):
+            save_results(self.path, run_engine(), format='parquet')
+
+    def test_dpi_only_and_errors(self):
+        save_results(self.path, dpi=DPIAnalyzer(), format='npy')
+        results = load_results(self.path)
+        self.assertEqual(results.rows('http_requests'), 0)
+        self.assertEqual(len(results.to_pandas('http_requests')), 0)
+        self.assertNotIn('flows', results)
+        with self.assertRaises(ValueError):
+            save_results(self.path, dpi=DPIAnalyzer(), format='csv')
+
+    def test_none_values_round_trip(self):
+        store = RecordStore(('host', 'user_agent'))
+        store.add(T0, 'a.example', None)
+        store.add(T0 + 1, None, 'UA')
+        tables = {'requests': record_table(store), 'hosts': counter_table({'a.example': 2, None: 1})}
+        for format in ('npy', 'npz'):
+            save_tables(self.path, tables, format=format)
+            results = load_results(self.path)
+            requests = results.table('requests')
+            self.assertEqual(list(requests.decode('host')), ['a.example', None])
+            self.assertEqual(list(requests.decode('user_agent')), [None, 'UA'])
+            self.assertEqual(results.to_pandas('requests')['host'].isna().tolist(), [False, True])
+            self.assertEqual(list(results.table('hosts').decode('key')), ['a.example', None])
+
+    def test_npy_export_replaces_stale_columns(self):
+        save_results(self.path, run_engine(), format='npy')
+        # A later export of a table without the dictionary-encoded 'host' column
+        store = RecordStore(('method',))
+        store.add(T0, 'GET')
+        save_tables(self.path, {'http_requests': record_table(store)}, format='npy')
+        http = load_results(self.path).table('http_requests')
+        self.assertEqual(set(http.columns), {'method', 'timestamp_ns'})
+        self.assertEqual(set(os.listdir(self.path)), {'http_requests', 'flows', 'windows', 'conversations',
+                                                      'dns_queries', 'protocols', 'ips', 'ports',
+                                                      'manifest.json'})
+
+    def test_empty_timeline(self):
+        self.assertEqual(len(window_table([])), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
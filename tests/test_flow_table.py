@@ -0,0 +1,59 @@
+import pickle
+import unittest
+
+import numpy as np
+
+from analyzer.fields import extract_fields
+from analyzer.flow_table import FlowTable, ip_to_int, int_to_ip
+from analyzer.packet_analysis import PacketAnalyzer
+from test_packet_analysis import make_packet
+
+class TestFlowTable(unittest.TestCase):
+    def setUp(self):
+        self.packets = [make_packet('10.0.0.%d' % (i % 5), '10.0.1.%d' % (i % 3), 80 + i % 4,
+                                    seconds=i, srcport=str(40000 + i % 2))
+                        for i in range(3000)]
+        self.packets.append(make_packet('2001:db8::1', '2001:db8::2', 443, seconds=5))
+
+    def test_matches_dict_flows(self):
+        for flow_key in ('pair', '5tuple'):
+            expected = PacketAnalyzer(flow_key=flow_key).analyze_flow(self.packets)
+            table = PacketAnalyzer(flow_key=flow_key, flow_table=True).analyze_flow(self.packets)
+
+            self.assertIsInstance(table, FlowTable)
+            self.assertEqual(len(table), len(expected))
+            self.assertEqual(dict(table), dict(expected))
+
+    def test_anomalies_from_flow_table(self):
+        expected = PacketAnalyzer().detect_anomalies(self.packets, threshold=50)
+        anomalies = PacketAnalyzer(flow_table=True).detect_anomalies(self.packets, threshold=50)
+        self.assertEqual(anomalies, expected)
+
+    def test_zero_copy_pandas(self):
+        analyzer = PacketAnalyzer(flow_table=True)
+        table = analyzer.analyze_flow(self.packets)
+        df = table.to_pandas(decode_addresses=True)
+
+        self.assertTrue(np.shares_memory(df['packet_count'].to_numpy(), table.column('packet_count')))
+        self.assertEqual(int(df['packet_count'].sum()), len(self.packets))
+        self.assertEqual(df.loc[0, 'src_ip'], '10.0.0.0')
+
+        # Growing the table while a view is alive must not fail
+        analyzer._update_flow(table, extract_fields(make_packet('172.16.0.1', '10.0.1.1', 80)))
+        self.assertEqual(len(table), len(df) + 1)
+
+    def test_merge_and_pickle(self):
+        half = len(self.packets) // 2
+        first = PacketAnalyzer(flow_key='5tuple', flow_table=True).analyze_flow(self.packets[:half])
+        second = PacketAnalyzer(flow_key='5tuple', flow_table=True).analyze_flow(self.packets[half:])
+        merged = pickle.loads(pickle.dumps(first)).merge(pickle.loads(pickle.dumps(second)))
+
+        expected = PacketAnalyzer(flow_key='5tuple').analyze_flow(self.packets)
+        self.assertEqual(dict(merged), dict(expected))
+
+    def test_ip_encoding(self):
+        for address in ('192.168.1.1', '::1', '2001:db8::ff'):
+            self.assertEqual(int_to_ip(ip_to_int(address)), address)
+
+if __name__ == '__main__':
+    unittest.main()
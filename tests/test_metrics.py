@@ -0,0 +1,127 @@
+import asyncio
+import os
+import pickle
+import tempfile
+import unittest
+import urllib.error
+import urllib.request
+from unittest import mock
+
+from analyzer.async_capture import AsyncCapturePipeline
+from analyzer.dpkt_reader import read_pcap
+from analyzer.engine import AnalysisEngine
+from analyzer.metrics import Metrics, peak_rss, serve_metrics
+from test_dpkt_reader import http_frame, dns_frame, write_pcap
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        fd, self.pcap_path = tempfile.mkstemp(suffix='.pcap')
+        os.close(fd)
+        write_pcap(self.pcap_path, [http_frame(), dns_frame()] * 5)
+
+    def tearDown(self):
+        os.remove(self.pcap_path)
+
+    def test_engine_stages(self):
+        metrics = Metrics()
+        engine = AnalysisEngine(metrics=metrics).run(read_pcap(self.pcap_path))
+        snapshot = metrics.snapshot()
+
+        self.assertEqual(set(snapshot['stages']), {'decode', 'extract', 'dpi', 'flows'})
+        for stage in snapshot['stages'].values():
+            self.assertEqual(stage['packets'], 10)
+            self.assertGreater(stage['total_seconds'], 0)
+            self.assertLessEqual(stage['p50_seconds'], stage['p99_seconds'])
+        self.assertIn('resident_memory_bytes', snapshot['gauges'])
+        self.assertEqual(len(engine.dpi.http_requests), 5)
+        # Metrics stay with the process that owns them
+        self.assertIsNone(pickle.loads(pickle.dumps(engine)).metrics)
+
+    def test_peak_rss_without_resource_module(self):
+        self.assertGreater(peak_rss(), 0)
+        # Windows has no resource module: fall back to psutil, or report 0
+        with mock.patch.dict('sys.modules', {'resource': None, 'psutil': None}):
+            self.assertEqual(peak_rss(), 0)
+            self.assertIn('peak_resident_memory_bytes', Metrics().snapshot()['gauges'])
+
+    def test_sampling(self):
+        metrics = Metrics(sample_every=4)
+        packets = list(read_pcap(self.pcap_path)) * 2
+        engine = AnalysisEngine(metrics=metrics).run(packets)
+        stages = metrics.snapshot()['stages']
+        # 20 packets, every fourth one timed and standing for four
+        self.assertEqual(stages['decode']['packets'], 20)
+        self.assertEqual(stages['dpi']['packets'], 20)
+        self.assertEqual(sum(metrics.stages['dpi'].buckets), 20)
+        self.assertEqual(engine.packet_count, 20)
+        self.assertEqual(len(engine.dpi.http_requests), 10)
+        with self.assertRaises(ValueError):
+            Metrics(sample_every=0)
+
+    def test_stage_errors(self):
+        metrics = Metrics()
+        engine = AnalysisEngine(metrics=metrics)
+        # An HTTP layer without a capture time fails inside the DPI stage
+        packet = type('Packet', (), {'http': object()})()
+        engine.process_packet(packet)
+        stages = metrics.snapshot()['stages']
+        self.assertEqual(stages['dpi']['errors'], 1)
+        self.assertEqual(stages['extract']['errors'], 0)
+        self.assertNotIn('flows', stages)
+
+    def test_prometheus_text(self):
+        metrics = Metrics()
+        metrics.observe('dpi', 3000)
+        metrics.observe('dpi', 2000000)
+        metrics.count('dropped_packets_total', 4, reason='queue_full')
+        metrics.register_gauge('queue_depth', lambda: 7, queue='capture')
+        text = metrics.to_prometheus()
+
+        self.assertIn('packet_analyzer_stage_packets_total{stage="dpi"} 2', text)
+        self.assertIn('packet_analyzer_stage_latency_seconds_bucket{stage="dpi",le="5e-06"} 1', text)
+        self.assertIn('packet_analyzer_stage_latency_seconds_bucket{stage="dpi",le="+Inf"} 2', text)
+        self.assertIn('packet_analyzer_stage_latency_seconds_sum{stage="dpi"} 0.002003000', text)
+        self.assertIn('# TYPE packet_analyzer_dropped_packets_total counter', text)
+        self.assertIn('packet_analyzer_dropped_packets_total{reason="queue_full"} 4', text)
+        self.assertIn('packet_analyzer_queue_depth{queue="capture"} 7', text)
+
+        path = os.path.join(tempfile.gettempdir(), f'metrics-{os.getpid()}.prom')
+        metrics.write_prometheus(path)
+        with open(path) as f:
+            self.assertIn('stage_packets_total', f.read())
+        os.remove(path)
+
+    def test_http_endpoint(self):
+        metrics = Metrics()
+        metrics.observe('decode', 1000)
+        server = serve_metrics(metrics, port=0)
+        try:
+            url = 'http://127.0.0.1:%d' % server.server_address[1]
+            with urllib.request.urlopen(url + '/metrics', timeout=5) as response:
+                self.assertTrue(response.headers['Content-Type'].startswith('text/plain'))
+                self.assertIn(b'stage="decode"', response.read())
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(url + '/other', timeout=5)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_async_pipeline_drops(self):
+        metrics = Metrics()
+        pipeline = AsyncCapturePipeline(queue_size=1, policy='drop', metrics=metrics)
+
+        async def burst():
+            for packet in read_pcap(self.pcap_path):
+                yield packet
+
+        stats = asyncio.run(pipeline.run(burst()))
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters'].get('dropped_packets_total{reason="queue_full"}', 0),
+                         stats['dropped'])
+        self.assertEqual(snapshot['stages']['queue']['packets'], stats['processed'])
+        self.assertEqual(snapshot['gauges']['queue_depth{queue="capture"}'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
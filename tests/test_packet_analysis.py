@@ -0,0 +1,57 @@
+import unittest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from analyzer.packet_analysis import PacketAnalyzer, TIMELINE_SIZE
+
+START = datetime(2023, 1, 1)
+
+def make_packet(src, dst, dstport, seconds=0, srcport='40000', length='60'):
+    return SimpleNamespace(
+        transport_layer='TCP',
+        ip=SimpleNamespace(src=src, dst=dst),
+        tcp=SimpleNamespace(srcport=srcport, dstport=str(dstport), length=length),
+        sniff_time=START + timedelta(seconds=seconds)
+    )
+
+class TestPacketAnalyzer(unittest.TestCase):
+    def setUp(self):
+        self.analyzer = PacketAnalyzer()
+
+    def test_flow_analysis(self):
+        packets = [make_packet('10.0.0.1', '10.0.0.2', 80, seconds=i) for i in range(3)]
+        flows = self.analyzer.analyze_flow(packets)
+
+        flow = flows[('10.0.0.1', '10.0.0.2')]
+        self.assertEqual(flow['packet_count'], 3)
+        self.assertEqual(flow['byte_count'], 180)
+        self.assertEqual(flow['protocols'], {'TCP'})
+        self.assertEqual(flow['end_time'] - flow['start_time'], timedelta(seconds=2))
+
+    def test_anomalies_from_generator(self):
+        # A generator can only be consumed once, so this checks for a single pass
+        packets = (make_packet('10.0.0.9', '10.0.0.2', port) for port in range(20))
+        anomalies = self.analyzer.detect_anomalies(packets, threshold=10)
+
+        self.assertEqual(anomalies['port_scans']['10.0.0.9'], 20)
+        self.assertEqual(len(anomalies['high_volume_flows']), 1)
+        self.assertEqual(anomalies['high_volume_flows'][0]['packet_count'], 20)
+
+    def test_possible_ddos(self):
+        packets = [make_packet('172.16.0.%d' % i, '10.0.0.2', 80) for i in range(60)]
+        anomalies = self.analyzer.detect_anomalies(packets, ddos_threshold=50)
+        self.assertEqual(anomalies['possible_ddos'], [{'target': '10.0.0.2', 'source_count': 60}])
+
+    def test_bounded_timeline(self):
+        analyzer = PacketAnalyzer(timeline_size=5)
+        analyzer.analyze_flow(make_packet('10.0.0.1', '10.0.0.2', 80, seconds=i) for i in range(50))
+        self.assertEqual(len(analyzer.timeline), 5)
+        self.assertEqual(analyzer.timeline[-1][0], START + timedelta(seconds=49))
+        self.assertEqual(PacketAnalyzer().timeline.maxlen, TIMELINE_SIZE)
+
+    def test_conversation_stats(self):
+        packets = [make_packet('10.0.0.1', '10.0.0.2', 80), make_packet('10.0.0.2', '10.0.0.1', 40000)]
+        conversations = self.analyzer.get_conversation_stats(iter(packets))
+        self.assertEqual(conversations[('10.0.0.1', '10.0.0.2')], 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
+import asyncio
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from analyzer.packet_capture import PacketCapture
 from analyzer.utils import get_network_interfaces
 
@@ -20,6 +21,7 @@ class TestPacketCapture(unittest.TestCase):
         mock_live_capture.assert_called_once_with(
             interface='eth0',
             display_filter=None,
+            bpf_filter=None,
             output_file=None
         )
         mock_capture.sniff.assert_called_once_with(packet_count=3, timeout=30)
@@ -42,6 +44,53 @@ class TestPacketCapture(unittest.TestCase):
             display_filter=None
         )
         
+    @patch('analyzer.packet_capture.pyshark.FileCapture')
+    def test_pcap_streaming(self, mock_file_capture):
+        mock_capture = MagicMock()
+        mock_capture.__iter__.return_value = iter(['pkt1', 'pkt2'])
+        mock_file_capture.return_value = mock_capture
+
+        capture = PacketCapture(interface='eth0')
+        packets = list(capture.iter_pcap_file('test.pcap'))
+
+        self.assertEqual(packets, ['pkt1', 'pkt2'])
+        mock_file_capture.assert_called_once_with(
+            'test.pcap',
+            display_filter=None,
+            keep_packets=False
+        )
+        mock_capture.close.assert_called_once()
+
+    @patch('analyzer.packet_capture.pyshark.LiveCapture')
+    def test_live_streaming(self, mock_live_capture):
+        mock_capture = MagicMock()
+        mock_capture.sniff_continuously.return_value = iter(['pkt1', 'pkt2'])
+        mock_live_capture.return_value = mock_capture
+
+        capture = PacketCapture(interface='eth0')
+        packets = list(capture.iter_live_capture(packet_count=2))
+
+        self.assertEqual(packets, ['pkt1', 'pkt2'])
+        mock_capture.sniff_continuously.assert_called_once_with(packet_count=2)
+
+    @patch('analyzer.packet_capture.pyshark.LiveCapture')
+    def test_async_live_streaming(self, mock_live_capture):
+        parser = MagicMock()
+        parser.get_packets_from_stream = AsyncMock(side_effect=[('pkt1', b''), (None, b'partial'),
+                                                                ('pkt2', b''), EOFError()])
+        mock_capture = MagicMock()
+        mock_capture._get_tshark_process = AsyncMock(return_value=MagicMock())
+        mock_capture._setup_tshark_output_parser.return_value = parser
+        mock_capture.close_async = AsyncMock()
+        mock_live_capture.return_value = mock_capture
+
+        async def collect():
+            capture = PacketCapture(interface='eth0')
+            return [packet async for packet in capture.aiter_live_capture()]
+
+        self.assertEqual(asyncio.run(collect()), ['pkt1', 'pkt2'])
+        mock_capture.close_async.assert_awaited_once()
+
     def test_interface_selection(self):
         # Test that interface selection works
         interfaces = get_network_interfaces()
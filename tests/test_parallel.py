@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+
+import dpkt
+
+from analyzer.dpkt_reader import read_pcap
+from analyzer.engine import AnalysisEngine
+from analyzer.parallel import analyze_parallel, analyze_shard, plan_shards
+from test_dpkt_reader import build_frame, http_frame, dns_frame, write_pcap
+
+def tcp_frame(src, dst, dport):
+    return build_frame(src, dst, dpkt.tcp.TCP(sport=40000, dport=dport, data=b'x' * 10))
+
+class TestParallelAnalysis(unittest.TestCase):
+    def setUp(self):
+        self.paths = []
+        for n in range(2):
+            fd, path = tempfile.mkstemp(suffix='.pcap')
+            os.close(fd)
+            frames = [tcp_frame('10.0.0.%d' % n, '10.0.1.1', port) for port in range(1, 30)]
+            frames += [http_frame(), dns_frame()]
+            write_pcap(path, frames, start=1700000000.0 + n * 1000)
+            self.paths.append(path)
+
+    def tearDown(self):
+        for path in self.paths:
+            os.remove(path)
+
+    def serial_engine(self):
+        engine = AnalysisEngine()
+        for path in self.paths:
+            engine.run(read_pcap(path))
+        return engine
+
+    def test_plan_shards(self):
+        shards = plan_shards(self.paths[:1], chunks_per_file=4)
+        self.assertEqual(len(shards), 4)
+        # Contiguous byte ranges ending on record boundaries, ~8 packets each
+        self.assertEqual(shards[0][1], 0)
+        self.assertEqual(shards[-1][2], os.path.getsize(self.paths[0]))
+        for previous, shard in zip(shards, shards[1:]):
+            self.assertEqual(previous[2], shard[1])
+        counts = [analyze_shard(shard).packet_count for shard in shards]
+        self.assertEqual(counts, [8, 8, 8, 7])
+        self.assertEqual(plan_shards(self.paths[:1]), [(self.paths[0], 0, None)])
+
+    def test_parallel_matches_serial(self):
+        expected = self.serial_engine()
+        merged = analyze_parallel(self.paths, workers=2, chunks_per_file=3)
+
+        self.assertEqual(merged.packet_count, expected.packet_count)
+        self.assertEqual(merged.get_ip_statistics(), expected.get_ip_statistics())
+        self.assertEqual(merged.get_port_statistics(), expected.get_port_statistics())
+        self.assertEqual(dict(merged.get_flow_stats()), dict(expected.get_flow_stats()))
+        self.assertEqual(merged.get_anomalies(threshold=10), expected.get_anomalies(threshold=10))
+        self.assertEqual(list(merged.dpi.http_requests), list(expected.dpi.http_requests))
+        self.assertEqual(list(merged.analyzer.timeline), list(expected.analyzer.timeline))
+
+if __name__ == '__main__':
+    unittest.main()
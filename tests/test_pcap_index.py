@@ -0,0 +1,130 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+import dpkt
+
+from analyzer.dpkt_reader import read_pcap
+from analyzer.packet_capture import PacketCapture
+from analyzer.pcap_index import build_index, open_index, iter_records, PcapFormatError
+from test_dpkt_reader import build_frame
+
+T0 = 1700000000.0
+
+
+def frames(count):
+    """Host 10.0.0.<i % 50> talks to 10.1.0.1 on port 1000 + i % 7"""
+    result = []
+    for i in range(count):
+        tcp = dpkt.tcp.TCP(sport=40000, dport=1000 + i % 7, flags=dpkt.tcp.TH_ACK)
+        result.append(build_frame(f'10.0.0.{i % 50}', '10.1.0.1', tcp))
+    return result
+
+
+def write_capture(path, frames, pcapng=False, nano=False, step=0.01):
+    with open(path, 'wb') as f:
+        writer = dpkt.pcapng.Writer(f) if pcapng else dpkt.pcap.Writer(f, nano=nano)
+        for i, frame in enumerate(frames):
+            writer.writepkt(frame, ts=T0 + i * step)
+
+
+class TestPacketIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pcap = os.path.join(self.tmp.name, 'capture.pcap')
+        write_capture(self.pcap, frames(1000))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_offsets_and_timestamps_match_reader(self):
+        for pcapng, nano in ((False, False), (False, True), (True, False)):
+            path = os.path.join(self.tmp.name, f'variant{pcapng}{nano}')
+            write_capture(path, frames(20), pcapng=pcapng, nano=nano)
+            index = build_index(path, block_size=8)
+            expected = list(read_pcap(path))
+            self.assertEqual(len(index), 20)
+            decoded = list(index.query())
+            self.assertEqual([p.ip.src for p in decoded], [p.ip.src for p in expected])
+            for mine, theirs in zip(decoded, expected):
+                self.assertAlmostEqual(mine.sniff_timestamp, theirs.sniff_timestamp, places=5)
+            self.assertEqual(index.linktypes, [dpkt.pcap.DLT_EN10MB])
+
+    def test_time_range_query(self):
+        index = build_index(self.pcap, block_size=100)
+        start = datetime.fromtimestamp(T0 + 2.0)
+        end = T0 + 2.995
+        packets = list(index.query(start=start, end=end))
+        self.assertEqual(len(packets), 100)
+        self.assertEqual(packets[0].ip.src, '10.0.0.0')
+        # Only the blocks overlapping the range are considered
+        self.assertEqual(list(index.candidate_blocks(start, end)), [2])
+
+    def test_host_and_port_queries(self):
+        index = build_index(self.pcap, block_size=100)
+        by_host = list(index.query(host='10.0.0.7'))
+        self.assertEqual(len(by_host), 20)
+        self.assertTrue(all(p.ip.src == '10.0.0.7' for p in by_host))
+
+        by_port = list(index.query(port=1003, end=T0 + 0.99))
+        self.assertEqual(len(by_port), len([i for i in range(100) if i % 7 == 3]))
+
+        both = list(index.query(host='10.0.0.3', port=1003))
+        self.assertEqual(len(both), len([i for i in range(1000) if i % 50 == 3 and i % 7 == 3]))
+        self.assertEqual(list(index.query(host='192.0.2.1')), [])
+        self.assertEqual(len(index.candidate_blocks(host='192.0.2.1')), 0)
+
+        filtered = list(index.query(host='10.0.0.7', bpf_filter='dst port 1000'))
+        self.assertEqual(len(filtered), len([i for i in range(1000) if i % 50 == 7 and i % 7 == 0]))
+
+    def test_index_is_reused_and_rebuilt_when_stale(self):
+        first = open_index(self.pcap, block_size=100)
+        self.assertTrue(os.path.exists(self.pcap + '.idx'))
+        reopened = open_index(self.pcap, build=False)
+        self.assertEqual(len(reopened), 1000)
+        self.assertTrue(reopened.is_current())
+
+        write_capture(self.pcap, frames(1200))
+        os.utime(self.pcap, ns=(0, first.metadata['mtime_ns'] + 1000))
+        self.assertFalse(reopened.is_current())
+        self.assertIsNone(open_index(self.pcap, build=False))
+        self.assertEqual(len(open_index(self.pcap)), 1200)
+
+    def test_appended_capture_extends_index(self):
+        for pcapng in (False, True):
+            path = os.path.join(self.tmp.name, f'growing{pcapng}')
+            write_capture(path, frames(250), pcapng=pcapng)
+            first = open_index(path, block_size=100)
+            # The capture keeps growing: its first 250 records are unchanged
+            write_capture(path, frames(420), pcapng=pcapng)
+            extended = open_index(path)
+            self.assertTrue(extended.is_current())
+            self.assertEqual(extended.metadata['block_size'], 100)
+            self.assertGreater(extended.metadata['block_end'], first.metadata['block_end'])
+            fresh = build_index(path, os.path.join(self.tmp.name, 'fresh.idx'), block_size=100)
+            for table in ('packets', 'blocks'):
+                for name, column in fresh.__dict__[table].columns.items():
+                    self.assertEqual(extended.__dict__[table][name].tolist(), column.tolist(), name)
+            self.assertEqual(len(list(extended.query(host='10.0.0.7'))), 9)
+
+        # A rewritten capture is indexed from scratch
+        write_capture(self.pcap, frames(1000), step=0.02)
+        first = open_index(self.pcap, block_size=100)
+        write_capture(self.pcap, frames(1100), step=0.01)
+        self.assertFalse(first.is_prefix())
+        self.assertEqual(open_index(self.pcap).packets['ts_ns'][999], int(T0 * 1e9) + 9990000000)
+
+    def test_rejects_other_files(self):
+        with self.assertRaises(PcapFormatError):
+            iter_records(b'not a capture file')
+
+    def test_packet_capture_query(self):
+        capture = PacketCapture(interface='eth0', backend='dpkt', bpf_filter='dst port 1001')
+        packets = list(capture.query_pcap_file(self.pcap, host='10.0.0.1'))
+        self.assertEqual(len(packets), len([i for i in range(1000) if i % 50 == 1 and i % 7 == 1]))
+        self.assertTrue(all(p.tcp.dstport == '1001' for p in packets))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import struct
+import unittest
+
+import dpkt
+
+from analyzer.dpi_engine import DPIAnalyzer
+from analyzer.dpkt_reader import decode_packet
+from analyzer.fields import extract_fields
+from analyzer.reassembly import TCPReassembler, HTTPRequestParser, tcp_segment
+from test_dpkt_reader import build_frame
+
+CLIENT = ('10.0.0.1', 40000)
+SERVER = ('10.0.0.2', 80)
+ISN = 0xFFFFFF00  # close to wrap-around
+
+
+def segment(offset, payload=b'', flags=dpkt.tcp.TH_ACK, seconds=0.0, client=CLIENT, server=SERVER,
+            isn=ISN):
+    tcp = dpkt.tcp.TCP(sport=client[1], dport=server[1], seq=(isn + 1 + offset) % (1 << 32),
+                       flags=flags, data=payload)
+    return decode_packet(1700000000.0 + seconds, build_frame(client[0], server[0], tcp))
+
+
+def feed(reassembler, packets):
+    messages = []
+    for packet in packets:
+        messages += reassembler.process(extract_fields(packet), *tcp_segment(packet))
+    return messages
+
+
+REQUEST_A = b'GET /a HTTP/1.1\r\nHost: example.com\r\nUser-Agent: UA\r\n\r\n'
+REQUEST_B = b'POST /b HTTP/1.1\r\nHost: example.com\r\nContent-Length: 5\r\n\r\nhello'
+REQUEST_C = b'GET /c HTTP/1.1\r\nHost: example.org\r\n\r\n'
+
+
+class TestTCPReassembler(unittest.TestCase):
+    def setUp(self):
+        self.reassembler = TCPReassembler()
+        self.syn = segment(-1, flags=dpkt.tcp.TH_SYN)
+
+    def uris(self, messages):
+        return [message['uri'] for kind, message in messages if kind == 'http']
+
+    def test_split_and_pipelined_requests(self):
+        stream = REQUEST_A + REQUEST_B + REQUEST_C
+        cuts = [0, 10, 70, 75, len(stream)]
+        packets = [self.syn] + [segment(a, stream[a:b]) for a, b in zip(cuts, cuts[1:])]
+        self.assertEqual(self.uris(feed(self.reassembler, packets)), ['/a', '/b', '/c'])
+
+    def test_out_of_order_and_retransmits(self):
+        stream = REQUEST_A + REQUEST_C
+        half = 30
+        packets = [self.syn,
+                   segment(half, stream[half:]),      # arrives early
+                   segment(0, stream[:half]),
+                   segment(0, stream[:half]),         # full retransmit
+                   segment(10, stream[10:half + 5])]  # partial overlap
+        messages = feed(self.reassembler, packets)
+        self.assertEqual(self.uris(messages), ['/a', '/c'])
+        self.assertEqual(self.reassembler.stats['out_of_order'], 1)
+        self.assertEqual(self.reassembler.stats['retransmits'], 2)
+
+    def test_chunked_body(self):
+        body = b'Transfer-Encoding: chunked\r\n\r\n5\r\nhello\r\n0\r\n\r\n'
+        request = b'POST /upload HTTP/1.1\r\n' + body
+        parser = HTTPRequestParser()
+        messages, consumed = parser.feed(bytearray(request + REQUEST_C))
+        self.assertEqual([m['uri'] for m in messages], ['/upload', '/c'])
+        self.assertEqual(consumed, len(request + REQUEST_C))
+
+    def test_teardown(self):
+        feed(self.reassembler, [self.syn, segment(0, REQUEST_A, flags=dpkt.tcp.TH_ACK | dpkt.tcp.TH_FIN)])
+        self.assertEqual(len(self.reassembler), 1)
+        reply = segment(0, flags=dpkt.tcp.TH_ACK | dpkt.tcp.TH_FIN, client=SERVER, server=CLIENT)
+        feed(self.reassembler, [reply])
+        self.assertEqual(len(self.reassembler), 0)
+
+        feed(self.reassembler, [self.syn, segment(0, REQUEST_A[:10])])
+        feed(self.reassembler, [segment(10, flags=dpkt.tcp.TH_RST)])
+        self.assertEqual(len(self.reassembler), 0)
+
+    def test_buffered_fin_closes_after_gap_fills(self):
+        stream = REQUEST_A + REQUEST_C
+        fin = dpkt.tcp.TH_ACK | dpkt.tcp.TH_FIN
+        reply = segment(0, flags=fin, client=SERVER, server=CLIENT)
+        # The server closes first; the client's FIN arrives before the data preceding it
+        messages = feed(self.reassembler, [self.syn, reply, segment(30, stream[30:], flags=fin)])
+        self.assertEqual(len(self.reassembler), 1)
+        messages += feed(self.reassembler, [segment(0, stream[:30])])
+        self.assertEqual(self.uris(messages), ['/a', '/c'])
+        self.assertEqual(len(self.reassembler), 0)
+
+        # A bare FIN buffered behind a gap closes the direction once the gap is filled
+        feed(self.reassembler, [self.syn, segment(len(REQUEST_A), flags=fin), reply])
+        self.assertEqual(len(self.reassembler), 1)
+        feed(self.reassembler, [segment(0, REQUEST_A)])
+        self.assertEqual(len(self.reassembler), 0)
+
+    def test_header_split_into_many_segments(self):
+        request = b'GET /long HTTP/1.1\r\nHost: example.com\r\nX-Pad: ' + b'p' * 5000 + b'\r\n\r\n'
+        stream = request + REQUEST_C
+        packets = [self.syn] + [segment(i, stream[i:i + 7]) for i in range(0, len(stream), 7)]
+        self.assertEqual(self.uris(feed(self.reassembler, packets)), ['/long', '/c'])
+
+        # Each feed resumes the terminator search where the previous one stopped
+        parser = HTTPRequestParser()
+        self.assertEqual(parser.feed(bytearray(request[:3000])), ([], 0))
+        self.assertEqual(parser.scanned, 2997)
+        messages, consumed = parser.feed(bytearray(request))
+        self.assertEqual(([m['uri'] for m in messages], consumed, parser.scanned), (['/long'], len(request), 0))
+
+    def test_memory_bounds(self):
+        reassembler = TCPReassembler(max_buffer=64, max_out_of_order=100, idle_timeout=10)
+        # A request line that never ends is dropped once it outgrows the buffer cap
+        feed(reassembler, [self.syn, segment(0, b'GET /' + b'x' * 100)])
+        self.assertEqual(reassembler.buffered_bytes(), 0)
+        self.assertEqual(reassembler.stats['dropped_bytes'], 105)
+
+        # Out-of-order data beyond the cap is treated as a gap
+        other = ('10.0.0.3', 40001)
+        messages = feed(reassembler, [segment(-1, flags=dpkt.tcp.TH_SYN, client=other),
+                                      segment(200, REQUEST_C, client=other),
+                                      segment(200 + len(REQUEST_C), REQUEST_A + b'x' * 60, client=other)])
+        self.assertEqual(reassembler.stats['gaps'], 1)
+        self.assertEqual(self.uris(messages), ['/c', '/a'])
+
+        # Idle connections are evicted as capture time advances
+        feed(reassembler, [segment(0, b'GET', client=('10.0.0.4', 40002), seconds=100)])
+        self.assertEqual(len(reassembler), 1)
+
+    def test_dns_over_tcp(self):
+        query = bytes(dpkt.dns.DNS(id=1, qd=[dpkt.dns.DNS.Q(name='example.com', type=dpkt.dns.DNS_A)]))
+        framed = struct.pack('!H', len(query)) + query
+        server = ('10.0.0.53', 53)
+        packets = [segment(0, framed[:5], server=server), segment(5, framed[5:] + framed, server=server)]
+        messages = feed(self.reassembler, packets)
+        self.assertEqual([(kind, m['query']) for kind, m in messages], [('dns', 'example.com')] * 2)
+
+
+class TestDPIReassembly(unittest.TestCase):
+    def test_split_request_recorded_once(self):
+        stream = REQUEST_A + REQUEST_C
+        packets = [segment(-1, flags=dpkt.tcp.TH_SYN), segment(0, stream[:20]), segment(20, stream[20:])]
+        dpi = DPIAnalyzer(reassemble=True)
+        for packet in packets:
+            dpi.analyze_packet(packet)
+        self.assertEqual([r['uri'] for r in dpi.http_requests], ['/a', '/c'])
+        self.assertEqual(dpi.http_requests[0]['user_agent'], 'UA')
+
+        # Without reassembly the per-packet parser sees only the first segment's request line
+        plain = DPIAnalyzer()
+        for packet in packets:
+            plain.analyze_packet(packet)
+        self.assertEqual(len(plain.http_requests), 1)
+
+if __name__ == '__main__':
+    unittest.main()
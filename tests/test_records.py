@@ -0,0 +1,227 @@
+import os
+import pickle
+import tempfile
+import unittest
+from datetime import datetime
+
+import dpkt
+
+from analyzer.dpi_engine import DPIAnalyzer
+from analyzer.dpkt_reader import decode_packet
+from analyzer.records import RecordStore, DNSAggregates, HTTP_FIELDS
+from test_dpkt_reader import build_frame
+
+T0 = 1700000000.0
+
+
+def dns_packet(seconds, name, dns_id, response=False, rcode=dpkt.dns.DNS_RCODE_NOERR, client='10.0.0.1'):
+    msg = dpkt.dns.DNS(id=dns_id, qd=[dpkt.dns.DNS.Q(name=name, type=dpkt.dns.DNS_A)])
+    if response:
+        msg.qr = dpkt.dns.DNS_R
+        msg.rcode = rcode
+        udp = dpkt.udp.UDP(sport=53, dport=5000, data=bytes(msg))
+        frame = build_frame('10.0.0.53', client, udp)
+    else:
+        udp = dpkt.udp.UDP(sport=5000, dport=53, data=bytes(msg))
+        frame = build_frame(client, '10.0.0.53', udp)
+    return decode_packet(T0 + seconds, frame)
+
+
+class TestRecordStore(unittest.TestCase):
+    def test_records_round_trip(self):
+        store = RecordStore(HTTP_FIELDS)
+        store.add(datetime.fromtimestamp(T0), 'GET', '/a', 'example.com', 'UA')
+        store.append({'method': 'POST', 'uri': '/b', 'host': 'example.com', 'user_agent': 'UA',
+                      'timestamp': datetime.fromtimestamp(T0 + 1).isoformat()})
+
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store[0], {'method': 'GET', 'uri': '/a', 'host': 'example.com', 'user_agent': 'UA',
+                                    'timestamp': datetime.fromtimestamp(T0).isoformat()})
+        self.assertEqual(store[-1]['method'], 'POST')
+        self.assertEqual([record['uri'] for record in store], ['/a', '/b'])
+        self.assertEqual(store.epoch(1), T0 + 1)
+        # Repeated strings are stored once
+        self.assertEqual(len(store._values), 6)
+        with self.assertRaises(IndexError):
+            store[2]
+
+    def test_ring_buffer_keeps_newest_and_spills(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'spill.jsonl')
+            store = RecordStore(('query', 'response'), max_records=3, spill_path=path)
+            for i in range(5):
+                store.add(T0 + i, f'name{i}', i % 2)
+
+            self.assertEqual([record['query'] for record in store], ['name2', 'name3', 'name4'])
+            self.assertEqual([record['response'] for record in store], [False, True, False])
+            self.assertEqual(store[0]['query'], 'name2')
+            self.assertEqual(store.spilled, 2)
+            self.assertEqual((len(store), store.total), (3, 5))
+            self.assertEqual([record['query'] for record in store.iter_spilled()], ['name0', 'name1'])
+
+            # Spill files are reopened after unpickling
+            clone = pickle.loads(pickle.dumps(store))
+            clone.add(T0 + 5, 'name5', 0)
+            self.assertEqual([record['query'] for record in clone.iter_spilled()], ['name0', 'name1', 'name2'])
+            self.assertEqual(clone.total, 6)
+            store.close()
+            clone.close()
+            self.assertIsNone(clone._spill_file)
+
+    def test_compaction_drops_evicted_values(self):
+        store = RecordStore(('query',), max_records=2)
+        for i in range(2000):
+            store.add(T0 + i, f'name{i}')
+        self.assertLess(len(store._values), 4 * 2 + 1024 + 1)
+        self.assertEqual([record['query'] for record in store], ['name1998', 'name1999'])
+
+    def test_counted_fields_and_merge(self):
+        first = RecordStore(HTTP_FIELDS, counted=('host',))
+        second = RecordStore(HTTP_FIELDS, counted=('host',))
+        first.add(T0 + 2, 'GET', '/c', 'b.example', 'UA')
+        first.add(T0 + 3, 'GET', '/d', 'a.example', 'UA')
+        second.add(T0 + 1, 'GET', '/a', 'a.example', 'UA')
+        second.add(T0 + 4, 'GET', '/e', 'a.example', 'UA')
+
+        merged = first.merged(second)
+        self.assertEqual([record['uri'] for record in merged], ['/a', '/c', '/d', '/e'])
+        self.assertEqual(merged.top('host', 1), [('a.example', 3)])
+        self.assertEqual(first.merged(second).merged(merged).total, 8)
+        # Stores covering disjoint time ranges are concatenated in either order
+        later = RecordStore(HTTP_FIELDS)
+        later.add(T0 + 9, 'PUT', '/z', 'c.example', 'UA')
+        self.assertEqual([record['uri'] for record in later.merged(merged)], ['/a', '/c', '/d', '/e', '/z'])
+
+    def test_merge_appends_newer_records(self):
+        store = RecordStore(('query',), max_records=3, counted=('query',))
+        store.add(T0, 'a')
+        store.add(T0 + 1, 'b')
+        delta = RecordStore(('query',), counted=('query',))
+        delta.add(T0 + 2, 'a')
+        delta.add(T0 + 3, 'c')
+        columns = store._column_list
+
+        self.assertIs(store.merge(delta), store)
+        # Appended to the existing columns, oldest record dropped by the ring buffer
+        self.assertIs(store._column_list, columns)
+        self.assertEqual([record['query'] for record in store], ['b', 'a', 'c'])
+        self.assertEqual((store.total, store.top('query', 1)), (4, [('a', 2)]))
+
+        # An older delta is merged in timestamp order
+        late = RecordStore(('query',), counted=('query',))
+        late.add(T0 + 2.5, 'd')
+        self.assertEqual([record['query'] for record in store.merge(late)], ['a', 'd', 'c'])
+        self.assertEqual(store.total, 5)
+
+    def test_merge_spills_in_order(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'spill.jsonl')
+            first = RecordStore(('query',), max_records=2, spill_path=path)
+            second = RecordStore(('query',), max_records=2, spill_path=path)
+            for i in range(4):
+                first.add(T0 + 2 * i + 1, f'odd{2 * i + 1}')
+            second.add(T0 + 2, 'even2')
+            second.add(T0 + 4, 'even4')
+
+            merged = first.merged(second)
+            self.assertEqual([record['query'] for record in merged], ['odd5', 'odd7'])
+            # odd1 and odd3 were spilled before the merge, even2 and even4 while merging
+            self.assertEqual((merged.spilled, merged.total), (4, 6))
+            self.assertEqual([record['query'] for record in merged.iter_spilled()],
+                             ['odd1', 'even2', 'odd3', 'even4'])
+            # The source store keeps spilling to the same file
+            self.assertIsNotNone(first._spill_file)
+            first.close()
+            merged.close()
+
+    def test_sketch_counted_fields(self):
+        store = RecordStore(HTTP_FIELDS, counted=('host',), sketch_capacity=2)
+        for host in ['a', 'a', 'a', 'b', 'c', 'a']:
+            store.add(T0, 'GET', '/', host, '')
+        self.assertEqual(store.top('host', 1), [('a', 4)])
+
+
+class TestDNSAggregates(unittest.TestCase):
+    def test_latency_and_nxdomain(self):
+        stats = DNSAggregates()
+        stats.add(T0, 'a.example', False, dns_id=1, client='10.0.0.1')
+        stats.add(T0, 'b.example', False, dns_id=2, client='10.0.0.1')
+        stats.add(T0 + 0.004, 'a.example', True, dns_id=1, rcode=0, client='10.0.0.1')
+        stats.add(T0 + 0.030, 'b.example', True, dns_id=2, rcode=3, client='10.0.0.1')
+        # Unmatched response: different client
+        stats.add(T0 + 0.040, 'a.example', True, dns_id=1, rcode=0, client='10.0.0.9')
+
+        summary = stats.summary()
+        self.assertEqual(summary['queries'], 2)
+        self.assertEqual(summary['responses'], 3)
+        self.assertEqual(summary['matched'], 2)
+        self.assertAlmostEqual(summary['nxdomain_rate'], 1 / 3)
+        self.assertAlmostEqual(summary['mean_latency_ms'], 17.0, places=3)
+        self.assertAlmostEqual(summary['max_latency_ms'], 30.0, places=3)
+        self.assertEqual(summary['p50_latency_ms'], 5)
+        self.assertEqual(summary['p95_latency_ms'], 50)
+
+    def test_unanswered_queries_expire(self):
+        stats = DNSAggregates(max_pending=2, timeout=1.0)
+        for i in range(3):
+            stats.add(T0, f'name{i}', False, dns_id=i)
+        self.assertEqual(stats.unanswered, 1)
+        stats.add(T0 + 5, 'other', True, dns_id=99)
+        self.assertEqual(stats.unanswered, 3)
+        self.assertEqual(stats.summary()['pending'], 0)
+
+
+class TestDPIRecordStatistics(unittest.TestCase):
+    def test_dns_statistics(self):
+        dpi = DPIAnalyzer()
+        packets = [
+            dns_packet(0.0, 'example.com', 1),
+            dns_packet(0.1, 'missing.example', 2),
+            dns_packet(0.2, 'example.com', 3),
+            dns_packet(0.010, 'example.com', 1, response=True),
+            dns_packet(0.150, 'missing.example', 2, response=True, rcode=dpkt.dns.DNS_RCODE_NXDOMAIN),
+        ]
+        for packet in packets:
+            dpi.analyze_packet(packet)
+
+        stats = dpi.get_dns_statistics(top_n=1)
+        self.assertEqual(stats['top_queries'], {'example.com': 2})
+        self.assertEqual(stats['matched'], 2)
+        self.assertAlmostEqual(stats['nxdomain_rate'], 0.5)
+        self.assertAlmostEqual(stats['mean_latency_ms'], 30.0, places=3)
+        self.assertEqual(dpi.dns_queries[4]['rcode'], 3)
+        self.assertTrue(dpi.dns_queries[4]['response'])
+
+    def test_spill_dir_and_merge(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            first = DPIAnalyzer(max_records=2, spill_dir=tmp)
+            second = DPIAnalyzer(max_records=2)
+            for i in range(3):
+                first.analyze_packet(dns_packet(i, f'first{i}.example', i))
+                second.analyze_packet(dns_packet(i + 0.5, f'second{i}.example', i))
+
+            self.assertEqual([record['query'] for record in first.dns_queries.iter_spilled()],
+                             ['first0.example'])
+            first.merge(second)
+            self.assertEqual([record['query'] for record in first.dns_queries],
+                             ['first2.example', 'second2.example'])
+            self.assertEqual(first.get_dns_statistics()['queries'], 6)
+            self.assertEqual(first.dns_queries.total, 6)
+            first.dns_queries.close()
+
+    def test_http_request_count_includes_evicted(self):
+        dpi = DPIAnalyzer(max_records=2)
+        for i in range(5):
+            payload = f'GET /{i} HTTP/1.1\r\nHost: a.com\r\n\r\n'.encode()
+            tcp = dpkt.tcp.TCP(sport=40000 + i, dport=80, flags=dpkt.tcp.TH_ACK | dpkt.tcp.TH_PUSH,
+                               data=payload)
+            dpi.analyze_packet(decode_packet(T0 + i, build_frame('10.0.0.1', '10.0.0.2', tcp)))
+
+        stats = dpi.get_http_statistics()
+        self.assertEqual(len(dpi.http_requests), 2)
+        self.assertEqual((stats['requests'], stats['top_hosts']), (5, {'a.com': 5}))
+        self.assertEqual(dpi.merge(DPIAnalyzer()).get_http_statistics()['requests'], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
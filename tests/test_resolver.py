@@ -0,0 +1,121 @@
+import math
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from analyzer import utils
+from analyzer.resolver import ReverseResolver
+
+
+class FakeLookup:
+    def __init__(self, names, slow=(), delay=0.0):
+        self.names = names
+        self.slow = set(slow)
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, ip_address):
+        with self.lock:
+            self.calls.append(ip_address)
+        if ip_address in self.slow:
+            time.sleep(self.delay)
+        return self.names.get(ip_address)
+
+
+class TestReverseResolver(unittest.TestCase):
+    def setUp(self):
+        self.lookup = FakeLookup({'10.0.0.1': 'alpha.lan', '10.0.0.2': 'beta.lan'},
+                                 slow={'10.0.0.9'}, delay=0.3)
+        self.resolver = ReverseResolver(lookup=self.lookup, timeout=1.0)
+
+    def tearDown(self):
+        self.resolver.close()
+
+    def test_positive_and_negative_caching(self):
+        self.assertEqual(self.resolver.resolve('10.0.0.1'), 'alpha.lan')
+        self.assertEqual(self.resolver.resolve('10.0.0.3'), '10.0.0.3')
+        self.assertEqual(self.resolver.resolve('10.0.0.1'), 'alpha.lan')
+        self.assertEqual(self.resolver.resolve('10.0.0.3'), '10.0.0.3')
+        self.assertEqual(sorted(self.lookup.calls), ['10.0.0.1', '10.0.0.3'])
+        self.assertEqual(self.resolver.stats['hits'], 2)
+
+    def test_ttl_expiry(self):
+        resolver = ReverseResolver(lookup=self.lookup, ttl=60, negative_ttl=5)
+        resolver.resolve_many(['10.0.0.1', '10.0.0.3'])
+        now = time.monotonic()
+        with patch('analyzer.resolver.time.monotonic', return_value=now + 10):
+            resolver.resolve_many(['10.0.0.1', '10.0.0.3'])
+        self.assertEqual(self.lookup.calls.count('10.0.0.1'), 1)
+        self.assertEqual(self.lookup.calls.count('10.0.0.3'), 2)
+        resolver.close()
+
+    def test_lru_eviction(self):
+        resolver = ReverseResolver(max_size=2, lookup=self.lookup)
+        resolver.add('10.0.0.1', 'a')
+        resolver.add('10.0.0.2', 'b')
+        resolver.resolve('10.0.0.1')
+        resolver.add('10.0.0.4', 'd')
+        self.assertEqual(len(resolver), 2)
+        self.assertEqual(resolver.resolve_many(['10.0.0.1', '10.0.0.4']),
+                         {'10.0.0.1': 'a', '10.0.0.4': 'd'})
+        self.assertEqual(self.lookup.calls, [])
+
+    def test_deadline_and_background_completion(self):
+        started = time.monotonic()
+        results = self.resolver.resolve_many(['10.0.0.1', '10.0.0.9'], timeout=0.05)
+        self.assertLess(time.monotonic() - started, 0.25)
+        self.assertEqual(results, {'10.0.0.1': 'alpha.lan', '10.0.0.9': '10.0.0.9'})
+        self.assertEqual(self.resolver.stats['timeouts'], 1)
+        # The slow lookup keeps running and lands in the cache
+        time.sleep(0.4)
+        self.assertEqual(self.resolver.resolve('10.0.0.9'), '10.0.0.9')
+        self.assertEqual(self.lookup.calls.count('10.0.0.9'), 1)
+
+    def test_load_hosts(self):
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.write("# comment\n10.0.0.7 gamma.lan gamma\n\n::1 localhost  # loopback\n")
+        try:
+            self.assertEqual(self.resolver.load_hosts(path), 2)
+        finally:
+            os.remove(path)
+        with patch('analyzer.resolver.time.monotonic', return_value=math.inf):
+            self.assertEqual(self.resolver.resolve('10.0.0.7'), 'gamma.lan')
+        self.assertEqual(self.lookup.calls, [])
+
+    def test_pinned_entries_survive_eviction(self):
+        resolver = ReverseResolver(max_size=2, lookup=self.lookup)
+        resolver.add('10.0.0.7', 'gamma.lan', ttl=math.inf)
+        for i in range(10):
+            resolver.add(f'10.0.1.{i}', f'host{i}')
+        self.assertEqual(len(resolver), 3)
+        self.assertEqual(resolver.resolve('10.0.0.7'), 'gamma.lan')
+        self.assertEqual(self.lookup.calls, [])
+        # A finite TTL unpins the address
+        resolver.add('10.0.0.7', 'gamma2.lan')
+        resolver.add('10.0.1.20', 'x')
+        resolver.add('10.0.1.21', 'y')
+        self.assertEqual(len(resolver), 2)
+
+    def test_warm_bulk_resolution(self):
+        ips = [f'10.{i // 65536}.{i // 256 % 256}.{i % 256}' for i in range(10000)]
+        for ip in ips:
+            self.resolver.add(ip, 'host-' + ip)
+        started = time.perf_counter()
+        results = self.resolver.resolve_many(ips)
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual(len(results), 10000)
+        self.assertEqual(self.lookup.calls, [])
+
+    def test_utils_ip_to_hostname(self):
+        with patch.object(utils, '_resolver', self.resolver):
+            self.assertEqual(utils.ip_to_hostname('10.0.0.2'), 'beta.lan')
+            self.assertEqual(utils.ips_to_hostnames(['10.0.0.1', '10.0.0.5']),
+                             {'10.0.0.1': 'alpha.lan', '10.0.0.5': '10.0.0.5'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import json
+import os
+import pickle
+import tempfile
+import unittest
+
+import dpkt
+
+from analyzer.dpi_engine import DPIAnalyzer
+from analyzer.dpkt_reader import decode_packet
+from analyzer.fields import extract_fields
+from analyzer.signatures import AhoCorasick, Signature, SignatureEngine, load_signatures
+from test_dpkt_reader import build_frame, http_frame, dns_frame
+
+
+def tcp_packet(payload, sport=40000, dport=443, src='10.0.0.1', dst='10.0.0.2'):
+    tcp = dpkt.tcp.TCP(sport=sport, dport=dport, flags=dpkt.tcp.TH_ACK, data=payload)
+    return decode_packet(1700000000.0, build_frame(src, dst, tcp))
+
+
+class TestAhoCorasick(unittest.TestCase):
+    def test_overlapping_matches(self):
+        patterns = [b'he', b'she', b'his', b'hers']
+        matches = sorted(AhoCorasick(patterns).iter_matches(b'ushers'))
+        self.assertEqual(matches, [(0, 4), (1, 4), (3, 6)])
+
+    def test_limit(self):
+        automaton = AhoCorasick([b'abc'])
+        self.assertEqual(list(automaton.iter_matches(b'xxabc', limit=4)), [])
+        self.assertEqual(list(automaton.iter_matches(b'xxabc', limit=5)), [(0, 5)])
+
+
+class TestSignatureEngine(unittest.TestCase):
+    def test_default_application_signatures(self):
+        engine = SignatureEngine()
+        tls = engine.match(b'\x16\x03\x01\x02\x00\x01', 'tcp', 40000, 443)
+        self.assertEqual([s.application for s in tls], ['TLS'])
+        http = engine.match(b'GET / HTTP/1.1\r\nHost: a\r\n\r\n', 'tcp', 40000, 8080)
+        self.assertEqual([s.name for s in http], ['http-request'])
+        # Depth: the literal must be at the start of the payload
+        self.assertEqual(engine.match(b'xxxxxxxxxSSH-2.0', 'tcp', 1, 22), [])
+        # Port hint: SMB only on 139/445
+        self.assertEqual(engine.match(b'\x00\x00\x00\x2f\xffSMB', 'tcp', 40000, 8080), [])
+        self.assertEqual(len(engine.match(b'\x00\x00\x00\x2f\xffSMB', 'tcp', 40000, 445)), 1)
+        # Transport restriction
+        self.assertEqual(engine.match(b'SSH-2.0', 'udp', 1, 22), [])
+
+    def test_regex_confirms_literal(self):
+        engine = SignatureEngine([Signature('beacon', b'/gate.php', regex=rb'id=[0-9a-f]{8}')])
+        self.assertEqual(engine.match(b'GET /gate.php?x=1'), [])
+        self.assertEqual(len(engine.match(b'GET /gate.php?id=deadbeef')), 1)
+
+    def test_flow_classified_once(self):
+        engine = SignatureEngine()
+        hello = tcp_packet(b'\x16\x03\x01\x00\x05hello')
+        data = tcp_packet(b'\x16\x03\x03 more handshake')
+        reply = tcp_packet(b'\x16\x03\x03', sport=443, dport=40000, src='10.0.0.2', dst='10.0.0.1')
+        self.assertEqual(len(engine.scan(extract_fields(hello), hello.tcp.payload)), 1)
+        self.assertEqual(engine.scan(extract_fields(data), data.tcp.payload), [])
+        self.assertEqual(engine.scan(extract_fields(reply), reply.tcp.payload), [])
+        self.assertEqual(engine.get_hit_counts(), {'tls-handshake': 1})
+        self.assertEqual(engine.get_application_stats(), {'TLS': 1})
+        self.assertEqual(engine.classification('tcp', '10.0.0.2', 443, '10.0.0.1', 40000), 'TLS')
+
+    def test_indicators_do_not_classify(self):
+        engine = SignatureEngine([Signature('evil-ua', b'EvilAgent')], max_flow_packets=2)
+        packet = tcp_packet(b'User-Agent: EvilAgent')
+        for _ in range(3):
+            engine.scan(extract_fields(packet), packet.tcp.payload)
+        self.assertEqual(engine.get_hit_counts(), {'evil-ua': 2})
+
+    def test_pyshark_hex_payload(self):
+        from analyzer.signatures import payload_bytes
+        from types import SimpleNamespace
+        packet = SimpleNamespace(tcp=SimpleNamespace(payload='53:53:48:2d'))
+        self.assertEqual(payload_bytes(packet), b'SSH-')
+
+    def test_load_and_pickle(self):
+        fd, path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump([{'name': 'x', 'literals': ['marker'], 'ports': [9999], 'application': 'X'}], f)
+        try:
+            engine = SignatureEngine(load_signatures(path))
+        finally:
+            os.remove(path)
+        engine.match(b'')
+        clone = pickle.loads(pickle.dumps(engine))
+        self.assertEqual(len(clone.match(b'a marker', 'tcp', 1, 9999)), 1)
+        with self.assertRaises(ValueError):
+            engine.add(Signature('x', b'other'))
+
+
+class TestDPISignatures(unittest.TestCase):
+    def test_signature_matches_in_dpi(self):
+        dpi = DPIAnalyzer(signatures=SignatureEngine())
+        dpi.analyze_packet(decode_packet(1700000000.0, http_frame()))
+        dpi.analyze_packet(decode_packet(1700000001.0, dns_frame()))
+        self.assertEqual(dpi.get_signature_statistics(),
+                         {'hits': {'http-request': 1}, 'applications': {'HTTP': 1}})
+        self.assertEqual(dpi.signature_matches[0]['dstport'], '80')
+
+        other = DPIAnalyzer(signatures=SignatureEngine())
+        other.analyze_packet(tcp_packet(b'SSH-2.0-OpenSSH', dport=22))
+        dpi.merge(other)
+        self.assertEqual(dpi.get_signature_statistics()['applications'], {'HTTP': 1, 'SSH': 1})
+        self.assertEqual(len(dpi.signature_matches), 2)
+
+if __name__ == '__main__':
+    unittest.main()
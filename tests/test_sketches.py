@@ -0,0 +1,80 @@
+import random
+import unittest
+from collections import Counter
+from analyzer.sketches import SpaceSaving, HyperLogLog, DistinctCounter
+from analyzer.dpi_engine import DPIAnalyzer
+from analyzer.packet_analysis import PacketAnalyzer
+from test_packet_analysis import make_packet
+
+class TestSketches(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(7)
+        # A few heavy hitters hidden in a large spoofed-source tail
+        self.stream = ['10.0.0.%d' % (i % 5) for i in range(5000)]
+        self.stream += ['172.%d.%d.%d' % (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+                        for _ in range(20000)]
+        rng.shuffle(self.stream)
+
+    def test_space_saving_bounds(self):
+        summary = SpaceSaving(capacity=100)
+        for key in self.stream:
+            summary.add(key)
+        exact = Counter(self.stream)
+
+        self.assertEqual(len(summary), 100)
+        top = dict(summary.top(5))
+        self.assertEqual(set(top), {'10.0.0.%d' % i for i in range(5)})
+        bound = len(self.stream) // 100
+        for key, estimate in top.items():
+            self.assertGreaterEqual(estimate, exact[key])
+            self.assertLessEqual(estimate - exact[key], min(summary.error(key), bound))
+
+    def test_space_saving_merge(self):
+        first, second = SpaceSaving(100), SpaceSaving(100)
+        half = len(self.stream) // 2
+        for key in self.stream[:half]:
+            first.add(key)
+        for key in self.stream[half:]:
+            second.add(key)
+        first.merge(second)
+        self.assertEqual(first.total, len(self.stream))
+        self.assertEqual({key for key, _ in first.top(5)}, {'10.0.0.%d' % i for i in range(5)})
+
+    def test_hyperloglog_accuracy(self):
+        for cardinality in (5, 11, 1000, 50000):
+            sketch = HyperLogLog(precision=10)
+            for port in range(cardinality):
+                sketch.add(str(port))
+            sketch.add('1')
+            self.assertLess(abs(sketch.estimate() - cardinality) / cardinality, 0.1)
+        small = HyperLogLog()
+        for port in range(11):
+            small.add(str(port))
+        self.assertEqual(len(small), 11)
+
+    def test_distinct_counter_is_bounded(self):
+        counter = DistinctCounter(max_keys=50, precision=6)
+        for i, src in enumerate(self.stream):
+            counter.add(src, i % 1000)
+        self.assertLessEqual(len(counter), 50)
+        self.assertGreater(counter.cardinality('10.0.0.1'), 150)
+
+    def test_dpi_sketch_mode(self):
+        dpi = DPIAnalyzer(sketch_capacity=50)
+        for src in self.stream:
+            dpi.analyze_packet(make_packet(src, '10.9.9.9', 80))
+        ips = dpi.get_ip_statistics(top_n=3)
+        self.assertEqual(ips['10.9.9.9'], len(self.stream))
+        self.assertEqual(len(dpi.get_ip_statistics()), 50)
+        self.assertEqual(dpi.get_port_statistics(top_n=2), {'80': len(self.stream), '40000': len(self.stream)})
+
+    def test_analyzer_sketch_mode(self):
+        packets = [make_packet('10.0.0.9', '10.0.0.2', port) for port in range(40)]
+        packets += [make_packet(src, '10.0.0.3', 80) for src in self.stream[:2000]]
+        anomalies = PacketAnalyzer(sketch_capacity=100).detect_anomalies(packets)
+
+        self.assertAlmostEqual(anomalies['port_scans']['10.0.0.9'], 40, delta=2)
+        self.assertEqual(anomalies['possible_ddos'][0]['target'], '10.0.0.3')
+
+if __name__ == '__main__':
+    unittest.main()
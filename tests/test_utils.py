@@ -0,0 +1,66 @@
+import unittest
+
+from analyzer.dpi_engine import DPIAnalyzer
+from analyzer.utils import (is_private_ip, classify_ip, classify_ips, parse_ips,
+                            aggregate_subnets, PrefixTrie)
+from test_packet_analysis import make_packet
+
+
+class TestAddressClassification(unittest.TestCase):
+    ADDRESSES = ['10.0.0.1', '172.31.255.1', '8.8.8.8', '127.0.0.1', '224.0.0.5',
+                 '169.254.1.1', '100.64.3.3', '::1', 'fe80::1', 'fd00::5', '2001:db8::1',
+                 'not-an-ip']
+
+    def test_is_private_ip(self):
+        self.assertTrue(is_private_ip('192.168.1.1'))
+        self.assertTrue(is_private_ip('172.16.0.1'))
+        self.assertFalse(is_private_ip('172.32.0.1'))
+        self.assertTrue(is_private_ip('fd12::1'))
+        self.assertFalse(is_private_ip('not-an-ip'))
+        self.assertFalse(is_private_ip(None))
+
+    def test_classify_ips_matches_scalar(self):
+        classes = classify_ips(self.ADDRESSES, cidrs=['8.8.0.0/16', '2001:db8::/32'])
+        for index, address in enumerate(self.ADDRESSES):
+            expected = classify_ip(address)
+            for name in ('private', 'loopback', 'multicast', 'link_local', 'cgnat'):
+                self.assertEqual(bool(classes[name][index]), expected == name, (address, name))
+        self.assertEqual(classes['custom'].tolist(),
+                         [address in ('8.8.8.8', '2001:db8::1') for address in self.ADDRESSES])
+        self.assertEqual(classes['valid'].tolist(), [True] * 11 + [False])
+
+    def test_parse_ips(self):
+        high, low, valid = parse_ips(['1.2.3.4', '::1'])
+        self.assertEqual((int(high[0]), int(low[0])), (0, 0xFFFF01020304))
+        self.assertEqual((int(high[1]), int(low[1])), (0, 1))
+        self.assertTrue(valid.all())
+
+    def test_longest_prefix_match(self):
+        trie = PrefixTrie({'10.0.0.0/8': 'corp', '10.1.0.0/16': 'lab', '10.1.2.0/24': 'rack',
+                           '2001:db8::/32': 'v6', '2001:db8:0:1::/64': 'v6-lan'})
+        addresses = ['10.1.2.3', '10.1.9.9', '10.9.9.9', '11.0.0.1', '2001:db8:0:1::5', '2001:db8::5']
+        expected = ['rack', 'lab', 'corp', None, 'v6-lan', 'v6']
+        self.assertEqual(trie.lookup_many(addresses), expected)
+        self.assertEqual([trie.lookup(address) for address in addresses], expected)
+
+
+class TestSubnetAggregation(unittest.TestCase):
+    def test_aggregate_subnets(self):
+        counts = {'10.0.0.1': 3, '10.0.0.200': 2, '10.0.1.1': 1, '2001:db8:1:2::1': 4,
+                  '2001:db8:1:3::1': 2, 'bogus': 9}
+        self.assertEqual(aggregate_subnets(counts),
+                         {'2001:db8:1::/48': 6, '10.0.0.0/24': 5, '10.0.1.0/24': 1})
+        self.assertEqual(aggregate_subnets(counts, v4_prefix=16, top_n=1), {'10.0.0.0/16': 6})
+        self.assertEqual(aggregate_subnets(counts, v6_prefix=64), {'10.0.0.0/24': 5, '2001:db8:1:2::/64': 4,
+                                                                 '2001:db8:1:3::/64': 2, '10.0.1.0/24': 1})
+        self.assertEqual(aggregate_subnets({}), {})
+
+    def test_dpi_subnet_statistics(self):
+        for sketch_capacity in (None, 100):
+            dpi = DPIAnalyzer(sketch_capacity=sketch_capacity)
+            for host in range(1, 4):
+                dpi.analyze_packet(make_packet('192.168.1.%d' % host, '192.168.2.1', 80))
+            self.assertEqual(dpi.get_subnet_statistics(), {'192.168.2.0/24': 3, '192.168.1.0/24': 3})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from analyzer.engine import AnalysisEngine
+from analyzer.export import window_table
+from analyzer.visualization import (TrafficVisualizer, top_items, bucket_ports, bin_timeline,
+                                    ARGPARTITION_THRESHOLD)
+from test_packet_analysis import make_packet
+
+
+class TestVisualization(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_top_items(self):
+        small = {'a': 3, 'b': 9, 'c': 1}
+        self.assertEqual(top_items(small, 2), [('b', 9), ('a', 3)])
+        large = {f'10.0.{i // 256}.{i % 256}': i % 1000 for i in range(ARGPARTITION_THRESHOLD * 2)}
+        large['10.9.9.9'] = 5000
+        expected = sorted(large.items(), key=lambda item: item[1], reverse=True)[:5]
+        self.assertEqual([count for _, count in top_items(large, 5)], [count for _, count in expected])
+        self.assertEqual(top_items(large, 1), [('10.9.9.9', 5000)])
+
+    def test_bucket_ports(self):
+        stats = {'22': 5, '80': 1, '8080': 2, 49152: 4, '65000': 1, 'http': 7}
+        self.assertEqual(bucket_ports(stats), {'Well-known': 6, 'Registered': 2,
+                                               'Dynamic/Private': 5, 'Other': 7})
+
+    def test_bin_timeline(self):
+        start = datetime(2024, 1, 1)
+        timeline = [(start + timedelta(seconds=i), ('a', 'b')) for i in range(100)]
+        starts, counts, width = bin_timeline(timeline, max_points=10)
+        self.assertEqual(len(counts), 10)
+        self.assertEqual(counts.sum(), 100)
+        self.assertAlmostEqual(width, 9.9)
+        self.assertEqual(starts[0], start.timestamp())
+
+        # The exported per-window counts bin to the same totals
+        starts, counts, width = bin_timeline(window_table(timeline, 10), max_points=5)
+        self.assertEqual(counts.sum(), 100)
+        self.assertEqual(len(counts), 5)
+        _, counts, width = bin_timeline(timeline, window=50)
+        self.assertEqual((list(counts), width), ([50, 50], 50))
+        self.assertEqual(len(bin_timeline([])[1]), 0)
+
+    def test_render_report_to_files(self):
+        engine = AnalysisEngine().run(make_packet('10.0.0.1', '10.0.0.2', port, seconds=port)
+                                      for port in range(30))
+        written = TrafficVisualizer.render_report(engine, self.tmp.name, max_points=5)
+        self.assertEqual(set(written), {'protocols', 'top_ips', 'ports', 'timeline'})
+        for path in written.values():
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(8), b'\x89PNG\r\n\x1a\n')
+        # Rendering to files never touches pyplot, so it works without a display
+        self.assertNotIn('matplotlib.pyplot', sys.modules)
+        self.assertIsNone(TrafficVisualizer.plot_top_ips({}, output=os.path.join(self.tmp.name, 'x.png')))
+
+
+if __name__ == '__main__':
+    unittest.main()